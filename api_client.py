@@ -1,122 +1,287 @@
+import contextlib
+import io
+import json
 import os
+import re
+import uuid
 import requests
 
+from rate_limit import TokenBucket
+
+# Default Lucid REST API endpoint
+LUCID_API_URL = "https://api.lucid.co"
+
+# Content type of a Lucid standard import archive
+LUCID_IMPORT_CONTENT_TYPE = "x-application/vnd.lucid.standardImport"
+
+class MultipartBody:
+    """
+    multipart/form-data body for a document upload, produced in chunks
+    
+    The form fields and the archive are never joined into one bytes object: the
+    archive is read from its file in chunks while the body is sent, and the total
+    length is known up front so the request can carry a Content-Length header.
+    It can be read like a file (for requests) or iterated in chunks (for aiohttp).
+    """
+    
+    def __init__(self, fields, filename, fileobj, size, chunk_size=64 * 1024):
+        """
+        Initialize the multipart body
+        
+        Args:
+            fields (dict): Form fields sent before the file
+            filename (str): File name of the uploaded archive
+            fileobj (file-like): Binary file object positioned at the start of the archive
+            size (int): Size of the archive in bytes
+            chunk_size (int): Number of bytes read from the archive at a time
+        """
+        self.boundary = uuid.uuid4().hex
+        self.content_type = f"multipart/form-data; boundary={self.boundary}"
+        self.chunk_size = chunk_size
+        
+        head = []
+        for name, value in fields.items():
+            head.append(f"--{self.boundary}\r\n"
+                        f"Content-Disposition: form-data; name=\"{name}\"\r\n\r\n{value}\r\n")
+        head.append(f"--{self.boundary}\r\n"
+                    f"Content-Disposition: form-data; name=\"file\"; filename=\"{filename}\"\r\n"
+                    f"Content-Type: {LUCID_IMPORT_CONTENT_TYPE}\r\n\r\n")
+        self._head = "".join(head).encode("utf-8")
+        self._tail = f"\r\n--{self.boundary}--\r\n".encode("utf-8")
+        self._fileobj = fileobj
+        self._file_remaining = size
+        
+        # requests takes the Content-Length of file-like bodies from this attribute
+        self.len = len(self._head) + size + len(self._tail)
+        self._pending = self._head
+    
+    def __len__(self):
+        return self.len
+    
+    def read(self, size=-1):
+        """
+        Read the next part of the body
+        
+        Args:
+            size (int): Maximum number of bytes to return, or -1 for the rest of the body
+            
+        Returns:
+            bytes: The next bytes of the body, empty at the end
+        """
+        if size is None or size < 0:
+            return b"".join(iter(lambda: self.read(self.chunk_size), b""))
+        
+        if not self._pending:
+            if self._file_remaining > 0:
+                self._pending = self._fileobj.read(min(size, self._file_remaining))
+                if not self._pending:
+                    raise ValueError("Lucid archive is shorter than its declared size")
+                self._file_remaining -= len(self._pending)
+            elif self._tail:
+                self._pending, self._tail = self._tail, b""
+        
+        chunk, self._pending = self._pending[:size], self._pending[size:]
+        return chunk
+    
+    def __iter__(self):
+        return iter(lambda: self.read(self.chunk_size), b"")
+
+@contextlib.contextmanager
+def open_lucid_source(lucid_file, filename=None):
+    """
+    Open a .lucid archive given as a path, as bytes or as a binary buffer
+    
+    Args:
+        lucid_file (str, bytes or file-like): Path to the .lucid file, the archive
+            contents, or a binary buffer positioned at the start of the archive
+        filename (str): File name sent with the archive; defaults to the file's base name
+        
+    Yields:
+        tuple: (binary file object, size in bytes, file name)
+    """
+    if isinstance(lucid_file, (str, os.PathLike)):
+        # Check if the file exists
+        if not os.path.exists(lucid_file):
+            raise FileNotFoundError(f"Lucid file not found: {lucid_file}")
+        with open(lucid_file, 'rb') as file:
+            yield file, os.path.getsize(lucid_file), filename or os.path.basename(lucid_file)
+    elif isinstance(lucid_file, (bytes, bytearray, memoryview)):
+        yield io.BytesIO(lucid_file), memoryview(lucid_file).nbytes, filename or "document.lucid"
+    else:
+        # Upload the rest of the buffer and leave it where it was, so it can be retried
+        start = lucid_file.tell()
+        size = lucid_file.seek(0, io.SEEK_END) - start
+        lucid_file.seek(start)
+        try:
+            yield lucid_file, size, filename or os.path.basename(getattr(lucid_file, "name", "") or "document.lucid")
+        finally:
+            lucid_file.seek(start)
+
+def parse_upload_response(response_json):
+    """
+    Extract the document ID and URL from a successful upload response
+    
+    Args:
+        response_json (dict): The JSON body returned by POST /documents
+        
+    Returns:
+        dict: The upload result with "message" and, when available, "document_id" and "document_url"
+    """
+    document_id = response_json.get("id") or response_json.get("documentId")
+    
+    if not document_id:
+        print(f"Full API response: {response_json}")
+        document_url = response_json.get("editUrl") or response_json.get("viewUrl")
+        if document_url:
+            # Extract document ID from URL if present
+            match = re.search(r'/([0-9a-f-]+)/(?:edit|view)$', document_url)
+            if match:
+                document_id = match.group(1)
+    
+    if document_id:
+        return {
+            "document_id": document_id,
+            "message": "Document uploaded successfully",
+            "document_url": f"https://lucid.app/documents/{document_id}"
+        }
+    else:
+        # If we can't find an ID but the upload succeeded, return the response
+        edit_url = response_json.get("editUrl")
+        if edit_url:
+            return {
+                "message": "Document uploaded successfully",
+                "document_url": edit_url
+            }
+        else:
+            return {
+                "message": "Document uploaded successfully, but no URL was returned",
+                "api_response": response_json
+            }
+
+def api_error_message(status, text):
+    """
+    Build the error message for a failed request from the status and response body
+    
+    Args:
+        status (int): HTTP status code
+        text (str): Response body
+        
+    Returns:
+        str: The status followed by the API's message, or the start of the body
+    """
+    try:
+        message = json.loads(text).get("message")
+    except (ValueError, AttributeError):
+        message = None
+    return f"{status} {message or text[:200]}"
+
+class LucidApiError(Exception):
+    """
+    Error returned by the Lucid API
+    
+    The message keeps the "API Error: ..." form; status and retry_after let
+    callers such as the upload spool tell rate limiting apart from other errors.
+    """
+    
+    def __init__(self, message, status=None, retry_after=None):
+        """
+        Initialize the error
+        
+        Args:
+            message (str): The error message
+            status (int): HTTP status code, or None if no response was received
+            retry_after (float): Seconds the API asked to wait before retrying, if any
+        """
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
 class LucidApiClient:
     """
     Client for interacting with the Lucid API
     """
     
-    def __init__(self, api_key):
+    def __init__(self, api_key, base_url=LUCID_API_URL, requests_per_second=None, burst=1,
+                 max_rate_limit_retries=3):
         """
         Initialize the Lucid API client
         
         Args:
             api_key (str): The API key to use for authentication
+            base_url (str): Base URL of the Lucid API, e.g. a local mock server for load tests
+            requests_per_second (float): Maximum request rate, or None to only slow down when rate limited
+            burst (int): Maximum number of requests sent at once before pacing applies
+            max_rate_limit_retries (int): Times a rate limited (429) request is retried after waiting
         """
         if not api_key:
             raise ValueError("API key is required")
             
         self.api_key = api_key
-        self.base_url = "https://api.lucid.co"
+        self.base_url = base_url.rstrip("/")
+        self.max_rate_limit_retries = max_rate_limit_retries
+        # Shared by all threads using the client, e.g. the pipeline's upload workers
+        self.rate_limiter = TokenBucket(requests_per_second, burst)
         
-    def upload_document(self, lucid_file_path, title):
+    def upload_document(self, lucid_file, title, filename=None):
         """
         Upload a document to Lucid
         
+        Requests are paced by the client's rate limiter. A 429 response is
+        retried after the Retry-After period, up to max_rate_limit_retries times.
+        
         Args:
-            lucid_file_path (str): Path to the .lucid file
+            lucid_file (str, bytes or file-like): Path to the .lucid file, the archive
+                contents, or a binary buffer positioned at the start of the archive
             title (str): Title for the document
+            filename (str): File name sent with the archive; defaults to the file's base name
             
         Returns:
             dict: The API response
         """
-        # Check if the file exists
-        if not os.path.exists(lucid_file_path):
-            raise FileNotFoundError(f"Lucid file not found: {lucid_file_path}")
-        
         # Define the URL and headers for the direct upload
         url = f"{self.base_url}/documents"
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Lucid-Api-Version": "1"
-            # Content-Type is set automatically by requests when using files
-        }
         
         print(f"\nUploading to Lucid API: {url}")
         print(f"Headers: Authorization: Bearer {self.api_key[:10]}... (truncated)")
         print(f"Lucid-Api-Version: 1")
         
-        try:
-            # Use multipart/form-data to upload the file directly to /documents endpoint
-            with open(lucid_file_path, 'rb') as file:
-                # Define the form data as specified in the documentation
-                files = {
-                    'file': (
-                        os.path.basename(lucid_file_path), 
-                        file, 
-                        'x-application/vnd.lucid.standardImport'
-                    )
-                }
-                data = {
-                    'title': title,
-                    'product': 'lucidchart'
-                }
-                
-                print(f"File size: {os.path.getsize(lucid_file_path)} bytes")
-                print(f"Sending form data: title={title}, product=lucidchart")
-                
-                # Send the POST request
-                response = requests.post(url, headers=headers, files=files, data=data)
-                
-                # Print response details for debugging
-                print(f"\nAPI Response Status Code: {response.status_code}")
-                print(f"API Response Content: {response.text[:200]}...")  # Truncate long responses
-                
-                # Raise exception if response status is not successful (200-299)
-                response.raise_for_status()
-                
-                # Extract the document ID or URL from the response
-                response_json = response.json()
-                document_id = response_json.get("id") or response_json.get("documentId")
-                
-                if not document_id:
-                    print(f"Full API response: {response_json}")
-                    document_url = response_json.get("editUrl") or response_json.get("viewUrl")
-                    if document_url:
-                        # Extract document ID from URL if present
-                        import re
-                        match = re.search(r'/([0-9a-f-]+)/(?:edit|view)$', document_url)
-                        if match:
-                            document_id = match.group(1)
-                
-                if document_id:
-                    return {
-                        "document_id": document_id,
-                        "message": "Document uploaded successfully",
-                        "document_url": f"https://lucid.app/documents/{document_id}"
+        for attempt in range(self.max_rate_limit_retries + 1):
+            self.rate_limiter.acquire()
+            
+            try:
+                # Use multipart/form-data to upload the file directly to /documents endpoint
+                with open_lucid_source(lucid_file, filename) as (file, size, source_filename):
+                    # Define the form data as specified in the documentation; the archive is
+                    # streamed from the file or buffer rather than copied into the request
+                    body = MultipartBody({'title': title, 'product': 'lucidchart'}, source_filename, file, size)
+                    headers = {
+                        "Authorization": f"Bearer {self.api_key}",
+                        "Lucid-Api-Version": "1",
+                        "Content-Type": body.content_type
                     }
-                else:
-                    # If we can't find an ID but the upload succeeded, return the response
-                    edit_url = response_json.get("editUrl")
-                    if edit_url:
-                        return {
-                            "message": "Document uploaded successfully",
-                            "document_url": edit_url
-                        }
-                    else:
-                        return {
-                            "message": "Document uploaded successfully, but no URL was returned",
-                            "api_response": response_json
-                        }
-                
-        except requests.exceptions.RequestException as e:
-            # Handle API errors
-            error_message = str(e)
-            if hasattr(e, 'response') and e.response is not None:
-                try:
-                    error_data = e.response.json()
-                    error_message = error_data.get('message', str(e))
-                except:
-                    pass
+                    
+                    print(f"File size: {size} bytes")
+                    print(f"Sending form data: title={title}, product=lucidchart")
+                    
+                    # Send the POST request
+                    response = requests.post(url, headers=headers, data=body)
+            except requests.exceptions.RequestException as e:
+                raise LucidApiError(f"API Error: {str(e)}")
             
-            raise Exception(f"API Error: {error_message}")
+            # Print response details for debugging
+            print(f"\nAPI Response Status Code: {response.status_code}")
+            print(f"API Response Content: {response.text[:200]}...")  # Truncate long responses
+            
+            retry_after = self.rate_limiter.on_response(response.status_code, response.headers)
+            if response.status_code == 429 and attempt < self.max_rate_limit_retries:
+                print(f"Rate limited by the Lucid API; retrying in {retry_after:.1f} s")
+                continue
+            break
+        
+        # Raise exception if response status is not successful (200-299)
+        if response.status_code >= 400:
+            raise LucidApiError(f"API Error: {api_error_message(response.status_code, response.text)}",
+                                response.status_code, retry_after)
+        
+        # Extract the document ID or URL from the response
+        return parse_upload_response(response.json())
@@ -0,0 +1,184 @@
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from api_client import (LUCID_API_URL, LucidApiError, MultipartBody, api_error_message, open_lucid_source,
+                        parse_upload_response)
+from rate_limit import TokenBucket
+
+
+class AsyncLucidApiClient:
+    """
+    asyncio client uploading many documents to Lucid concurrently
+
+    At most max_concurrency uploads are in flight at a time, paced by the same
+    adaptive token bucket as LucidApiClient. Each request body is streamed from
+    the .lucid file or buffer in chunks (see MultipartBody), so concurrent
+    uploads do not copy whole archives into their requests. An upload waiting
+    for the rate limit or a Retry-After pause does not hold one of the slots. Uses aiohttp when
+    it is installed; otherwise each request is sent with requests in a worker
+    thread.
+    """
+
+    def __init__(self, api_key, base_url=LUCID_API_URL, max_concurrency=4, chunk_size=64 * 1024,
+                 requests_per_second=None, burst=1, max_rate_limit_retries=3):
+        """
+        Initialize the asynchronous Lucid API client
+
+        Args:
+            api_key (str): The API key to use for authentication
+            base_url (str): Base URL of the Lucid API, e.g. a local mock server for load tests
+            max_concurrency (int): Maximum number of uploads in flight at a time
+            chunk_size (int): Number of bytes of the archive sent at a time
+            requests_per_second (float): Maximum request rate, or None to only slow down when rate limited
+            burst (int): Maximum number of requests sent at once before pacing applies
+            max_rate_limit_retries (int): Times a rate limited (429) request is retried after waiting
+        """
+        if not api_key:
+            raise ValueError("API key is required")
+        if max_concurrency < 1:
+            raise ValueError("max_concurrency must be at least 1")
+
+        self.api_key = api_key
+        self.base_url = base_url.rstrip("/")
+        self.max_concurrency = max_concurrency
+        self.chunk_size = chunk_size
+        self.max_rate_limit_retries = max_rate_limit_retries
+        self.rate_limiter = TokenBucket(requests_per_second, burst)
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._session = None
+        self._threads = None
+
+        try:
+            import aiohttp
+            self._aiohttp = aiohttp
+        except ImportError:
+            self._aiohttp = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def close(self):
+        """
+        Close the HTTP session or worker threads, if any were started
+        """
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+        if self._threads is not None:
+            self._threads.shutdown(wait=False)
+            self._threads = None
+
+    async def upload_document(self, lucid_file, title, filename=None):
+        """
+        Upload a document to Lucid, waiting for a free slot if max_concurrency uploads are in flight
+
+        Args:
+            lucid_file (str, bytes or file-like): Path to the .lucid file, the archive
+                contents, or a binary buffer positioned at the start of the archive
+            title (str): Title for the document
+            filename (str): File name sent with the archive; defaults to the file's base name
+
+        Returns:
+            dict: The upload result, as returned by LucidApiClient.upload_document
+        """
+        for attempt in range(self.max_rate_limit_retries + 1):
+            # Wait for the rate limit without holding a slot, so other uploads can use it
+            await self._acquire_slot(self.rate_limiter.reserve())
+            try:
+                with open_lucid_source(lucid_file, filename) as (file, size, source_filename):
+                    body = MultipartBody({"title": title, "product": "lucidchart"}, source_filename, file, size,
+                                         self.chunk_size)
+                    if self._aiohttp is not None:
+                        status, text, headers = await self._post_aiohttp(body)
+                    else:
+                        # The default executor may have fewer threads than max_concurrency
+                        if self._threads is None:
+                            self._threads = ThreadPoolExecutor(self.max_concurrency,
+                                                               thread_name_prefix="lucid-upload")
+                        status, text, headers = await asyncio.get_running_loop().run_in_executor(
+                            self._threads, self._post_blocking, body)
+            finally:
+                self._semaphore.release()
+
+            retry_after = self.rate_limiter.on_response(status, headers)
+            if status != 429 or attempt == self.max_rate_limit_retries:
+                break
+
+        if status >= 400:
+            raise LucidApiError(f"API Error: {api_error_message(status, text)}", status, retry_after)
+        return parse_upload_response(json.loads(text))
+
+    async def upload_documents(self, uploads):
+        """
+        Upload several documents concurrently
+
+        Args:
+            uploads (list): List of (lucid_file, title) or (lucid_file, title, filename) tuples,
+                lucid_file being a path, bytes or buffer
+
+        Returns:
+            list: One entry per upload, in order: the upload result, or the exception it raised
+        """
+        return await asyncio.gather(*(self.upload_document(*upload) for upload in uploads),
+                                    return_exceptions=True)
+
+    async def _acquire_slot(self, wait):
+        """
+        Wait out a rate limit reservation, then take one of the max_concurrency upload slots
+
+        Args:
+            wait (float): Seconds to wait before sending, as returned by TokenBucket.reserve
+        """
+        while True:
+            while wait > 0:
+                await asyncio.sleep(wait)
+                wait = self.rate_limiter.pause_remaining()
+            await self._semaphore.acquire()
+            # The API may have asked for a pause while this upload waited for a slot
+            wait = self.rate_limiter.pause_remaining()
+            if wait <= 0:
+                return
+            self._semaphore.release()
+
+    def _headers(self, body):
+        return {
+            "Authorization": f"Bearer {self.api_key}",
+            "Lucid-Api-Version": "1",
+            "Content-Type": body.content_type,
+            "Content-Length": str(body.len)
+        }
+
+    async def _post_aiohttp(self, body):
+        if self._session is None:
+            self._session = self._aiohttp.ClientSession()
+
+        # Read the archive in a worker thread, so file reads do not block the event loop
+        async def chunks():
+            loop = asyncio.get_running_loop()
+            while True:
+                chunk = await loop.run_in_executor(None, body.read, self.chunk_size)
+                if not chunk:
+                    return
+                yield chunk
+
+        try:
+            async with self._session.post(f"{self.base_url}/documents", data=chunks(),
+                                          headers=self._headers(body)) as response:
+                return response.status, await response.text(), response.headers
+        except self._aiohttp.ClientError as e:
+            raise LucidApiError(f"API Error: {str(e)}")
+
+    def _post_blocking(self, body):
+        try:
+            # requests streams file-like bodies and takes the Content-Length from body.len
+            response = requests.post(f"{self.base_url}/documents", data=body, headers=self._headers(body))
+        except requests.exceptions.RequestException as e:
+            raise LucidApiError(f"API Error: {str(e)}")
+        return response.status_code, response.text, response.headers
+
@@ -0,0 +1,89 @@
+import pandas as pd
+
+from excel_reader import RULE_KEY_COLUMNS, merge_ports_values
+
+# Diff statuses, in the order they are reported
+CHANGE_TYPES = ["added", "removed", "changed"]
+
+
+def merge_changes(changes):
+    """
+    Combine the diff statuses of rules merged into one rule
+
+    Args:
+        changes (list): Diff statuses ("added", "removed", "changed", "unchanged")
+
+    Returns:
+        str: "unchanged" if no rule changed, the status of the changed rules if
+            they all share one, and "changed" for any other mix
+    """
+    changes = set(changes) - {"unchanged"}
+    if not changes:
+        return "unchanged"
+    if len(changes) == 1:
+        return next(iter(changes))
+    return "changed"
+
+
+# How the diff columns of rules merged by normalize_rules are combined, e.g. when
+# level-of-detail mode collapses the entities of a diff
+DIFF_COLUMN_MERGERS = {"Change": merge_changes, "Old Ports": merge_ports_values}
+
+
+def diff_rules(old_df, new_df):
+    """
+    Compare two sets of normalized rules
+
+    Rules are matched on their rule key (software type, endpoints and protocol)
+    with a single outer join, so the cost is linear in the number of rules. A
+    rule only in the new rules is "added", only in the old rules "removed", and
+    in both with different ports "changed".
+
+    Args:
+        old_df (pd.DataFrame): Normalized rules of the old workbook
+        new_df (pd.DataFrame): Normalized rules of the new workbook
+
+    Returns:
+        pd.DataFrame: The union of both rule sets with the new values (the old
+            ones for removed rules), an "Old Ports" column and a "Change" column
+    """
+    # Both sides are normalized, so every rule key occurs at most once per side
+    merged = pd.merge(old_df, new_df, on=RULE_KEY_COLUMNS, how="outer",
+                      suffixes=(" (old)", ""), indicator=True, validate="one_to_one")
+
+    # Take the other columns from the new rule, or from the old one for removed rules
+    removed = merged["_merge"] == "left_only"
+    for column in new_df.columns:
+        old_column = f"{column} (old)"
+        if old_column in merged.columns:
+            merged.loc[removed, column] = merged.loc[removed, old_column]
+
+    old_ports = merged["Ports (old)"]
+    ports_changed = (old_ports.fillna("") != merged["Ports"].fillna("")) & (merged["_merge"] == "both")
+
+    merged["Change"] = "unchanged"
+    merged.loc[merged["_merge"] == "right_only", "Change"] = "added"
+    merged.loc[removed, "Change"] = "removed"
+    merged.loc[ports_changed, "Change"] = "changed"
+    merged["Old Ports"] = old_ports
+
+    return merged[list(new_df.columns) + ["Old Ports", "Change"]]
+
+
+def summarize_diff(diff):
+    """
+    Count the added, removed and changed rules of each software type
+
+    Args:
+        diff (pd.DataFrame): Rules returned by diff_rules
+
+    Returns:
+        dict: Mapping of affected software types to {"added": n, "removed": n, "changed": n},
+            leaving out software types whose rules did not change
+    """
+    counts = diff[diff["Change"] != "unchanged"].groupby(["Software Type", "Change"]).size()
+
+    summary = {}
+    for (software_type, change), count in counts.items():
+        summary.setdefault(software_type, {change_type: 0 for change_type in CHANGE_TYPES})[change] = count
+    return dict(sorted(summary.items()))
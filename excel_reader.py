@@ -1,6 +1,9 @@
 import pandas as pd
 import os
+import re
+import time
 import warnings
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 # Suppress specific openpyxl warnings about data validation
 warnings.filterwarnings("ignore", 
@@ -64,6 +67,389 @@ def read_excel_data(file_path):
     except Exception as e:
         raise Exception(f"Error reading Excel file: {str(e)}")
 
+# Columns every rules sheet must have
+REQUIRED_COLUMNS = ["Software Type", "Source", "Destination",
+                    "Source AZ (Used for Diagram Generation)",
+                    "Destination AZ (Used for Diagram Generation)"]
+
+def _clean_chunk(rows, columns):
+    """
+    Build a DataFrame from a chunk of sheet rows and drop rows missing key values
+    """
+    chunk = pd.DataFrame(rows, columns=columns)
+    missing_columns = [col for col in REQUIRED_COLUMNS if col not in chunk.columns]
+    if missing_columns:
+        raise ValueError(f"Missing required columns: {', '.join(missing_columns)}")
+    return chunk.dropna(subset=["Software Type", "Source", "Destination"])
+
+def read_excel_data_streaming(file_path, chunk_size=5000):
+    """
+    Read the "External Ports" sheet in read-only streaming mode
+    
+    Only the rules sheet is opened, without styles or data validations, and its
+    rows are converted and cleaned in chunks of chunk_size rows, so memory use
+    does not grow with the size of the rest of the workbook.
+    
+    Args:
+        file_path (str): Path to the Excel file
+        chunk_size (int): Number of rows converted at a time
+        
+    Returns:
+        pd.DataFrame: DataFrame containing the Excel data
+    """
+    if not os.path.exists(file_path):
+        raise FileNotFoundError(f"Excel file not found: {file_path}")
+    
+    from openpyxl import load_workbook
+    
+    try:
+        workbook = load_workbook(file_path, read_only=True, data_only=True)
+        try:
+            if "External Ports" not in workbook.sheetnames:
+                raise ValueError("Worksheet named 'External Ports' not found")
+            rows = workbook["External Ports"].iter_rows(values_only=True)
+            
+            # The header is the first of the top rows holding every required column;
+            # rows above it might contain instructions
+            columns = None
+            for skip_rows, row in enumerate(rows):
+                header = [f"Unnamed: {i}" if value is None else str(value) for i, value in enumerate(row)]
+                if all(col in header for col in REQUIRED_COLUMNS):
+                    columns = header
+                    if skip_rows:
+                        print(f"Successfully read Excel file by skipping {skip_rows} rows")
+                    break
+                if skip_rows >= 5:
+                    break
+            if columns is None:
+                raise ValueError("Could not find required columns in the Excel file")
+            
+            # Convert and clean the rows one chunk at a time
+            chunks = []
+            buffer = []
+            for row in rows:
+                if any(value is not None for value in row):
+                    buffer.append(row[:len(columns)])
+                if len(buffer) >= chunk_size:
+                    chunks.append(_clean_chunk(buffer, columns))
+                    buffer = []
+            if buffer or not chunks:
+                chunks.append(_clean_chunk(buffer, columns))
+        finally:
+            workbook.close()
+        
+        return pd.concat(chunks, ignore_index=True)
+    except Exception as e:
+        raise Exception(f"Error reading Excel file: {str(e)}")
+
+def _read_tagged_workbook(file_path, streaming):
+    """
+    Read a workbook and tag every row with the name of the file it came from
+    
+    The time spent reading is kept in df.attrs["read_seconds"].
+    """
+    started = time.perf_counter()
+    df = read_excel_data_streaming(file_path) if streaming else read_excel_data(file_path)
+    df["Source File"] = os.path.basename(file_path)
+    df.attrs["read_seconds"] = time.perf_counter() - started
+    return df
+
+def read_workbooks(file_paths, max_workers=None, streaming=False):
+    """
+    Read several workbooks concurrently in a process pool
+    
+    Workbooks are yielded as soon as each one has been read, so a slow workbook
+    does not hold up processing of the others. Every row gets a "Source File"
+    column naming the workbook it came from.
+    
+    Args:
+        file_paths (list): Paths to the Excel files
+        max_workers (int): Number of worker processes; None uses one per CPU
+        streaming (bool): Read in read-only streaming mode
+        
+    Yields:
+        tuple: (file_path, DataFrame, error) where error is the exception raised
+            while reading the workbook, or None
+    """
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(_read_tagged_workbook, path, streaming): path for path in file_paths}
+        for future in as_completed(futures):
+            try:
+                yield futures[future], future.result(), None
+            except Exception as e:
+                yield futures[future], None, e
+
+# Columns that identify a rule; rules sharing all of them differ only in their ports
+RULE_KEY_COLUMNS = ["Software Type", "Source", "Source AZ (Used for Diagram Generation)",
+                    "Destination", "Destination AZ (Used for Diagram Generation)", "Transfer Protocol"]
+
+# Preferred order of protocols in combined values such as "TCP/UDP"
+PROTOCOL_ORDER = ["TCP", "UDP", "ICMP"]
+
+# Ports values meaning every port, besides a blank cell
+ANY_PORT_TOKENS = {"any", "all", "*"}
+
+# Separator for the distinct notes of merged rows
+MERGED_TEXT_SEPARATOR = "; "
+
+def _clean_text(value):
+    """
+    Trim and collapse whitespace in a cell value, leaving missing values as None
+    """
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return None
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    text = " ".join(str(value).split())
+    return text or None
+
+def _normalize_protocol(value):
+    """
+    Parse a protocol value such as "tcp / udp" into a canonical "TCP/UDP" form
+    
+    Returns:
+        str: The canonical protocol, or None if the value is missing
+    """
+    text = _clean_text(value)
+    if text is None:
+        return None
+    
+    protocols = {p for p in re.split(r"[/,&+\s]+|\band\b", text.upper()) if p}
+    known = [p for p in PROTOCOL_ORDER if p in protocols]
+    return "/".join(known + sorted(protocols - set(known)))
+
+def _parse_ports(value):
+    """
+    Parse a ports value into merged numeric ranges and any non-numeric tokens
+    
+    A blank value, or one naming every port ("any", "all" or "*"), allows all
+    ports.
+    
+    Returns:
+        tuple: (list of (start, end) ranges, set of other tokens, whether all ports are allowed)
+    """
+    ranges = []
+    others = set()
+    
+    text = _clean_text(value)
+    if text is None:
+        return ranges, others, True
+    
+    any_port = False
+    for token in text.split(","):
+        token = token.strip()
+        match = re.fullmatch(r"(\d+)\s*-\s*(\d+)|(\d+)", token)
+        if match and match.group(3):
+            ranges.append((int(match.group(3)), int(match.group(3))))
+        elif match:
+            start, end = int(match.group(1)), int(match.group(2))
+            ranges.append((min(start, end), max(start, end)))
+        elif token.casefold() in ANY_PORT_TOKENS:
+            any_port = True
+        elif token:
+            others.add(token)
+    
+    return ranges, others, any_port
+
+def _merge_ranges(ranges):
+    """
+    Merge overlapping or adjacent port ranges
+    """
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+def _format_ports(rule):
+    """
+    Format the merged ports of a rule as a comma-separated ports value
+    
+    A rule allowing all ports stays blank if all its rows were blank, and is
+    "any" once it absorbed rows naming ports, so those rows stay visible as
+    a rule for every port rather than disappearing.
+    """
+    if rule["any_port"]:
+        return "any" if rule["ranges"] or rule["others"] or not rule["blank"] else None
+    tokens = [str(start) if start == end else f"{start}-{end}" for start, end in rule["ranges"]]
+    return ", ".join(tokens + sorted(rule["others"])) or None
+
+def _ranges_cover(outer, inner):
+    """
+    Check whether the merged ranges in outer contain every range in inner
+    """
+    return all(any(o_start <= start and end <= o_end for o_start, o_end in outer)
+               for start, end in inner)
+
+def _rule_covers(outer, inner):
+    """
+    Check whether the ports of rule outer include every port of rule inner
+    
+    A rule allowing all ports is only covered by another rule allowing all
+    ports. Ports that are not numbers are only covered by the same tokens.
+    """
+    if outer["any_port"]:
+        return True
+    if inner["any_port"]:
+        return False
+    return inner["others"] <= outer["others"] and _ranges_cover(outer["ranges"], inner["ranges"])
+
+def _merge_text(rule, record):
+    """
+    Collect the distinct notes of a row merged into a rule
+    
+    Args:
+        rule (dict): The rule the row is merged into
+        record (dict): The merged row
+    """
+    for column, value in record.items():
+        if column in RULE_KEY_COLUMNS or column == "Ports" or not isinstance(value, str):
+            continue
+        values = rule["texts"].setdefault(column, [])
+        if value not in values:
+            values.append(value)
+
+def _merge_rule(rule, other):
+    """
+    Merge the ports and notes of a rule into another rule
+    """
+    other["ranges"] = _merge_ranges(other["ranges"] + rule["ranges"])
+    other["others"] |= rule["others"]
+    other["any_port"] = other["any_port"] or rule["any_port"]
+    other["blank"] = other["blank"] and rule["blank"]
+    for column, values in rule["texts"].items():
+        merged = other["texts"].setdefault(column, [])
+        merged.extend(value for value in values if value not in merged)
+
+def merge_ports_values(values):
+    """
+    Merge several ports values the way the ports of merged rules are merged
+    
+    Args:
+        values (list): Ports values, such as "80, 443" or "8000-8100"
+        
+    Returns:
+        str: The merged ports value, or None if every value was blank
+    """
+    merged = {"ranges": [], "others": set(), "any_port": False, "blank": True, "texts": {}}
+    for value in values:
+        ranges, others, any_port = _parse_ports(value)
+        _merge_rule({"ranges": ranges, "others": others, "any_port": any_port,
+                     "blank": _clean_text(value) is None, "texts": {}}, merged)
+    return _format_ports(merged)
+
+def _protocols(rule):
+    protocol = rule["record"].get("Transfer Protocol")
+    return protocol.split("/") if protocol else []
+
+def normalize_rules(df, canonical_names=None, column_mergers=None):
+    """
+    Normalize the firewall rules and collapse duplicate or overlapping rows
+    
+    Whitespace is trimmed, entity and AZ names that differ only in case are
+    given a single spelling, protocols are canonicalized (e.g. "udp/tcp" becomes
+    "TCP/UDP") and port lists are parsed into merged ranges. Rows with the same
+    software type, endpoints and protocol are then merged into one row, and rows
+    whose ports are already covered by a rule for a broader protocol between the
+    same endpoints (e.g. TCP 53 under TCP/UDP 53) are folded into that rule.
+    Blank ports allow every port: such a rule absorbs numbered ports but is only
+    covered by another rule allowing every port. The distinct Service Flow and
+    Additional Notes of merged rows are kept, joined with "; ", unless
+    column_mergers gives a column its own way of combining values.
+    
+    Args:
+        df (pd.DataFrame): DataFrame containing the Excel data
+        canonical_names (iterable): Preferred spellings for names, e.g. the AZ names
+            the diagram layout reserves positions for
+        column_mergers (dict): Mapping of column name to a function combining the
+            distinct values of merged rows into one, e.g. for diff statuses
+        
+    Returns:
+        pd.DataFrame: DataFrame containing the normalized rules
+        dict: Row counts before and after normalization
+    """
+    # Map case-insensitive names to a single spelling, preferring canonical names
+    # and otherwise the first spelling seen in the workbook
+    spellings = {name.casefold(): name for name in (canonical_names or [])}
+    
+    def canonical(value):
+        text = _clean_text(value)
+        if text is None:
+            return None
+        return spellings.setdefault(text.casefold(), text)
+    
+    name_columns = ["Source", "Destination", "Source AZ (Used for Diagram Generation)",
+                    "Destination AZ (Used for Diagram Generation)"]
+    
+    rules = {}
+    for record in df.to_dict("records"):
+        for column, value in record.items():
+            if column in name_columns:
+                record[column] = canonical(value)
+            elif isinstance(value, str):
+                record[column] = _clean_text(value)
+        record["Transfer Protocol"] = _normalize_protocol(record.get("Transfer Protocol"))
+        
+        # Merge the ports and notes of rows sharing the same rule key
+        key = tuple(record.get(column) for column in RULE_KEY_COLUMNS)
+        ranges, others, any_port = _parse_ports(record.get("Ports"))
+        row = {"record": record, "ranges": _merge_ranges(ranges), "others": others, "any_port": any_port,
+               "blank": _clean_text(record.get("Ports")) is None, "texts": {}}
+        _merge_text(row, record)
+        if key in rules:
+            _merge_rule(row, rules[key])
+        else:
+            rules[key] = row
+    
+    # Fold rules covered by a rule for a broader protocol between the same endpoints
+    # into that rule, keeping their notes
+    by_endpoints = {}
+    for key, rule in rules.items():
+        if key[-1] is not None:
+            by_endpoints.setdefault(key[:-1], []).append((set(key[-1].split("/")), rule))
+    
+    covered_by = {}
+    for group in by_endpoints.values():
+        for protocols, rule in group:
+            for other_protocols, other in group:
+                if other is not rule and protocols < other_protocols and _rule_covers(other, rule):
+                    covered_by[id(rule)] = other
+                    break
+    
+    # Narrower protocols first, so notes travel along chains such as TCP -> TCP/UDP -> TCP/UDP/ICMP
+    for rule in sorted(rules.values(), key=lambda rule: len(_protocols(rule))):
+        if id(rule) in covered_by:
+            covering = covered_by[id(rule)]
+            # Only the notes move: the covering rule already includes the ports
+            for column, values in rule["texts"].items():
+                merged = covering["texts"].setdefault(column, [])
+                merged.extend(value for value in values if value not in merged)
+    
+    records = []
+    for rule in rules.values():
+        if id(rule) in covered_by:
+            continue
+        record = rule["record"]
+        record["Ports"] = _format_ports(rule)
+        for column, values in rule["texts"].items():
+            if column_mergers and column in column_mergers:
+                record[column] = column_mergers[column](values)
+            else:
+                record[column] = MERGED_TEXT_SEPARATOR.join(values)
+        records.append(record)
+    
+    normalized = pd.DataFrame(records, columns=df.columns)
+    
+    stats = {
+        "rows_before": len(df),
+        "rows_after": len(normalized),
+        "rows_eliminated": len(df) - len(normalized)
+    }
+    
+    return normalized, stats
+
 def get_software_types(df):
     """
     Extract unique software types from the DataFrame
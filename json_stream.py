@@ -0,0 +1,48 @@
+import json
+import types
+
+# Same compact separators as serialize_document, so streamed and in-memory output match
+SEPARATORS = (",", ":")
+
+
+def dump_streaming(value, fp):
+    """
+    Write a value as compact JSON, consuming generators lazily
+
+    Dicts, lists and tuples are written structurally so that any generator inside
+    them is found. A generator is written as a JSON array one item at a time,
+    without building the whole array in memory; its items are encoded with
+    json.dumps and must not contain generators themselves. The output is
+    identical to json.dumps(value, separators=(",", ":")) with the generators
+    replaced by lists.
+
+    Args:
+        value: The value to write; may contain generators
+        fp (file-like): Writable text stream
+    """
+    if isinstance(value, dict):
+        fp.write("{")
+        for index, (key, item) in enumerate(value.items()):
+            if index:
+                fp.write(",")
+            fp.write(json.dumps(str(key)))
+            fp.write(":")
+            dump_streaming(item, fp)
+        fp.write("}")
+    elif isinstance(value, (list, tuple)):
+        fp.write("[")
+        for index, item in enumerate(value):
+            if index:
+                fp.write(",")
+            dump_streaming(item, fp)
+        fp.write("]")
+    elif isinstance(value, types.GeneratorType):
+        fp.write("[")
+        for index, item in enumerate(value):
+            if index:
+                fp.write(",")
+            # Generated items are leaves (such as lines), so encode each in one call
+            fp.write(json.dumps(item, separators=SEPARATORS))
+        fp.write("]")
+    else:
+        fp.write(json.dumps(value, separators=SEPARATORS))
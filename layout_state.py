@@ -0,0 +1,90 @@
+import json
+import os
+import tempfile
+import threading
+
+# Bumped whenever the file layout changes; files with another version are ignored
+LAYOUT_STATE_VERSION = 1
+
+
+class LayoutState:
+    """
+    Remembers the placement of AZs and entities between runs so diagrams stay stable
+
+    The state file is keyed by software type, then by AZ, and stores the grid
+    cell of each AZ and the top-to-bottom order of its entities:
+
+        {"version": 1, "software_types": {TYPE: {AZ: {"cell": [row, col], "entities": [...]}}}}
+    """
+
+    def __init__(self, path):
+        """
+        Initialize the layout state, loading it from disk if the file exists
+
+        Args:
+            path (str): Path to the layout state JSON file
+        """
+        self.path = path
+        self._software_types = {}
+        self._lock = threading.Lock()
+
+        if os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                if data.get("version") == LAYOUT_STATE_VERSION:
+                    self._software_types = data.get("software_types", {})
+                else:
+                    print(f"Ignoring layout state {path}: unsupported version {data.get('version')}")
+            except (OSError, ValueError, AttributeError) as e:
+                print(f"Ignoring unreadable layout state {path}: {str(e)}")
+
+    def get(self, software_type):
+        """
+        Get the remembered placement for a software type
+
+        Args:
+            software_type (str): The software type
+
+        Returns:
+            dict: Mapping of AZ name to {"cell": (row, col), "entities": [...]},
+                empty if the software type has not been laid out before
+        """
+        with self._lock:
+            placement = self._software_types.get(software_type, {})
+            return {
+                az: {"cell": tuple(az_state["cell"]), "entities": list(az_state["entities"])}
+                for az, az_state in placement.items()
+            }
+
+    def update(self, software_type, placement):
+        """
+        Replace the remembered placement for a software type
+
+        Args:
+            software_type (str): The software type
+            placement (dict): Mapping of AZ name to {"cell": (row, col), "entities": [...]}
+        """
+        with self._lock:
+            self._software_types[software_type] = {
+                az: {"cell": list(az_state["cell"]), "entities": list(az_state["entities"])}
+                for az, az_state in placement.items()
+            }
+
+    def save(self):
+        """
+        Write the layout state to disk, replacing the previous file atomically
+        """
+        with self._lock:
+            data = {"version": LAYOUT_STATE_VERSION, "software_types": self._software_types}
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+
+            fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    json.dump(data, f, indent=2, sort_keys=True)
+                os.replace(temp_path, self.path)
+            except Exception:
+                os.remove(temp_path)
+                raise
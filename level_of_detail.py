@@ -0,0 +1,130 @@
+import re
+
+from diff_mode import DIFF_COLUMN_MERGERS
+from excel_reader import normalize_rules
+
+SOURCE_AZ = "Source AZ (Used for Diagram Generation)"
+DEST_AZ = "Destination AZ (Used for Diagram Generation)"
+
+
+def _name_prefix(name):
+    """
+    Get the grouping prefix of an entity name: everything before its first digit
+
+    For example "web-01 (prod)" and "web-17 (prod)" share the prefix "web".
+    """
+    prefix = re.match(r"[^\d]*", name).group().rstrip(" -_.#(")
+    return prefix or name
+
+
+def _group_label(members):
+    """
+    Build the label of a super-node from the names it contains
+    """
+    if len(members) == 1:
+        return next(iter(members))
+
+    prefixes = {_name_prefix(name) for name in members}
+    if len(prefixes) == 1:
+        return f"{prefixes.pop()}* ({len(members)})"
+    return f"{min(members)} + {len(members) - 1} more"
+
+
+def _merge_nodes(nodes, key):
+    """
+    Merge nodes (sets of entity names) that share the same key
+    """
+    merged = {}
+    for node in nodes:
+        merged.setdefault(key(node), set()).update(node)
+    return list(merged.values())
+
+
+def collapse_dense_azs(df, threshold):
+    """
+    Collapse the entities of AZs holding more than threshold entities into super-nodes
+
+    Entities in a dense AZ are first grouped by name prefix. If the AZ is still
+    above the threshold, groups with the same set of peers are merged, and
+    finally the smallest groups are merged into a single "Other" node, so no AZ
+    ever shows more than threshold entities. Connections of collapsed entities
+    are merged by normalizing the rewritten rules.
+
+    Args:
+        df (pd.DataFrame): DataFrame containing the filtered firewall rules
+        threshold (int): Maximum number of entities to show per AZ
+
+    Returns:
+        pd.DataFrame: DataFrame with the collapsed rules
+        dict: Per-AZ entity counts before and after collapsing, for collapsed AZs
+    """
+    rows = list(zip(df["Source"], df[SOURCE_AZ], df["Destination"], df[DEST_AZ]))
+
+    # Collect the entities of each AZ and the peers each entity talks to
+    entities_by_az = {}
+    peers = {}
+    for source, source_az, destination, dest_az in rows:
+        if not all(isinstance(value, str) for value in (source, source_az, destination, dest_az)):
+            continue
+        entities_by_az.setdefault(source_az, set()).add(source)
+        entities_by_az.setdefault(dest_az, set()).add(destination)
+        peers.setdefault((source, source_az), set()).add(("to", destination, dest_az))
+        peers.setdefault((destination, dest_az), set()).add(("from", source, source_az))
+
+    renames = {}
+    stats = {}
+    # Every entity name is taken up front, so a group label never depends on the order of the AZs
+    used_labels = set().union(*entities_by_az.values())
+    for az, entities in entities_by_az.items():
+        if len(entities) <= threshold:
+            continue
+
+        # Group by name prefix
+        nodes = _merge_nodes(({name} for name in entities), lambda node: _name_prefix(next(iter(node))))
+
+        # Merge groups that talk to exactly the same peers
+        if len(nodes) > threshold:
+            nodes = _merge_nodes(nodes, lambda node: frozenset().union(
+                *(peers.get((name, az), set()) for name in node)))
+
+        # Keep the largest groups and fold the rest into a single node
+        if len(nodes) > threshold:
+            nodes.sort(key=lambda node: (-len(node), min(node)))
+            other = set().union(*nodes[threshold - 1:])
+            nodes = nodes[:threshold - 1]
+        else:
+            other = set()
+
+        for node in nodes:
+            label = _group_label(node)
+            # Keep labels unique across AZs so collapsed nodes never share a shape
+            if len(node) > 1 and label in used_labels:
+                label = f"{label} - {az}"
+            used_labels.add(label)
+            for name in node:
+                renames[(name, az)] = label
+
+        if other:
+            label = f"Other {az} ({len(other)})"
+            # An entity or group may already carry this name
+            if label in used_labels:
+                label = f"{label} - {az}"
+            used_labels.add(label)
+            for name in other:
+                renames[(name, az)] = label
+
+        stats[az] = {"entities_before": len(entities), "entities_after": len(nodes) + (1 if other else 0)}
+
+    if not renames:
+        return df, stats
+
+    collapsed = df.copy()
+    collapsed["Source"] = [renames.get((source, source_az), source)
+                           for source, source_az, _, _ in rows]
+    collapsed["Destination"] = [renames.get((destination, dest_az), destination)
+                                for _, _, destination, dest_az in rows]
+
+    # Merge the connections of entities that now share a node
+    collapsed, _ = normalize_rules(collapsed, column_mergers=DIFF_COLUMN_MERGERS)
+
+    return collapsed, stats
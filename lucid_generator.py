@@ -1,55 +1,139 @@
+import functools
+import hashlib
+import io
 import json
+import math
 import os
-import shutil
-import tempfile
+import threading
+import time
 import zipfile
-import uuid
+from types import MappingProxyType
+
 import pandas as pd
 
-class LucidGenerator:
+from json_stream import dump_streaming
+from rendering import (BUNDLE_STROKE, CHANGE_ENTITY_STYLES, CHANGE_LINE_STROKES, LINE_STROKE, container_group,
+                       container_label_shape, container_shape, entity_shape, line_label_markup)
+from text_metrics import TEXT_METRICS
+
+# Number of distinct layout options whose generators are kept for reuse
+SHARED_GENERATORS = 16
+
+# Endpoints on one entity closer than this (x, y) distance count as the same point
+POINT_TOLERANCE = (0.01, 0.05)
+
+# Specific grid positions (row, col) for key AZs on the 4x4 layout grid
+AZ_GRID_POSITIONS = {
+    # Client Network at top left
+    "Client network": (0, 0),
+    
+    # AZ3 at the top
+    "AZ3": (0, 1),  # top, second column
+    
+    # Internet Services and External Services must always be on the right
+    "Internet Services": (0, 3),  # top right
+    "External Services": (1, 3),  # right side, second row
+    
+    # Local AZ in middle left
+    "Local AZ": (2, 0),  # left side, third row
+    
+    # AZ1 must always be at bottom left
+    "AZ1": (3, 0),  # bottom left
+    
+    # AZ2 must always be bottom right
+    "AZ2": (3, 3)   # bottom right
+}
+
+
+def stable_id(prefix, key, digits=12):
     """
-    Class to generate Lucid diagrams from firewall rules
+    Derive a shape or line ID from a stable hash of its identifying key
+    
+    Unlike running counters, the ID only depends on the key, so unchanged elements
+    keep their IDs across runs and documents can be compared element by element.
+    
+    Args:
+        prefix (str): Kind of element, such as "az", "entity" or "line"
+        key (str): Identifying key: the AZ name, entity name or connection key
+        digits (int): Number of hex digits of the hash to keep
+        
+    Returns:
+        str: The ID, for example "entity_a030328790b9" for "Web Server"
+    """
+    return f"{prefix}_{hashlib.sha1(key.encode('utf-8')).hexdigest()[:digits]}"
+
+
+def summarize_changes(changes):
     """
+    Reduce the diff status of the rules behind a line or entity to one highlight
     
-    def __init__(self, filtered_data, software_type):
+    Args:
+        changes (iterable): Diff statuses ("added", "removed", "changed", "unchanged")
+        
+    Returns:
+        str: "added" or "removed" if every changed rule was, "changed" for any other
+            mix of changes, or None if nothing changed
+    """
+    changes = set(changes) - {"unchanged"}
+    if not changes:
+        return None
+    if len(changes) == 1:
+        return next(iter(changes))
+    return "changed"
+
+
+class LayoutConfig:
+    """
+    Immutable layout configuration shared by every diagram a generator creates
+    """
+    
+    def __init__(self, lod_threshold=None, bundle_threshold=None, bundle_fan_out=False):
         """
-        Initialize the Lucid Generator
+        Initialize the layout configuration
         
         Args:
-            filtered_data (pd.DataFrame): DataFrame containing the filtered firewall rules
-            software_type (str): The selected software type
+            lod_threshold (int): Collapse AZs with more entities than this into grouped
+                super-nodes (level-of-detail mode); None shows every entity
+            bundle_threshold (int): Merge at least this many parallel connections between
+                an AZ pair into one trunk line (at least 2); None draws every connection
+            bundle_fan_out (bool): Also draw a segment from the container end of each
+                trunk to every bundled entity; off by default, since the segments
+                cost as many lines as bundling saves
         """
-        self.filtered_data = filtered_data
-        self.software_type = software_type
-        self.entities_by_az = {}
-        self.az_list = []
-        self.entity_id_map = {}
+        if bundle_threshold is not None and bundle_threshold < 2:
+            raise ValueError(f"bundle_threshold must be at least 2, got {bundle_threshold}")
+        
+        self._set("lod_threshold", lod_threshold)
+        self._set("bundle_threshold", bundle_threshold)
+        self._set("bundle_fan_out", bundle_fan_out)
         
         # Define layout parameters for a strict 4x4 grid
-        self.start_x = 100
-        self.start_y = 100
-        self.grid_cols = 4
-        self.grid_rows = 4
+        self._set("start_x", 100)
+        self._set("start_y", 100)
+        self._set("grid_cols", 4)
+        self._set("grid_rows", 4)
         
         # Maximum allowed y-coordinate to ensure all elements stay within page bounds
-        self.max_y_coordinate = 2300  # Increased from 1800 to accommodate larger containers
+        self._set("max_y_coordinate", 2300)  # Increased from 1800 to accommodate larger containers
         
         # Base container dimensions (will be dynamically adjusted based on content)
-        self.min_container_width = 300  # Minimum width for each AZ container (increased from 250)
-        self.min_container_height = 300  # Minimum height for each AZ container (increased from 250)
-        self.horizontal_spacing = 150  # Spacing between AZs horizontally
-        self.vertical_spacing = 150    # Spacing between AZs vertically
+        self._set("min_container_width", 300)  # Minimum width for each AZ container (increased from 250)
+        self._set("min_container_height", 300)  # Minimum height for each AZ container (increased from 250)
+        self._set("horizontal_spacing", 150)  # Spacing between AZs horizontally
+        self._set("vertical_spacing", 150)    # Spacing between AZs vertically
         
         # Entity dimensions
-        self.entity_width = 220  # Increased from 180 to better fit text
-        self.entity_height = 60  # Base height to fit text
-        self.entity_vertical_spacing = 25  # Increased from 15 for better spacing
-        self.entity_horizontal_spacing = 20  # Horizontal spacing between entities
-        self.min_entity_height = 40  # Minimum height for any entity, regardless of space constraints
+        self._set("entity_width", 220)  # Increased from 180 to better fit text
+        self._set("entity_height", 60)  # Base height to fit text
+        self._set("entity_vertical_spacing", 25)  # Increased from 15 for better spacing
+        self._set("entity_horizontal_spacing", 20)  # Horizontal spacing between entities
+        self._set("min_entity_height", 40)  # Minimum height for any entity, regardless of space constraints
+        self._set("max_entity_width", 350)  # Entities grow up to this width before their text wraps
+        self._set("entity_text_padding", 10)  # Horizontal padding between entity text and its border
         
         # Create a grid position map for easy reference
         # This ensures all AZs are properly aligned on a 4x4 grid
-        self.grid_positions = {}
+        grid_positions = {}
         # Increased horizontal and vertical spacing to avoid container overlaps
         grid_h_spacing = 450  # Increased from self.horizontal_spacing
         grid_v_spacing = 350  # Increased from self.vertical_spacing
@@ -58,7 +142,264 @@ class LucidGenerator:
             for col in range(self.grid_cols):
                 x = self.start_x + col * grid_h_spacing
                 y = self.start_y + row * grid_v_spacing
-                self.grid_positions[(row, col)] = {"x": x, "y": y}
+                grid_positions[(row, col)] = MappingProxyType({"x": x, "y": y})
+        
+        self._set("grid_positions", MappingProxyType(grid_positions))
+    
+    def _set(self, name, value):
+        object.__setattr__(self, name, value)
+    
+    def __setattr__(self, name, value):
+        raise AttributeError("LayoutConfig is immutable; create a new LayoutConfig instead")
+
+
+class LucidGenerator:
+    """
+    Class to generate Lucid diagrams from firewall rules
+    
+    A generator only holds its immutable LayoutConfig; all state of a generation
+    lives in a separate _DiagramRun, so one generator can serve many concurrent
+    generation calls, e.g. from a thread pool.
+    """
+    
+    def __init__(self, config=None):
+        """
+        Initialize the Lucid Generator
+        
+        Args:
+            config (LayoutConfig): Layout configuration; defaults to LayoutConfig()
+        """
+        self.config = config or LayoutConfig()
+    
+    def create_document_json(self, filtered_data, software_type, layout_state=None, metrics=None):
+        """
+        Create the document.json structure for a Lucid diagram
+        
+        Args:
+            filtered_data (pd.DataFrame): DataFrame containing the filtered firewall rules
+            software_type (str): The selected software type
+            layout_state (LayoutState): Placement remembered from earlier runs, updated
+                with this run's placement; None lays the diagram out from scratch
+            metrics (dict): Filled with the counts, sizes and timings of this generation, or None
+            
+        Returns:
+            dict: The document.json structure
+        """
+        document_json = self._create_streaming_document(filtered_data, software_type, layout_state, metrics)
+        document_json["pages"][0]["lines"] = list(document_json["pages"][0]["lines"])
+        return document_json
+    
+    def _create_streaming_document(self, filtered_data, software_type, layout_state=None, metrics=None):
+        """
+        Lay out a diagram, leaving its lines to be routed while the document is written
+        
+        Args:
+            filtered_data (pd.DataFrame): DataFrame containing the filtered firewall rules
+            software_type (str): The selected software type
+            layout_state (LayoutState): Placement remembered from earlier runs, or None
+            metrics (dict): Filled with the counts, sizes and timings of this generation, or None
+            
+        Returns:
+            dict: The document.json structure, with a generator of lines
+        """
+        previous_placement = layout_state.get(software_type) if layout_state is not None else None
+        
+        started = time.perf_counter()
+        run = _DiagramRun(self.config, filtered_data, software_type, previous_placement)
+        document_json = run._create_streaming_document()
+        if metrics is not None:
+            _record_page(metrics, run, document_json["pages"][0], len(filtered_data), started)
+        
+        # The placement is final once the shapes exist, before any line is routed
+        if layout_state is not None:
+            layout_state.update(software_type, run.placement)
+        
+        return document_json
+    
+    def _create_streaming_multi_page_document(self, pages, layout_state=None, metrics=None):
+        """
+        Lay out several diagrams as the pages of one document, leaving their lines as generators
+        
+        Args:
+            pages (list): List of (filtered_data, software_type) tuples, one per page
+            layout_state (LayoutState): Placement remembered from earlier runs, or None
+            metrics (dict): Filled with the counts, sizes and timings of this generation, or None
+            
+        Returns:
+            dict: The document.json structure, with a generator of lines per page
+        """
+        document_json = {"version": 1, "pages": []}
+        namespaces = {}
+        
+        for filtered_data, software_type in pages:
+            previous_placement = layout_state.get(software_type) if layout_state is not None else None
+            started = time.perf_counter()
+            
+            # Namespace the IDs of each page by its software type so they stay unique
+            page_id = stable_id("page", software_type)
+            id_namespace = stable_id("p", software_type) + "_"
+            if namespaces.setdefault(id_namespace, software_type) != software_type:
+                raise ValueError(f"Software types '{namespaces[id_namespace]}' and '{software_type}' "
+                                 f"hash to the same page ID namespace")
+            
+            run = _DiagramRun(self.config, filtered_data, software_type, previous_placement,
+                              id_namespace)
+            document_json["pages"].append(run._create_page(page_id))
+            if metrics is not None:
+                _record_page(metrics, run, document_json["pages"][-1], len(filtered_data), started)
+            
+            if layout_state is not None:
+                layout_state.update(software_type, run.placement)
+        
+        return document_json
+    
+    def create_multi_page_document_json(self, pages, layout_state=None, metrics=None):
+        """
+        Create a document.json with one page per software type
+        
+        Args:
+            pages (list): List of (filtered_data, software_type) tuples, one per page
+            layout_state (LayoutState): Placement remembered from earlier runs, or None
+            metrics (dict): Filled with the counts, sizes and timings of this generation, or None
+            
+        Returns:
+            dict: The document.json structure
+        """
+        document_json = self._create_streaming_multi_page_document(pages, layout_state, metrics)
+        for page in document_json["pages"]:
+            page["lines"] = list(page["lines"])
+        return document_json
+    
+    def create_multi_page_lucid_file(self, pages, output_path, layout_state=None, metrics=None):
+        """
+        Create a .lucid file (ZIP) with one page per software type
+        
+        Args:
+            pages (list): List of (filtered_data, software_type) tuples, one per page
+            output_path (str): Path to the output .lucid file
+            layout_state (LayoutState): Placement remembered from earlier runs, or None
+            metrics (dict): Filled with the counts, sizes and timings of this generation, or None
+            
+        Returns:
+            str: Path to the created .lucid file
+        """
+        document_json = self._create_streaming_multi_page_document(pages, layout_state, metrics)
+        
+        # Lines of every page are routed while the archive is written
+        write_lucid_archive(document_json, output_path, metrics)
+        
+        return output_path
+    
+    def create_lucid_file(self, filtered_data, software_type, output_path, layout_state=None, metrics=None):
+        """
+        Create a .lucid file (ZIP) containing the document.json
+        
+        Args:
+            filtered_data (pd.DataFrame): DataFrame containing the filtered firewall rules
+            software_type (str): The selected software type
+            output_path (str): Path to the output .lucid file
+            layout_state (LayoutState): Placement remembered from earlier runs, or None
+            metrics (dict): Filled with the counts, sizes and timings of this generation, or None
+            
+        Returns:
+            str: Path to the created .lucid file
+        """
+        document_json = self._create_streaming_document(filtered_data, software_type, layout_state, metrics)
+        
+        # Create a ZIP file containing document.json, writing lines as they are routed
+        write_lucid_archive(document_json, output_path, metrics)
+        
+        return output_path
+    
+    def create_lucid_buffer(self, filtered_data, software_type, layout_state=None, metrics=None):
+        """
+        Create a .lucid archive (ZIP) in an in-memory buffer, without touching the filesystem
+        
+        Args:
+            filtered_data (pd.DataFrame): DataFrame containing the filtered firewall rules
+            software_type (str): The selected software type
+            layout_state (LayoutState): Placement remembered from earlier runs, or None
+            metrics (dict): Filled with the counts, sizes and timings of this generation, or None
+            
+        Returns:
+            io.BytesIO: Buffer holding the archive, positioned at its start
+        """
+        document_json = self._create_streaming_document(filtered_data, software_type, layout_state, metrics)
+        
+        buffer = io.BytesIO()
+        write_lucid_archive(document_json, buffer, metrics)
+        buffer.seek(0)
+        
+        return buffer
+    
+    def create_multi_page_lucid_buffer(self, pages, layout_state=None, metrics=None):
+        """
+        Create a .lucid archive (ZIP) with one page per software type in an in-memory buffer
+        
+        Args:
+            pages (list): List of (filtered_data, software_type) tuples, one per page
+            layout_state (LayoutState): Placement remembered from earlier runs, or None
+            metrics (dict): Filled with the counts, sizes and timings of this generation, or None
+            
+        Returns:
+            io.BytesIO: Buffer holding the archive, positioned at its start
+        """
+        document_json = self._create_streaming_multi_page_document(pages, layout_state, metrics)
+        
+        buffer = io.BytesIO()
+        write_lucid_archive(document_json, buffer, metrics)
+        buffer.seek(0)
+        
+        return buffer
+    
+    def create_lucid_bytes(self, filtered_data, software_type, layout_state=None, metrics=None):
+        """
+        Create a .lucid archive (ZIP) in memory
+        
+        Args:
+            filtered_data (pd.DataFrame): DataFrame containing the filtered firewall rules
+            software_type (str): The selected software type
+            layout_state (LayoutState): Placement remembered from earlier runs, or None
+            metrics (dict): Filled with the counts, sizes and timings of this generation, or None
+            
+        Returns:
+            bytes: The contents of the .lucid archive
+        """
+        return self.create_lucid_buffer(filtered_data, software_type, layout_state, metrics).getvalue()
+
+
+class _DiagramRun:
+    """
+    State of a single diagram generation
+    """
+    
+    def __init__(self, config, filtered_data, software_type, previous_placement=None,
+                 id_namespace=""):
+        """
+        Initialize the generation state
+        
+        Args:
+            config (LayoutConfig): Layout configuration
+            filtered_data (pd.DataFrame): DataFrame containing the filtered firewall rules
+            software_type (str): The selected software type
+            previous_placement (dict): AZ cells and entity order from an earlier run, or None
+            id_namespace (str): Prefix for every shape and line ID, keeping IDs unique
+                when several diagrams share a document
+        """
+        self.config = config
+        self.previous_placement = previous_placement or {}
+        self.id_namespace = id_namespace
+        self.filtered_data = filtered_data
+        self.software_type = software_type
+        self.entities_by_az = {}
+        self.az_list = []
+        self.entity_id_map = {}
+        self.az_dimensions = {}
+        self.az_grid_cells = {}
+        self.az_sides = {}
+        self.placement = {}
+        self.entity_changes = {}
+        self.collapsed = {}
         
     def _preprocess_data(self):
         """
@@ -66,37 +407,43 @@ class LucidGenerator:
         """
         from excel_reader import get_unique_az_values, get_unique_entities
         
+        # Collapse very dense AZs into super-nodes in level-of-detail mode
+        if self.config.lod_threshold:
+            from level_of_detail import collapse_dense_azs
+            self.filtered_data, self.collapsed = collapse_dense_azs(self.filtered_data, self.config.lod_threshold)
+        
         # Get unique AZ values
         self.az_list = get_unique_az_values(self.filtered_data)
         
         # Get unique entities by AZ
         self.entities_by_az = get_unique_entities(self.filtered_data)
         
+        # In diff mode, collect the diff status of the rules touching each entity
+        if "Change" in self.filtered_data.columns:
+            for source, destination, change in zip(self.filtered_data["Source"], self.filtered_data["Destination"],
+                                                   self.filtered_data["Change"]):
+                self.entity_changes.setdefault(source, set()).add(change)
+                self.entity_changes.setdefault(destination, set()).add(change)
+        
         # Create entity ID mapping
         self._create_entity_id_map()
         
     def _create_entity_id_map(self):
         """
         Create a mapping of entity names to unique IDs
-        """
-        entity_id = 1
         
+        IDs are derived from the entity name, so an entity keeps its ID when other
+        entities are added or removed.
+        """
         # Process each AZ
         for az in self.az_list:
             if az not in self.entities_by_az:
                 continue
                 
-            # Process sources
-            for source in self.entities_by_az[az]["sources"]:
-                if source not in self.entity_id_map:
-                    self.entity_id_map[source] = f"entity_{entity_id}"
-                    entity_id += 1
-            
-            # Process destinations
-            for dest in self.entities_by_az[az]["destinations"]:
-                if dest not in self.entity_id_map:
-                    self.entity_id_map[dest] = f"entity_{entity_id}"
-                    entity_id += 1
+            # Process sources and destinations
+            for entity in self.entities_by_az[az]["sources"] + self.entities_by_az[az]["destinations"]:
+                if entity not in self.entity_id_map:
+                    self.entity_id_map[entity] = self.id_namespace + stable_id("entity", entity)
     
     def _create_document_json(self):
         """
@@ -105,37 +452,63 @@ class LucidGenerator:
         Returns:
             dict: The document.json structure
         """
+        document = self._create_streaming_document()
+        document["pages"][0]["lines"] = list(document["pages"][0]["lines"])
+        return document
+    
+    def _create_streaming_document(self):
+        """
+        Create the document.json structure with the lines left as a generator
+        
+        Containers and entities are laid out up front since lines attach to them;
+        lines are only routed while the document is being written.
+        
+        Returns:
+            dict: The document.json structure, with a generator of lines
+        """
+        return {
+            "version": 1,
+            "pages": [self._create_page("page1")]
+        }
+    
+    def _create_page(self, page_id):
+        """
+        Create the page showing this diagram, with the lines left as a generator
+        
+        Args:
+            page_id (str): ID of the page
+            
+        Returns:
+            dict: The page structure, with a generator of lines
+        """
         self._preprocess_data()
         
-        # Initialize the document
+        # Initialize the page
         # Increase page dimensions to accommodate all AZs with dynamic sizing
-        document = {
-            "version": 1,
-            "pages": [
-                {
-                    "id": "page1",
-                    "title": f"Firewall Rules - {self.software_type}",
-                    "width": 2000,  # Increased from 1500 to accommodate wider containers
-                    "height": 2500,  # Increased from 2000 to accommodate taller containers
-                    "shapes": [],
-                    "lines": []
-                }
-            ]
+        page = {
+            "id": page_id,
+            "title": f"Firewall Rules - {self.software_type}",
+            "width": 2000,  # Increased from 1500 to accommodate wider containers
+            "height": 2500,  # Increased from 2000 to accommodate taller containers
+            "shapes": [],
+            "groups": [],
+            "lines": None
         }
         
-        # Create shapes for AZ containers
+        # Create shapes for AZ containers, each grouped with its title
         az_containers = self._create_az_containers()
-        document["pages"][0]["shapes"].extend(az_containers)
+        page["shapes"].extend(az_containers)
+        page["groups"].extend(container_group(self.az_dimensions[az]["container"]["id"])
+                              for az in self.az_dimensions if "container" in self.az_dimensions[az])
         
         # Create shapes for entities (sources and destinations)
         entity_shapes = self._create_entity_shapes()
-        document["pages"][0]["shapes"].extend(entity_shapes)
+        page["shapes"].extend(entity_shapes)
         
-        # Create lines for connections
-        connection_lines = self._create_connection_lines()
-        document["pages"][0]["lines"].extend(connection_lines)
+        # Create lines for connections lazily
+        page["lines"] = self._iter_connection_lines()
         
-        return document
+        return page
     
     def _create_az_containers(self):
         """
@@ -146,34 +519,12 @@ class LucidGenerator:
         """
         containers = []
         
-        # Define specific grid positions for key AZs according to requirements
-        az_grid_positions = {
-            # Client Network at top left
-            "Client network": (0, 0),  # (row, col) - top left
-            
-            # AZ3 at the top
-            "AZ3": (0, 1),  # top, second column
-            
-            # Internet Services and External Services must always be on the right
-            "Internet Services": (0, 3),  # top right
-            "External Services": (1, 3),  # right side, second row
-            
-            # Local AZ in middle left
-            "Local AZ": (2, 0),  # left side, third row
-            
-            # AZ1 must always be at bottom left
-            "AZ1": (3, 0),  # bottom left
-            
-            # AZ2 must always be bottom right
-            "AZ2": (3, 3)   # bottom right
-        }
-        
         # Create a list of available grid positions (excluding reserved positions)
         available_positions = []
-        reserved_positions = set(az_grid_positions.values())
+        reserved_positions = set(AZ_GRID_POSITIONS.values())
         
-        for row in range(self.grid_rows):
-            for col in range(self.grid_cols):
+        for row in range(self.config.grid_rows):
+            for col in range(self.config.grid_cols):
                 if (row, col) not in reserved_positions:
                     available_positions.append((row, col))
         
@@ -181,8 +532,8 @@ class LucidGenerator:
         az_dimensions = {}
         for i, az in enumerate(self.az_list):
             # Default dimensions for empty AZs
-            container_width = self.min_container_width
-            container_height = self.min_container_height
+            container_width = self.config.min_container_width
+            container_height = self.config.min_container_height
             
             # Count entities and calculate space requirements
             if az in self.entities_by_az:
@@ -190,83 +541,24 @@ class LucidGenerator:
                 max_entity_width = 0
                 total_entity_height = 0
                 
-                # Process sources
-                if "sources" in self.entities_by_az[az]:
-                    for source in self.entities_by_az[az]["sources"]:
-                        entity_count += 1
-                        
-                        # Adjust width based on text length and content
-                        text_length = len(source)
-                        entity_width = self.entity_width
-                        entity_height = self.entity_height
-                        
-                        # More aggressive scaling for longer text
-                        if text_length > 40:
-                            entity_width = max(entity_width, 350)  # Much wider for very long text
-                        elif text_length > 30:
-                            entity_width = max(entity_width, 300)  # Wider for very long text
-                        elif text_length > 20:
-                            entity_width = max(entity_width, 250)  # Wide for long text
-                        
-                        # Special handling for text with parentheses
-                        has_parentheses = "(" in source and ")" in source
-                        if has_parentheses:
-                            # Add 10% additional width for text with parentheses
-                            entity_width = int(entity_width * 1.1)
-                            
-                        # Adjust height based on text length
-                        if text_length > 35:
-                            entity_height = max(entity_height, 80)  # Much taller for very long text
-                        elif text_length > 25:
-                            entity_height = max(entity_height, 70)  # Taller for long text
-                        
-                        # Add additional height for text with parentheses
-                        if has_parentheses:
-                            entity_height = max(entity_height, entity_height + 10)
-                            
-                        max_entity_width = max(max_entity_width, entity_width)
-                        total_entity_height += entity_height
+                # Process sources, then destinations that aren't already counted as sources
+                sources = self.entities_by_az[az].get("sources", [])
+                source_set = set(sources)
+                destinations = [dest for dest in self.entities_by_az[az].get("destinations", [])
+                                if dest not in source_set]
                 
-                # Process destinations (that aren't already counted as sources)
-                if "destinations" in self.entities_by_az[az]:
-                    for dest in self.entities_by_az[az]["destinations"]:
-                        if "sources" not in self.entities_by_az[az] or dest not in self.entities_by_az[az]["sources"]:
-                            entity_count += 1
-                            
-                            # Adjust width based on text length and content
-                            text_length = len(dest)
-                            entity_width = self.entity_width
-                            entity_height = self.entity_height
-                            
-                            # More aggressive scaling for longer text
-                            if text_length > 40:
-                                entity_width = max(entity_width, 350)  # Much wider for very long text
-                            elif text_length > 30:
-                                entity_width = max(entity_width, 300)  # Wider for very long text
-                            elif text_length > 20:
-                                entity_width = max(entity_width, 250)  # Wide for long text
-                            
-                            # Special handling for text with parentheses
-                            has_parentheses = "(" in dest and ")" in dest
-                            if has_parentheses:
-                                # Add 10% additional width for text with parentheses
-                                entity_width = int(entity_width * 1.1)
-                                
-                            # Adjust height based on text length
-                            if text_length > 35:
-                                entity_height = max(entity_height, 80)  # Much taller for very long text
-                            elif text_length > 25:
-                                entity_height = max(entity_height, 70)  # Taller for long text
-                            
-                            # Add additional height for text with parentheses
-                            if has_parentheses:
-                                entity_height = max(entity_height, entity_height + 10)
-                                
-                            max_entity_width = max(max_entity_width, entity_width)
-                            total_entity_height += entity_height
+                for entity in list(sources) + destinations:
+                    entity_count += 1
+                    
+                    # Size the entity from its measured label text
+                    entity_width, text_height_factor = _measure_entity(self.config, entity)
+                    entity_height = self.config.entity_height * text_height_factor
+                    
+                    max_entity_width = max(max_entity_width, entity_width)
+                    total_entity_height += entity_height
                 
                 # Calculate spacing between entities
-                spacing = (entity_count - 1) * self.entity_vertical_spacing if entity_count > 1 else 0
+                spacing = (entity_count - 1) * self.config.entity_vertical_spacing if entity_count > 1 else 0
                 
                 # Calculate container dimensions with padding
                 if entity_count > 0:
@@ -280,8 +572,8 @@ class LucidGenerator:
                         vertical_padding += entity_count * 5  # Scale padding with entity count
                     
                     # Calculate container dimensions with padding
-                    container_width = max(self.min_container_width, max_entity_width + horizontal_padding)
-                    container_height = max(self.min_container_height, total_entity_height + spacing + vertical_padding)
+                    container_width = max(self.config.min_container_width, max_entity_width + horizontal_padding)
+                    container_height = max(self.config.min_container_height, total_entity_height + spacing + vertical_padding)
                     
                     # Apply more aggressive height calculation for containers with many entities
                     if entity_count > 5:
@@ -297,12 +589,22 @@ class LucidGenerator:
                 "height": container_height
             }
         
+        # AZs keep the grid position they had in the previous run while it is still free
+        remembered_cells = {}
+        for az in self.az_list:
+            cell = self.previous_placement.get(az, {}).get("cell")
+            if az not in AZ_GRID_POSITIONS and cell in available_positions and cell not in remembered_cells.values():
+                remembered_cells[az] = cell
+        available_positions = [pos for pos in available_positions if pos not in remembered_cells.values()]
+        
         # Create container for each AZ
         available_position_index = 0
         for i, az in enumerate(self.az_list):
             # Get grid position for this AZ
-            if az in az_grid_positions:
-                row, col = az_grid_positions[az]
+            if az in AZ_GRID_POSITIONS:
+                row, col = AZ_GRID_POSITIONS[az]
+            elif az in remembered_cells:
+                row, col = remembered_cells[az]
             else:
                 # Use the next available grid position
                 if available_position_index < len(available_positions):
@@ -312,8 +614,10 @@ class LucidGenerator:
                     # Fallback if we run out of grid positions (shouldn't happen with 4x4 grid)
                     row, col = (2, 2)  # Default to center if all positions are taken
             
+            self.az_grid_cells[az] = (row, col)
+            
             # Get the x, y coordinates for this grid position
-            position = self.grid_positions[(row, col)]
+            position = self.config.grid_positions[(row, col)]
             x_position = position["x"]
             y_position = position["y"]
             
@@ -322,40 +626,104 @@ class LucidGenerator:
             container_height = az_dimensions[az]["height"]
             
             # Ensure y-coordinate doesn't exceed the maximum allowed value
-            if y_position > self.max_y_coordinate - container_height:
-                y_position = self.max_y_coordinate - container_height
+            if y_position > self.config.max_y_coordinate - container_height:
+                y_position = self.config.max_y_coordinate - container_height
             
             # Create the container with dynamic dimensions based on content
-            container = {
-                "id": f"az_{i+1}",
-                "type": "rectangle",
-                "boundingBox": {
-                    "x": x_position,
-                    "y": y_position,
-                    "w": container_width,
-                    "h": container_height
-                },
-                "style": {
-                    "fill": {
-                        "type": "color",
-                        "color": "#d7d7d7"
-                    },
-                    "stroke": {
-                        "color": "#d7d7d7",
-                        "width": 2,
-                        "style": "solid"
-                    }
-                },
-                "text": f"<p style=\"font-family: Liberation Sans;font-size: 9pt;text-align: center;margin-top: 10px;\">{az}</p><p style=\"font-family: Liberation Sans;font-size: 9pt;text-align: center;\"><br><br><br><br><br><br><br><br><br><br><br><br><br><br><br><br><br><br><br><br><br><br><br><br><br><br><br><br><br><br><br><br><br><br><br><br><br><br><br><br></p>"
+            bounding_box = {
+                "x": x_position,
+                "y": y_position,
+                "w": container_width,
+                "h": container_height
             }
+            container = container_shape(self.id_namespace + stable_id("az", az), bounding_box)
+            
+            # The AZ name is a separate text shape at the top of the container, grouped with it
+            label = container_label_shape(container["id"], az, bounding_box)
             
-            # Store the container dimensions for validation later
+            # Store the container and its label for validation later
             az_dimensions[az]["container"] = container
+            az_dimensions[az]["label"] = label
             
             containers.append(container)
+            containers.append(label)
+        
+        self.az_dimensions = az_dimensions
+        
+        # Decide the line sides for each AZ pair once, rather than per line
+        self.az_sides = self._build_az_side_table()
         
         return containers
     
+    def _build_az_side_table(self):
+        """
+        Decide which side of the entities connection lines attach to for each AZ pair
+        
+        Lines only use the left (x=0) or right (x=1) side of an entity. The side
+        depends only on the source and destination AZs, so it is computed once per
+        AZ pair rather than once per line.
+        
+        Returns:
+            dict: Mapping of (source AZ, destination AZ) to (source x, destination x,
+                spread) where spread marks same-AZ pairs whose endpoints are spread
+                along the shared side
+        """
+        az_sides = {}
+        
+        for source_az in self.az_list:
+            for dest_az in self.az_list:
+                source_grid_pos = AZ_GRID_POSITIONS.get(source_az)
+                dest_grid_pos = AZ_GRID_POSITIONS.get(dest_az)
+                
+                if not (source_grid_pos and dest_grid_pos):
+                    # If we don't have fixed grid positions, determine the sides from the name
+                    if source_az != dest_az:
+                        # Cross-AZ: right-to-left
+                        az_sides[(source_az, dest_az)] = (1, 0, False)
+                    else:
+                        # AZs with names like "AZ1", "Local AZ", "Client network" are typically on the left
+                        left_side_az_patterns = ["AZ1", "AZ3", "Local AZ", "Client network"]
+                        side = 0 if any(pattern in source_az for pattern in left_side_az_patterns) else 1
+                        az_sides[(source_az, dest_az)] = (side, side, False)
+                    continue
+                
+                source_row, source_col = source_grid_pos
+                dest_row, dest_col = dest_grid_pos
+                
+                if source_az == dest_az:
+                    # Same-AZ connection: AZs in columns 0-1 use their left side,
+                    # AZs in columns 2-3 use their right side
+                    side = 0 if source_col < 2 else 1
+                    az_sides[(source_az, dest_az)] = (side, side, True)
+                elif source_col != dest_col and source_row != dest_row:
+                    # Diagonal connection - special handling based on diagonal type
+                    if source_row > dest_row and source_col < dest_col:
+                        # Bottom-left to top-right: both use right sides
+                        az_sides[(source_az, dest_az)] = (1, 1, False)
+                    elif source_row < dest_row and source_col > dest_col:
+                        # Top-right to bottom-left: both use left sides
+                        az_sides[(source_az, dest_az)] = (0, 0, False)
+                    elif source_row < dest_row and source_col < dest_col:
+                        # Top-left to bottom-right: right-to-left standard
+                        az_sides[(source_az, dest_az)] = (1, 0, False)
+                    else:
+                        # Bottom-right to top-left: left-to-right standard
+                        az_sides[(source_az, dest_az)] = (0, 1, False)
+                elif source_col < dest_col:
+                    # Source is to the left of destination
+                    az_sides[(source_az, dest_az)] = (1, 0, False)
+                elif source_col > dest_col:
+                    # Source is to the right of destination
+                    az_sides[(source_az, dest_az)] = (0, 1, False)
+                elif source_row < dest_row:
+                    # Same column, source above destination: right-to-left
+                    az_sides[(source_az, dest_az)] = (1, 0, False)
+                else:
+                    # Same column, source below destination: left-to-right
+                    az_sides[(source_az, dest_az)] = (0, 1, False)
+        
+        return az_sides
+    
     def _analyze_connections(self):
         """
         Analyze connections between entities to optimize placement
@@ -363,7 +731,8 @@ class LucidGenerator:
         Returns:
             dict: Connection information for optimizing entity placement
             set: Set of source entity IDs
-            dict: Connection weight matrix for component ordering
+            dict: Adjacency list mapping each entity to {neighbor: weight} for
+                connections within the same AZ, used for component ordering
         """
         # Create a dictionary to store connection information
         connections = {}
@@ -376,15 +745,23 @@ class LucidGenerator:
                     if source in self.entity_id_map:
                         source_entity_ids.add(source)
         
-        # Create a connection weight matrix for optimizing component ordering
-        # This will track how many connections exist between each pair of components
-        connection_weights = {}
+        # Look up the AZ each entity first appears in as a source or destination
+        # in a single pass instead of rescanning the rules for every connection
+        first_source_az = {}
+        first_dest_az = {}
+        rows = zip(self.filtered_data["Source"], self.filtered_data["Destination"],
+                   self.filtered_data["Source AZ (Used for Diagram Generation)"],
+                   self.filtered_data["Destination AZ (Used for Diagram Generation)"])
+        for source, destination, source_az, dest_az in rows:
+            first_source_az.setdefault(source, source_az)
+            first_dest_az.setdefault(destination, dest_az)
+        
+        # Adjacency list of weighted connections between components in the same AZ
+        # This tracks how many connections exist between each pair of components
+        adjacency = {}
         
         # Analyze connections
-        for _, row in self.filtered_data.iterrows():
-            source = row["Source"]
-            destination = row["Destination"]
-            
+        for source, destination in zip(self.filtered_data["Source"], self.filtered_data["Destination"]):
             if pd.isna(source) or pd.isna(destination):
                 continue
             
@@ -403,31 +780,22 @@ class LucidGenerator:
             connections[destination]["connection_count"] += 1  # Count incoming connections too
             
             # Store source AZ
-            source_az = None
-            dest_az = None
-            for _, row2 in self.filtered_data.iterrows():
-                if row2["Source"] == source:
-                    source_az = row2["Source AZ (Used for Diagram Generation)"]
-                if row2["Destination"] == destination:
-                    dest_az = row2["Destination AZ (Used for Diagram Generation)"]
-                if source_az and dest_az:
-                    break
+            source_az = first_source_az.get(source)
+            dest_az = first_dest_az.get(destination)
             
             if source_az:
                 connections[source]["source_az"] = source_az
             if dest_az:
                 connections[destination]["source_az"] = dest_az
             
-            # Update connection weight matrix
-            if source_az == dest_az:  # Only track connections within the same AZ for ordering
-                # Create entity pair key (always sort to ensure consistency)
-                entity_pair = tuple(sorted([source, destination]))
-                
-                if entity_pair not in connection_weights:
-                    connection_weights[entity_pair] = 0
-                connection_weights[entity_pair] += 1
+            # Update the adjacency list
+            if source_az == dest_az and source != destination:  # Only track connections within the same AZ for ordering
+                source_neighbors = adjacency.setdefault(source, {})
+                source_neighbors[destination] = source_neighbors.get(destination, 0) + 1
+                dest_neighbors = adjacency.setdefault(destination, {})
+                dest_neighbors[source] = dest_neighbors.get(source, 0) + 1
         
-        return connections, source_entity_ids, connection_weights
+        return connections, source_entity_ids, adjacency
     
     def _pre_analyze_connections(self):
         """
@@ -438,11 +806,16 @@ class LucidGenerator:
         """
         connection_counts = {}
         
+        # Create a set of all source entity IDs once, not once per rule
+        source_entity_ids = set()
+        for az in self.az_list:
+            if az in self.entities_by_az:
+                for src in self.entities_by_az[az]["sources"]:
+                    if src in self.entity_id_map:
+                        source_entity_ids.add(f"{self.entity_id_map[src]}_source")
+        
         # First pass to count connections
-        for _, row in self.filtered_data.iterrows():
-            source = row["Source"]
-            destination = row["Destination"]
-            
+        for source, destination in zip(self.filtered_data["Source"], self.filtered_data["Destination"]):
             if pd.isna(source) or pd.isna(destination):
                 continue
             
@@ -455,14 +828,6 @@ class LucidGenerator:
             # If destination is also a source, use the source ID
             dest_id = f"{self.entity_id_map[destination]}_dest"
             
-            # Create a set of all source entity IDs
-            source_entity_ids = set()
-            for az in self.az_list:
-                if az in self.entities_by_az:
-                    for src in self.entities_by_az[az]["sources"]:
-                        if src in self.entity_id_map:
-                            source_entity_ids.add(f"{self.entity_id_map[src]}_source")
-            
             if f"{self.entity_id_map[destination]}_source" in source_entity_ids:
                 dest_id = f"{self.entity_id_map[destination]}_source"
             
@@ -478,6 +843,59 @@ class LucidGenerator:
         
         return connection_counts
     
+    def _order_entities(self, entities, connections, adjacency):
+        """
+        Order the entities of an AZ so that highly connected, related components sit together
+        
+        Entities are ranked by their total connection count plus twice the weight of
+        their connections to other entities in the same AZ. Entities with equal
+        scores are then ordered by the barycenter (mean rank) of their intra-AZ
+        neighbors, which keeps connected components adjacent and reduces line
+        crossings. Runs in O(E log E + edges) for E entities.
+        
+        Args:
+            entities (list): Entities in the AZ, in their default order
+            connections (dict): Connection information from _analyze_connections
+            adjacency (dict): Intra-AZ adjacency list from _analyze_connections
+            
+        Returns:
+            list: The ordered entities
+        """
+        members = set(entities)
+        
+        scores = {}
+        for entity in entities:
+            if entity not in connections:
+                scores[entity] = 0
+                continue
+            
+            # Base score is the total number of connections
+            score = connections[entity].get("connection_count", 0)
+            
+            # Give extra weight to intra-AZ connections
+            for neighbor, weight in adjacency.get(entity, {}).items():
+                if neighbor in members:
+                    score += weight * 2
+            
+            scores[entity] = score
+        
+        # First pass: rank by score, keeping the default order for ties
+        ranked = sorted(entities, key=lambda entity: -scores[entity])
+        rank = {entity: index for index, entity in enumerate(ranked)}
+        
+        # Second pass: break ties by the weighted mean rank of intra-AZ neighbors
+        barycenters = {}
+        for entity in ranked:
+            total_weight = 0
+            weighted_rank = 0
+            for neighbor, weight in adjacency.get(entity, {}).items():
+                if neighbor in members:
+                    total_weight += weight
+                    weighted_rank += rank[neighbor] * weight
+            barycenters[entity] = weighted_rank / total_weight if total_weight else rank[entity]
+        
+        return sorted(ranked, key=lambda entity: (-scores[entity], barycenters[entity], rank[entity]))
+    
     def _validate_container_bounds(self, az, entity_shapes):
         """
         Validate and adjust container bounds if entities exceed them
@@ -493,12 +911,8 @@ class LucidGenerator:
             return False
             
         # Get the container for this AZ
-        container = None
-        for az_info in self.az_dimensions.values():
-            if "container" in az_info and az_info["container"]["text"].startswith(f"<p style=\"font-family: Liberation Sans;font-size: 9pt;text-align: center;margin-top: 10px;\">{az}</p>"):
-                container = az_info["container"]
-                break
-                
+        container = self.az_dimensions.get(az, {}).get("container")
+        
         if not container:
             return False
             
@@ -546,6 +960,9 @@ class LucidGenerator:
         if new_width != container_width or new_height != container_height:
             container["boundingBox"]["w"] = new_width
             container["boundingBox"]["h"] = new_height
+            
+            # Keep the AZ title spanning the full container width
+            self.az_dimensions[az]["label"]["boundingBox"]["w"] = new_width
             return True
             
         return False
@@ -557,62 +974,13 @@ class LucidGenerator:
         Returns:
             list: List of entity shapes
         """
-        # Store AZ dimensions for container validation
-        self.az_dimensions = {}
         shapes = []
         
         # Pre-analyze connections to get connection counts
         connection_counts = self._pre_analyze_connections()
         
-        # Define specific grid positions for key AZs (same as in _create_az_containers)
-        az_grid_positions = {
-            # Client Network at top left
-            "Client network": (0, 0),  # top left
-            
-            # AZ3 at the top
-            "AZ3": (0, 1),  # top, second column
-            
-            # Internet Services and External Services must always be on the right
-            "Internet Services": (0, 3),  # top right
-            "External Services": (1, 3),  # right side, second row
-            
-            # Local AZ in middle left
-            "Local AZ": (2, 0),  # left side, third row
-            
-            # AZ1 must always be at bottom left
-            "AZ1": (3, 0),  # bottom left
-            
-            # AZ2 must always be bottom right
-            "AZ2": (3, 3)   # bottom right
-        }
-        
-        # Create a mapping of AZ to grid position
-        az_to_grid_position = {}
-        for az, pos in az_grid_positions.items():
-            az_to_grid_position[az] = pos
-        
-        # For AZs not in the predefined list, assign them to available grid positions
-        available_positions = []
-        reserved_positions = set(az_grid_positions.values())
-        
-        for row in range(self.grid_rows):
-            for col in range(self.grid_cols):
-                if (row, col) not in reserved_positions:
-                    available_positions.append((row, col))
-        
-        # Assign remaining AZs to available positions
-        available_position_index = 0
-        for az in self.az_list:
-            if az not in az_to_grid_position:
-                if available_position_index < len(available_positions):
-                    az_to_grid_position[az] = available_positions[available_position_index]
-                    available_position_index += 1
-                else:
-                    # Fallback if we run out of grid positions (shouldn't happen with 4x4 grid)
-                    az_to_grid_position[az] = (2, 2)  # Default to center if all positions are taken
-        
         # Analyze connections to optimize entity placement
-        connections, source_entity_ids, connection_weights = self._analyze_connections()
+        connections, source_entity_ids, adjacency = self._analyze_connections()
         
         # Group entities by AZ and sort them based on connection patterns
         entities_by_az_ordered = {}
@@ -626,199 +994,91 @@ class LucidGenerator:
             if "sources" in self.entities_by_az[az]:
                 all_entities.extend(self.entities_by_az[az]["sources"])
             if "destinations" in self.entities_by_az[az]:
+                seen = set(all_entities)
                 for dest in self.entities_by_az[az]["destinations"]:
-                    if dest not in all_entities:
+                    if dest not in seen:
                         all_entities.append(dest)
+                        seen.add(dest)
+            
+            previous_order = self.previous_placement.get(az, {}).get("entities")
+            if previous_order:
+                # Keep the remembered order and only place entities that are new in this run
+                current = set(all_entities)
+                remembered = set(previous_order)
+                kept = [entity for entity in previous_order if entity in current]
+                added = [entity for entity in all_entities if entity not in remembered]
+                if added:
+                    added = self._order_entities(added, connections, adjacency)
+                entities_by_az_ordered[az] = kept + added
+            else:
+                # Sort entities based on their connection patterns and weights
+                entities_by_az_ordered[az] = self._order_entities(all_entities, connections, adjacency)
             
-            # Sort entities based on their connection patterns and weights
-            def connection_score(entity):
-                if entity not in connections:
-                    return 0
-                
-                # Base score is the total number of connections
-                score = connections[entity].get("connection_count", 0)
-                
-                # Add bonus for entities that are highly connected to each other
-                # This helps place related entities adjacent to each other
-                for other_entity in all_entities:
-                    if other_entity == entity:
-                        continue
-                        
-                    # Check if there's a connection weight between these entities
-                    entity_pair = tuple(sorted([entity, other_entity]))
-                    if entity_pair in connection_weights:
-                        score += connection_weights[entity_pair] * 2  # Give extra weight to intra-AZ connections
-                
-                return score
-            
-            all_entities.sort(key=connection_score, reverse=True)
-            entities_by_az_ordered[az] = all_entities
+            # Remember this placement for the next run
+            self.placement[az] = {"cell": self.az_grid_cells[az], "entities": entities_by_az_ordered[az]}
         
-        # Keep track of vertical position within each AZ
-        az_y_positions = {}
-        for az in self.az_list:
-            # Start components at the top of the container with a small padding
-            az_y_positions[az] = self.grid_positions[az_to_grid_position.get(az, (0, 0))]["y"] + 30
-        
-        # Create shape for each entity by AZ
+        # Lay out each AZ independently
+        tasks = []
+        task_azs = []
         for az in self.az_list:
             if az not in entities_by_az_ordered:
                 continue
-                
+            
             # Get container position from grid
-            grid_pos = az_to_grid_position.get(az, (0, 0))
-            container_x = self.grid_positions[grid_pos]["x"]
-            container_y = self.grid_positions[grid_pos]["y"]
+            grid_pos = self.az_grid_cells.get(az, (0, 0))
+            container_origin = self.config.grid_positions[grid_pos]
             
-            # Calculate available height for entities in this AZ
             # Get the container dimensions (now dynamic)
             container_width = 0
             container_height = 0
             
             # Find the container for this AZ
-            for container in self._create_az_containers():
-                if container["text"].startswith(f"<p style=\"font-family: Liberation Sans;font-size: 9pt;text-align: center;margin-top: 10px;\">{az}</p>"):
-                    container_width = container["boundingBox"]["w"]
-                    container_height = container["boundingBox"]["h"]
-                    break
-            
-            # If we couldn't find the container, use default values
-            if container_width == 0:
-                container_width = self.min_container_width
-            if container_height == 0:
-                container_height = self.min_container_height
-                
-            available_height = container_height - 60  # Increased padding from 40 to 60
-            
-            # Count total entities in this AZ
-            entity_count = len(entities_by_az_ordered[az])
+            container = self.az_dimensions.get(az, {}).get("container")
+            if container:
+                container_width = container["boundingBox"]["w"]
+                container_height = container["boundingBox"]["h"]
+            
+            # Only pass each task the entity data of its own AZ
+            entities = entities_by_az_ordered[az]
+            sources = set(self.entities_by_az[az].get("sources", []))
+            shape_ids = {}
+            for entity in entities:
+                # Create shape ID based on entity role
+                role = "source" if entity in sources else "dest"
+                shape_ids[entity] = f"{self.entity_id_map[entity]}_{role}"
             
-            # Calculate max height per entity to ensure all fit
-            if entity_count > 0:
-                max_entity_height = (available_height - (entity_count - 1) * self.entity_vertical_spacing) / entity_count
-                # Ensure minimum height
-                max_entity_height = max(40, min(max_entity_height, self.entity_height))
-            else:
-                max_entity_height = self.entity_height
+            tasks.append((self.config, entities, shape_ids,
+                          {shape_id: connection_counts.get(shape_id, 0) for shape_id in shape_ids.values()},
+                          container_origin["x"], container_origin["y"], container_width, container_height))
+            task_azs.append(az)
+        
+        results = map(_layout_az_entities, tasks)
+        
+        # Merge in AZ order so shape order and IDs stay deterministic
+        for az, task, az_shapes in zip(task_azs, tasks, results):
+            # Highlight entities whose rules changed in diff mode
+            for entity, shape in zip(task[1], az_shapes):
+                change = summarize_changes(self.entity_changes.get(entity, ()))
+                if change:
+                    shape["style"] = CHANGE_ENTITY_STYLES.get(change, shape["style"])
             
-            # Keep track of shapes for this AZ for container validation
-            az_shapes = []
-            
-            # Process entities in this AZ
-            for entity in entities_by_az_ordered[az]:
-                entity_id = self.entity_id_map[entity]
-                
-                # Determine if this entity is a source, destination, or both
-                is_source = False
-                if "sources" in self.entities_by_az[az] and entity in self.entities_by_az[az]["sources"]:
-                    is_source = True
-                
-                # Create shape ID based on entity role
-                shape_id = f"{entity_id}_source" if is_source else f"{entity_id}_dest"
-                
-                # Set entity width to fit within container
-                entity_width = min(self.entity_width, container_width - 40)  # Ensure it fits with padding
-                
-                # Adjust entity height based on text length and number of connections
-                entity_height = max_entity_height  # Default to calculated max height
-                
-                # Get the number of connections for this entity from our pre-analysis
-                entity_id = f"{entity_id}_source" if is_source else f"{entity_id}_dest"
-                connection_count = connection_counts.get(entity_id, 0)
-                
-                # Adjust height based on text length
-                text_length = len(entity)
-                # If text is very long, increase height
-                if text_length > 50:  # Long text with many commas or special characters
-                    text_height_factor = 2.0  # Double the height
-                elif text_length > 30:
-                    text_height_factor = 1.5  # 50% taller
-                elif text_length > 15:
-                    text_height_factor = 1.2  # 20% taller
-                else:
-                    text_height_factor = 1.0  # Standard height
-                
-                # Apply text length factor
-                entity_height = entity_height * text_height_factor
-                
-                # If this entity has many connections, make it even taller (but still within limits)
-                if connection_count > 3:
-                    # Increase height based on connection count, but don't exceed container
-                    # Use a more aggressive scaling factor to provide more space for connections
-                    additional_height = min((connection_count - 3) * 15, 100)
-                    entity_height = min(entity_height + additional_height, 
-                                       (container_height - (az_y_positions[az] - container_y) - 30))
-                
-                # Calculate the center position of the container
-                container_center_x = container_x + (container_width / 2)
-                entity_x = container_center_x - (entity_width / 2)
-                
-                # Ensure entity stays within container bounds
-                if entity_x < container_x + 20:
-                    entity_x = container_x + 20
-                if entity_x + entity_width > container_x + container_width - 20:
-                    entity_x = container_x + container_width - entity_width - 20
-                
-                # Check if this entity would exceed container height
-                if az_y_positions[az] + entity_height > container_y + container_height - 20:
-                    # Adjust height to fit, but ensure minimum height
-                    entity_height = max(self.min_entity_height, container_y + container_height - 20 - az_y_positions[az])
-                    
-                    # If we can't fit this entity with minimum height, adjust previous entities to make room
-                    if entity_height < self.min_entity_height:
-                        # Set to minimum height anyway - we'll overlap slightly if necessary
-                        entity_height = self.min_entity_height
-                
-                # Ensure entity height is at least the minimum height
-                # This prevents negative or very small heights that cause API errors
-                entity_height = max(self.min_entity_height, entity_height)
-                
-                # Ensure entity y-coordinate doesn't exceed the maximum allowed value
-                if az_y_positions[az] > self.max_y_coordinate - entity_height:
-                    az_y_positions[az] = self.max_y_coordinate - entity_height
-                
-                # Create the entity shape
-                shape = {
-                    "id": shape_id,
-                    "type": "rectangle",
-                    "boundingBox": {
-                        "x": entity_x,
-                        "y": az_y_positions[az],
-                        "w": entity_width,
-                        "h": entity_height
-                    },
-                    "style": {
-                        "fill": {
-                            "type": "color",
-                            "color": "#ffffff"
-                        },
-                        "stroke": {
-                            "color": "#131313",
-                            "width": 1.5,
-                            "style": "solid"
-                        }
-                    },
-                    "text": f"<p style=\"font-family: Liberation Sans;font-size: 9pt;text-align: center;vertical-align: middle;display: flex;justify-content: center;align-items: center;height: 100%;margin: 0;\">{entity}</p>"
-                }
-                
-                shapes.append(shape)
-                az_shapes.append(shape)
-                az_y_positions[az] += entity_height + self.entity_vertical_spacing
+            shapes.extend(az_shapes)
             
             # Validate and adjust container bounds if needed
             self._validate_container_bounds(az, az_shapes)
         
         return shapes
     
-    def _create_connection_lines(self):
+    def _iter_connection_lines(self):
         """
         Create lines for connections between sources and destinations
         
-        Returns:
-            list: List of connection lines
+        Lines are yielded as soon as they are routed, so they can be written out
+        without holding every line in memory.
+        
+        Yields:
+            dict: A connection line
         """
-        lines = []
-        line_id = 1
         
         # Track bidirectional connections to avoid duplicates
         processed_bidirectional = set()
@@ -831,41 +1091,6 @@ class LucidGenerator:
                     if source in self.entity_id_map:
                         source_entity_ids.add(f"{self.entity_id_map[source]}_source")
         
-        # Count connections per entity to distribute endpoints
-        # We need to track connections more specifically
-        source_to_dest = {}  # Maps source_id -> list of dest_ids
-        dest_from_source = {}  # Maps dest_id -> list of source_ids
-        
-        # Use pre-analyzed connection counts
-        connection_counts = self._pre_analyze_connections()
-        
-        # First pass to count connections
-        for _, row in self.filtered_data.iterrows():
-            source = row["Source"]
-            destination = row["Destination"]
-            
-            if pd.isna(source) or pd.isna(destination):
-                continue
-            
-            if source not in self.entity_id_map or destination not in self.entity_id_map:
-                continue
-                
-            source_id = f"{self.entity_id_map[source]}_source"
-            dest_id = f"{self.entity_id_map[destination]}_dest"
-            
-            # If destination is also a source, use the source ID
-            if f"{self.entity_id_map[destination]}_source" in source_entity_ids:
-                dest_id = f"{self.entity_id_map[destination]}_source"
-            
-            # Track connections in both directions
-            if source_id not in source_to_dest:
-                source_to_dest[source_id] = []
-            source_to_dest[source_id].append(dest_id)
-            
-            if dest_id not in dest_from_source:
-                dest_from_source[dest_id] = []
-            dest_from_source[dest_id].append(source_id)
-        
         # Get source and destination AZs for each entity
         entity_az_map = {}
         for az in self.az_list:
@@ -881,57 +1106,28 @@ class LucidGenerator:
                     entity_id = self.entity_id_map[dest]
                     entity_az_map[f"{entity_id}_dest"] = az
         
-        # Collect all connections for analysis
-        all_connections = []
-        for _, row in self.filtered_data.iterrows():
-            source = row["Source"]
-            destination = row["Destination"]
-            ports = row["Ports"]
-            protocol = row["Transfer Protocol"]
-            
-            if pd.isna(source) or pd.isna(destination) or pd.isna(ports) or pd.isna(protocol):
-                continue
-            
-            if source not in self.entity_id_map or destination not in self.entity_id_map:
-                continue
-                
-            source_id = f"{self.entity_id_map[source]}_source"
-            dest_id = f"{self.entity_id_map[destination]}_dest"
-            
-            # If destination is also a source, use the source ID
-            if f"{self.entity_id_map[destination]}_source" in source_entity_ids:
-                dest_id = f"{self.entity_id_map[destination]}_source"
-                
-            all_connections.append({
-                "source_id": source_id,
-                "dest_id": dest_id,
-                "ports": ports,
-                "protocol": protocol,
-                "source_az": entity_az_map.get(source_id),
-                "dest_az": entity_az_map.get(dest_id)
-            })
-        
-        # We no longer use bottom side for connections - all connections use left or right sides only
-        # This ensures cleaner diagrams with consistent connection point positioning
-        
-        # Initialize counters for distributing connection points
-        source_current = {k: 0 for k in source_to_dest.keys()}
-        dest_current = {k: 0 for k in dest_from_source.keys()}
-        
-        # Create a more specific mapping for each source-destination pair
-        # This ensures each connection gets a unique position
+        # Collect every connection in a single pass over the rules: a unique entry per
+        # source-destination pair, protocol and ports, which gets its own endpoint position,
+        # and the ports of each protocol by direction, which are drawn as one line
         connection_positions = {}
+        connection_data = {}
         
-        # First, create a unique key for each source-destination pair
-        for _, row in self.filtered_data.iterrows():
-            source = row["Source"]
-            destination = row["Destination"]
-            ports = row["Ports"]
-            protocol = row["Transfer Protocol"]
-            
+        # Diff status of the rules behind each direction, and the old ports of changed
+        # rules by direction and protocol, when diffing two workbooks
+        connection_changes = {}
+        connection_old_ports = {}
+        
+        data = self.filtered_data
+        no_values = [None] * len(data)
+        rows = zip(data["Source"], data["Destination"], data["Ports"], data["Transfer Protocol"],
+                   data["Change"] if "Change" in data.columns else no_values,
+                   data["Old Ports"] if "Old Ports" in data.columns else no_values)
+        for source, destination, ports, protocol, change, old_ports in rows:
+            # Skip if any required field is missing
             if pd.isna(source) or pd.isna(destination) or pd.isna(ports) or pd.isna(protocol):
                 continue
             
+            # Get entity IDs
             if source not in self.entity_id_map or destination not in self.entity_id_map:
                 continue
                 
@@ -953,19 +1149,58 @@ class LucidGenerator:
                     "protocol": protocol,
                     "ports": ports
                 }
+            
+            # Create a direction key (source -> destination)
+            direction_key = f"{source_id}:{dest_id}"
+            
+            if isinstance(change, str):
+                connection_changes.setdefault(direction_key, set()).add(change)
+            if change == "changed" and isinstance(old_ports, str):
+                connection_old_ports.setdefault((direction_key, protocol), set()).update(
+                    p.strip() for p in old_ports.split(","))
+            
+            # Initialize if not exists
+            if direction_key not in connection_data:
+                connection_data[direction_key] = {}
+            
+            # Initialize protocol if not exists
+            if protocol not in connection_data[direction_key]:
+                connection_data[direction_key][protocol] = set()
+            
+            # Add ports to this protocol
+            # Ensure ports is a string before splitting
+            if isinstance(ports, str):
+                port_list = [p.strip() for p in ports.split(",")]
+            else:
+                # If it's not a string (e.g., an integer), convert it to string
+                port_list = [str(ports)]
+            connection_data[direction_key][protocol].update(port_list)
+        
+        # Count the connections of each source and destination up front
+        source_counts = {}
+        dest_counts = {}
+        for conn in connection_positions.values():
+            source_counts[conn["source_id"]] = source_counts.get(conn["source_id"], 0) + 1
+            dest_counts[conn["dest_id"]] = dest_counts.get(conn["dest_id"], 0) + 1
+        
+        # Connections seen so far per source and destination, giving each connection its index
+        source_seen = {}
+        dest_seen = {}
         
         # Now assign positions to each connection
-        for i, (key, conn) in enumerate(connection_positions.items()):
+        for key, conn in connection_positions.items():
             source_id = conn["source_id"]
             dest_id = conn["dest_id"]
             
             # Get the number of connections for this source and destination
-            source_count = len([k for k, c in connection_positions.items() if c["source_id"] == source_id])
-            dest_count = len([k for k, c in connection_positions.items() if c["dest_id"] == dest_id])
+            source_count = source_counts[source_id]
+            dest_count = dest_counts[dest_id]
             
             # Calculate the index of this connection among all connections for this source/dest
-            source_index = len([k for k, c in connection_positions.items() if c["source_id"] == source_id and list(connection_positions.keys()).index(k) < i])
-            dest_index = len([k for k, c in connection_positions.items() if c["dest_id"] == dest_id and list(connection_positions.keys()).index(k) < i])
+            source_index = source_seen.get(source_id, 0)
+            dest_index = dest_seen.get(dest_id, 0)
+            source_seen[source_id] = source_index + 1
+            dest_seen[dest_id] = dest_index + 1
             
             # Apply new positioning logic based on connection count
             # Single connection: middle (y=0.5)
@@ -986,63 +1221,17 @@ class LucidGenerator:
                 # Single connection: middle
                 dest_y = 0.5
             elif dest_count == 2:
-                # Two connections: top and bottom
-                dest_y = 0.2 if dest_index == 0 else 0.8
-            else:
-                # Three or more: distributed evenly
-                dest_y = 0.1 + (0.8 * dest_index / (dest_count - 1))
-            
-            # Store the calculated positions
-            connection_positions[key]["source_y"] = source_y
-            connection_positions[key]["dest_y"] = dest_y
-            
-            # We no longer use bottom side for connections - all connections use left or right sides only
-        
-        # Create a structure to track all connections between each source-destination pair
-        # This will help us consolidate connections and detect bidirectional traffic
-        connection_data = {}
-        
-        # First pass: collect all connections by source-destination pairs and protocol
-        for _, row in self.filtered_data.iterrows():
-            source = row["Source"]
-            destination = row["Destination"]
-            ports = row["Ports"]
-            protocol = row["Transfer Protocol"]
-            
-            # Skip if any required field is missing
-            if pd.isna(source) or pd.isna(destination) or pd.isna(ports) or pd.isna(protocol):
-                continue
-            
-            # Get entity IDs
-            if source not in self.entity_id_map or destination not in self.entity_id_map:
-                continue
-                
-            source_id = f"{self.entity_id_map[source]}_source"
-            dest_id = f"{self.entity_id_map[destination]}_dest"
-            
-            # If destination is also a source, use the source ID
-            if f"{self.entity_id_map[destination]}_source" in source_entity_ids:
-                dest_id = f"{self.entity_id_map[destination]}_source"
-            
-            # Create a direction key (source -> destination)
-            direction_key = f"{source_id}:{dest_id}"
-            
-            # Initialize if not exists
-            if direction_key not in connection_data:
-                connection_data[direction_key] = {}
+                # Two connections: top and bottom
+                dest_y = 0.2 if dest_index == 0 else 0.8
+            else:
+                # Three or more: distributed evenly
+                dest_y = 0.1 + (0.8 * dest_index / (dest_count - 1))
             
-            # Initialize protocol if not exists
-            if protocol not in connection_data[direction_key]:
-                connection_data[direction_key][protocol] = set()
+            # Store the calculated positions
+            connection_positions[key]["source_y"] = source_y
+            connection_positions[key]["dest_y"] = dest_y
             
-            # Add ports to this protocol
-            # Ensure ports is a string before splitting
-            if isinstance(ports, str):
-                port_list = [p.strip() for p in ports.split(",")]
-            else:
-                # If it's not a string (e.g., an integer), convert it to string
-                port_list = [str(ports)]
-            connection_data[direction_key][protocol].update(port_list)
+            # We no longer use bottom side for connections - all connections use left or right sides only
         
         # Second pass: Detect bidirectional connections and prepare consolidated connections
         consolidated_connections = []
@@ -1119,7 +1308,8 @@ class LucidGenerator:
         used_connection_points = {}
         
         # Track used connection points for each individual entity to ensure uniqueness
-        # This prevents multiple connections from using the same point on a single entity
+        # This prevents multiple connections from using the same point on a single entity;
+        # points are kept by tolerance-sized cell so a lookup only scans neighbouring cells
         entity_used_points = {}
         
         for conn in consolidated_connections:
@@ -1143,9 +1333,17 @@ class LucidGenerator:
                     "dest_id": dest_id,
                     "is_bidirectional": is_bidirectional,
                     "protocols": {},
-                    "connection_index": 0  # Track the index of this connection for this entity pair
+                    "old_ports": {},
+                    "connection_index": 0,  # Track the index of this connection for this entity pair
+                    "changes": set()
                 }
             
+            # Collect the diff status of the rules drawn by this line
+            changes = grouped_connections[direction_key]["changes"]
+            changes.update(connection_changes.get(f"{source_id}:{dest_id}", ()))
+            if is_bidirectional:
+                changes.update(connection_changes.get(f"{dest_id}:{source_id}", ()))
+            
             # Add protocol and ports
             protocol = conn["protocol"]
             if protocol not in grouped_connections[direction_key]["protocols"]:
@@ -1155,6 +1353,33 @@ class LucidGenerator:
                 grouped_connections[direction_key]["connection_index"] += 1
             
             grouped_connections[direction_key]["protocols"][protocol].append(conn["ports"])
+            
+            # Keep the old ports of changed rules, to show what they changed from
+            old_ports = connection_old_ports.get((f"{source_id}:{dest_id}", protocol), set())
+            if is_bidirectional:
+                old_ports = old_ports | connection_old_ports.get((f"{dest_id}:{source_id}", protocol), set())
+            if old_ports:
+                grouped_connections[direction_key]["old_ports"].setdefault(protocol, set()).update(old_ports)
+        
+        # Optionally merge parallel connections between AZ pairs into trunk lines
+        if self.config.bundle_threshold:
+            grouped_connections = self._bundle_connections(grouped_connections, entity_az_map)
+        
+        # Index the first position of each source-destination pair, instead of
+        # scanning every connection position for every line
+        first_positions = {}
+        for index, pos in enumerate(connection_positions.values()):
+            first_positions.setdefault((pos["source_id"], pos["dest_id"]), (index, pos))
+        
+        # Count the lines of each source and destination, and the lines before each one,
+        # instead of rescanning every grouped connection for every line
+        source_totals = {}
+        dest_totals = {}
+        line_indices = {}
+        for key, conn in grouped_connections.items():
+            line_indices[key] = (source_totals.get(conn["source_id"], 0), dest_totals.get(conn["dest_id"], 0))
+            source_totals[conn["source_id"]] = line_indices[key][0] + 1
+            dest_totals[conn["dest_id"]] = line_indices[key][1] + 1
         
         # Now create lines for each grouped connection
         for direction_key, conn_data in grouped_connections.items():
@@ -1166,48 +1391,21 @@ class LucidGenerator:
             source_az = entity_az_map.get(source_id)
             dest_az = entity_az_map.get(dest_id)
             
-            # Define specific grid positions for key AZs (same as in _create_az_containers)
-            az_grid_positions = {
-                # Client Network at top left
-                "Client network": (0, 0),  # top left
-                
-                # AZ3 at the top
-                "AZ3": (0, 1),  # top, second column
-                
-                # Internet Services and External Services must always be on the right
-                "Internet Services": (0, 3),  # top right
-                "External Services": (1, 3),  # right side, second row
-                
-                # Local AZ in middle left
-                "Local AZ": (2, 0),  # left side, third row
-                
-                # AZ1 must always be at bottom left
-                "AZ1": (3, 0),  # bottom left
-                
-                # AZ2 must always be bottom right
-                "AZ2": (3, 3)   # bottom right
-            }
-            
-            # Get grid positions for source and destination AZs
-            source_grid_pos = az_grid_positions.get(source_az)
-            dest_grid_pos = az_grid_positions.get(dest_az)
-            
             # Get the calculated y-positions for this connection
             # Use the first connection between these entities as a reference
             source_y = 0.5  # Default to center
             dest_y = 0.5    # Default to center
             
-            # Look for a matching connection in connection_positions
-            for key, pos in connection_positions.items():
-                if pos["source_id"] == source_id and pos["dest_id"] == dest_id:
-                    source_y = pos["source_y"]
-                    dest_y = pos["dest_y"]
-                    break
-                # Also check the reverse direction for bidirectional connections
-                elif is_bidirectional and pos["source_id"] == dest_id and pos["dest_id"] == source_id:
-                    source_y = pos["dest_y"]  # Swap positions
-                    dest_y = pos["source_y"]
-                    break
+            # Look for the first matching connection in connection_positions
+            forward = first_positions.get((source_id, dest_id))
+            # Also check the reverse direction for bidirectional connections
+            reverse = first_positions.get((dest_id, source_id)) if is_bidirectional else None
+            if forward is not None and (reverse is None or forward[0] <= reverse[0]):
+                source_y = forward[1]["source_y"]
+                dest_y = forward[1]["dest_y"]
+            elif reverse is not None:
+                source_y = reverse[1]["dest_y"]  # Swap positions
+                dest_y = reverse[1]["source_y"]
             
             # Create a unique key for this entity pair to track connection points
             entity_pair_key = tuple(sorted([source_id, dest_id]))
@@ -1218,196 +1416,79 @@ class LucidGenerator:
                 
             # Initialize tracking for individual entities if not exists
             if source_id not in entity_used_points:
-                entity_used_points[source_id] = []
+                entity_used_points[source_id] = {}
             if dest_id not in entity_used_points:
-                entity_used_points[dest_id] = []
+                entity_used_points[dest_id] = {}
             
-            # Determine which sides to use for connection based on relative positions
+            # Look up which sides to use for this AZ pair; unknown AZs go right-to-left
             # We only use left (x=0) or right (x=1) sides, never top or bottom
-            source_pos = {"x": 0.5, "y": source_y}  # Default to center, will be adjusted to left/right
-            dest_pos = {"x": 0.5, "y": dest_y}      # Default to center, will be adjusted to left/right
+            source_x, dest_x, spread = self.az_sides.get((source_az, dest_az), (1, 0, False))
+            source_pos = {"x": source_x, "y": source_y}
+            dest_pos = {"x": dest_x, "y": dest_y}
             
-            # Determine if this is a cross-AZ or same-AZ connection
-            is_cross_az = source_az != dest_az
+            # Get the connection index for this entity pair
+            connection_index = grouped_connections[direction_key]["connection_index"]
             
-            if source_grid_pos and dest_grid_pos:
-                source_row, source_col = source_grid_pos
-                dest_row, dest_col = dest_grid_pos
+            # Same-AZ connections spread their endpoints along the shared side
+            if spread:
+                # Calculate a unique y-coordinate for each connection based on connection index
+                # We'll use a more sophisticated distribution to ensure no two connections use the same point
                 
-                # Special handling for Client Network connections - always use right side
-                if source_az == "Client network":
-                    source_pos = {"x": 1, "y": source_y}  # Always use right side of Client Network
-                    # Destination should use left side when possible
-                    dest_pos = {"x": 0, "y": dest_y}      # Left side of destination
-                    
-                # Get the connection index for this entity pair
-                connection_index = grouped_connections[direction_key]["connection_index"]
+                # Count total connections for this entity pair to distribute evenly
+                total_connections = len(grouped_connections.keys())
                 
-                if is_cross_az:
-                    # Cross-AZ connection with improved diagonal handling
-                    if source_col != dest_col and source_row != dest_row:
-                        # Diagonal connection - special handling based on diagonal type
-                        if source_row > dest_row and source_col < dest_col:
-                            # Bottom-left to top-right: both use right sides
-                            source_pos = {"x": 1, "y": source_y}  # Right side of source
-                            dest_pos = {"x": 1, "y": dest_y}      # Right side of destination
-                        elif source_row < dest_row and source_col > dest_col:
-                            # Top-right to bottom-left: both use left sides
-                            source_pos = {"x": 0, "y": source_y}  # Left side of source
-                            dest_pos = {"x": 0, "y": dest_y}      # Left side of destination
-                        elif source_row < dest_row and source_col < dest_col:
-                            # Top-left to bottom-right: right-to-left standard
-                            source_pos = {"x": 1, "y": source_y}  # Right side of source
-                            dest_pos = {"x": 0, "y": dest_y}      # Left side of destination
-                        else:
-                            # Bottom-right to top-left: left-to-right standard
-                            source_pos = {"x": 0, "y": source_y}  # Left side of source
-                            dest_pos = {"x": 1, "y": dest_y}      # Right side of destination
-                    else:
-                        # Non-diagonal cross-AZ connection: use standard right-to-left positioning
-                        if source_col < dest_col:
-                            # Source is to the left of destination
-                            source_pos = {"x": 1, "y": source_y}  # Right side of source
-                            dest_pos = {"x": 0, "y": dest_y}      # Left side of destination
-                        elif source_col > dest_col:
-                            # Source is to the right of destination
-                            source_pos = {"x": 0, "y": source_y}  # Left side of source
-                            dest_pos = {"x": 1, "y": dest_y}      # Right side of destination
-                        else:
-                            # Same column but different rows - use right-to-left
-                            if source_row < dest_row:
-                                # Source is above destination
-                                source_pos = {"x": 1, "y": source_y}  # Right side of source
-                                dest_pos = {"x": 0, "y": dest_y}      # Left side of destination
-                            else:
-                                # Source is below destination
-                                source_pos = {"x": 0, "y": source_y}  # Left side of source
-                                dest_pos = {"x": 1, "y": dest_y}      # Right side of destination
-                else:
-                    # Same-AZ connection: use consistent sides based on AZ position
-                    # Left-side AZs use left side, Right-side AZs use right side
-                    
-                    # Get the connection index for this entity pair
-                    connection_index = grouped_connections[direction_key]["connection_index"]
-                    
-                    # Determine which side to use based on AZ position
-                    # For AZs in columns 0-1 (left side), use left side (x=0)
-                    # For AZs in columns 2-3 (right side), use right side (x=1)
-                    is_left_side_az = source_col < 2
-                    
-                    # Set x-coordinates based on AZ position (consistent for all connections in same AZ)
-                    source_x = 0 if is_left_side_az else 1
-                    dest_x = 0 if is_left_side_az else 1
-                    
-                    # Calculate a unique y-coordinate for each connection based on connection index
-                    # We'll use a more sophisticated distribution to ensure no two connections use the same point
-                    
-                    # Count total connections for this entity pair to distribute evenly
-                    total_connections = len(grouped_connections.keys())
-                    
-                    # Improved arrow distribution algorithm
-                    # Use a progressive distribution based on connection count and index
-                    
-                    # Get the total number of connections for this entity
-                    source_total_connections = len([k for k, c in grouped_connections.items() if c["source_id"] == source_id])
-                    dest_total_connections = len([k for k, c in grouped_connections.items() if c["dest_id"] == dest_id])
-                    
-                    # Calculate the source and destination indices among all connections for these entities
-                    source_connection_index = len([k for k, c in grouped_connections.items() 
-                                                if c["source_id"] == source_id and 
-                                                list(grouped_connections.keys()).index(k) < list(grouped_connections.keys()).index(direction_key)])
-                    
-                    dest_connection_index = len([k for k, c in grouped_connections.items() 
-                                              if c["dest_id"] == dest_id and 
-                                              list(grouped_connections.keys()).index(k) < list(grouped_connections.keys()).index(direction_key)])
-                    
-                    # Create a wider range of base positions for better distribution
-                    # More connections = more spread out distribution
-                    base_positions = []
-                    
-                    # Dynamically create positions based on connection count
-                    if source_total_connections <= 3:
-                        # For few connections, use fixed positions
-                        base_positions = [0.2, 0.5, 0.8]
-                    elif source_total_connections <= 5:
-                        # For medium number of connections, use more positions
-                        base_positions = [0.15, 0.3, 0.5, 0.7, 0.85]
-                    else:
-                        # For many connections, create evenly distributed positions
-                        step = 0.7 / (source_total_connections - 1)
-                        base_positions = [0.15 + i * step for i in range(source_total_connections)]
-                    
-                    # Get base positions for source and destination
-                    source_base_y = base_positions[min(source_connection_index, len(base_positions) - 1)]
-                    
-                    # For destination, use a different distribution to avoid straight lines
-                    if dest_total_connections <= 3:
-                        dest_base_positions = [0.2, 0.5, 0.8]
-                    elif dest_total_connections <= 5:
-                        dest_base_positions = [0.15, 0.3, 0.5, 0.7, 0.85]
-                    else:
-                        step = 0.7 / (dest_total_connections - 1)
-                        dest_base_positions = [0.15 + i * step for i in range(dest_total_connections)]
-                    
-                    dest_base_y = dest_base_positions[min(dest_connection_index, len(dest_base_positions) - 1)]
-                    
-                    # Add protocol-based variation for uniqueness
-                    protocol_key = list(conn_data["protocols"].keys())[0]
-                    protocol_hash = sum(ord(c) for c in protocol_key) % 10
-                    protocol_variation = protocol_hash * 0.01  # Small variation (0.00 to 0.09)
-                    
-                    # Apply the positions with variations
-                    source_y = source_base_y + protocol_variation
-                    dest_y = dest_base_y - protocol_variation
-                    
-                    # Add additional variation based on connection index to ensure uniqueness
-                    connection_variation = (connection_index % 3) * 0.02
-                    source_y += connection_variation
-                    dest_y -= connection_variation
-                    
-                    # Ensure y-coordinates are within bounds
-                    source_y = max(0.1, min(0.9, source_y))
-                    dest_y = max(0.1, min(0.9, dest_y))
-                    
-                    # Apply positions
-                    source_pos = {"x": source_x, "y": source_y}
-                    dest_pos = {"x": dest_x, "y": dest_y}
-                    
-                    # Add some variation based on the specific connection index
-                    # This ensures that even with the same pattern, different connections use different points
-                    variation = (connection_index // 4) * 0.1
-                    source_pos["y"] = max(0.1, min(0.9, source_pos["y"] + variation))
-                    dest_pos["y"] = max(0.1, min(0.9, dest_pos["y"] - variation))
-                    
-                    # If x is 0 or 1 (side connection), adjust y to ensure it's within bounds
-                    if source_pos["x"] == 0 or source_pos["x"] == 1:
-                        source_pos["y"] = max(0.1, min(0.9, source_pos["y"]))
-                    if dest_pos["x"] == 0 or dest_pos["x"] == 1:
-                        dest_pos["y"] = max(0.1, min(0.9, dest_pos["y"]))
-                    
-                    # Note: We no longer increment the connection index here
-                    # It's now incremented when a new protocol is added to ensure
-                    # different protocols use different connection points
-            else:
-                # If we don't have grid positions, try to determine AZ position from name
-                if is_cross_az:
-                    # Cross-AZ: right-to-left
-                    source_pos = {"x": 1, "y": source_y}  # Right side of source
-                    dest_pos = {"x": 0, "y": dest_y}      # Left side of destination
-                else:
-                    # Same-AZ: determine based on AZ name or default logic
-                    # AZs with names like "AZ1", "Local AZ", "Client network" are typically on the left
-                    left_side_az_patterns = ["AZ1", "AZ3", "Local AZ", "Client network"]
-                    is_left_side = any(pattern in source_az for pattern in left_side_az_patterns)
-                    
-                    if is_left_side:
-                        # Left side AZ: use left-to-left
-                        source_pos = {"x": 0, "y": source_y}  # Left side of source
-                        dest_pos = {"x": 0, "y": dest_y}      # Left side of destination
-                    else:
-                        # Right side AZ or unknown: use right-to-right
-                        source_pos = {"x": 1, "y": source_y}  # Right side of source
-                        dest_pos = {"x": 1, "y": dest_y}      # Right side of destination
+                # Improved arrow distribution algorithm
+                # Use a progressive distribution based on connection count and index
+                
+                # Get the total number of connections for this entity
+                source_total_connections = source_totals[source_id]
+                dest_total_connections = dest_totals[dest_id]
+                
+                # Calculate the source and destination indices among all connections for these entities
+                source_connection_index, dest_connection_index = line_indices[direction_key]
+                
+                # Spread the endpoints over the side; more connections = more spread out
+                # distribution, and destinations use their own index to avoid straight lines
+                source_base_y = _spread_position(source_total_connections, source_connection_index)
+                dest_base_y = _spread_position(dest_total_connections, dest_connection_index)
+                
+                # Add protocol-based variation for uniqueness
+                protocol_key = list(conn_data["protocols"].keys())[0]
+                protocol_hash = sum(ord(c) for c in protocol_key) % 10
+                protocol_variation = protocol_hash * 0.01  # Small variation (0.00 to 0.09)
+                
+                # Apply the positions with variations
+                source_y = source_base_y + protocol_variation
+                dest_y = dest_base_y - protocol_variation
+                
+                # Add additional variation based on connection index to ensure uniqueness
+                connection_variation = (connection_index % 3) * 0.02
+                source_y += connection_variation
+                dest_y -= connection_variation
+                
+                # Ensure y-coordinates are within bounds
+                source_y = max(0.1, min(0.9, source_y))
+                dest_y = max(0.1, min(0.9, dest_y))
+                
+                # Apply positions
+                source_pos = {"x": source_x, "y": source_y}
+                dest_pos = {"x": dest_x, "y": dest_y}
+                
+                # Add some variation based on the specific connection index
+                # This ensures that even with the same pattern, different connections use different points
+                variation = (connection_index // 4) * 0.1
+                source_pos["y"] = max(0.1, min(0.9, source_pos["y"] + variation))
+                dest_pos["y"] = max(0.1, min(0.9, dest_pos["y"] - variation))
+                
+                # If x is 0 or 1 (side connection), adjust y to ensure it's within bounds
+                if source_pos["x"] == 0 or source_pos["x"] == 1:
+                    source_pos["y"] = max(0.1, min(0.9, source_pos["y"]))
+                if dest_pos["x"] == 0 or dest_pos["x"] == 1:
+                    dest_pos["y"] = max(0.1, min(0.9, dest_pos["y"]))
+                
+                # Note: We no longer increment the connection index here
+                # It's now incremented when a new protocol is added to ensure
+                # different protocols use different connection points
             
             # Create a unique identifier for this connection point
             # Include protocol in the key to ensure different protocols use different points
@@ -1422,8 +1503,8 @@ class LucidGenerator:
             dest_point_key = (dest_pos["x"], dest_pos["y"])
             
             # Check if positions are already used on individual entities or entity pairs
-            source_point_used = any(abs(point[0] - source_point_key[0]) < 0.01 and abs(point[1] - source_point_key[1]) < 0.05 for point in entity_used_points[source_id])
-            dest_point_used = any(abs(point[0] - dest_point_key[0]) < 0.01 and abs(point[1] - dest_point_key[1]) < 0.05 for point in entity_used_points[dest_id])
+            source_point_used = _point_used(entity_used_points[source_id], source_point_key)
+            dest_point_used = _point_used(entity_used_points[dest_id], dest_point_key)
             pair_point_used = position_key in [k[:4] for k in used_connection_points[entity_pair_key]]
             
             # If any position is already used, adjust it
@@ -1453,16 +1534,16 @@ class LucidGenerator:
                 dest_point_key = (dest_pos["x"], dest_pos["y"])
                 
                 # Check if the new positions are still used
-                source_point_used = any(abs(point[0] - source_point_key[0]) < 0.01 and abs(point[1] - source_point_key[1]) < 0.05 for point in entity_used_points[source_id])
-                dest_point_used = any(abs(point[0] - dest_point_key[0]) < 0.01 and abs(point[1] - dest_point_key[1]) < 0.05 for point in entity_used_points[dest_id])
+                source_point_used = _point_used(entity_used_points[source_id], source_point_key)
+                dest_point_used = _point_used(entity_used_points[dest_id], dest_point_key)
                 pair_point_used = position_key in [k[:4] for k in used_connection_points[entity_pair_key]]
                 
                 attempts += 1
             
             # Record this connection point as used for both the entity pair and individual entities
             used_connection_points[entity_pair_key].append(connection_point)
-            entity_used_points[source_id].append(source_point_key)
-            entity_used_points[dest_id].append(dest_point_key)
+            _use_point(entity_used_points[source_id], source_point_key)
+            _use_point(entity_used_points[dest_id], dest_point_key)
             
             # Ensure source and destination points are not at the same height when on the same side
             if source_pos["x"] == dest_pos["x"] and abs(source_pos["y"] - dest_pos["y"]) < 0.15:
@@ -1473,30 +1554,25 @@ class LucidGenerator:
                 used_connection_points[entity_pair_key][-1] = (source_pos["x"], source_pos["y"], dest_pos["x"], dest_pos["y"])
             
             # Format the text for the line
-            text_parts = []
-            for protocol, ports_list in conn_data["protocols"].items():
-                # Combine all ports for this protocol
-                all_ports = []
-                for ports in ports_list:
-                    # Ensure ports is a string before splitting
-                    if isinstance(ports, str):
-                        all_ports.extend(ports.split(", "))
-                    else:
-                        # If it's not a string (e.g., an integer), convert it to string
-                        all_ports.append(str(ports))
-                
-                # Remove duplicates and sort
-                unique_ports = sorted(set(all_ports))
-                ports_text = ", ".join(unique_ports)
-                
-                text_parts.append(f"{protocol} {ports_text}")
+            text_parts = self._format_protocol_text(conn_data["protocols"], conn_data["old_ports"])
+            
+            # Bundled trunk lines also show how many connections they carry
+            if conn_data.get("bundle_size"):
+                bundle_size = conn_data["bundle_size"]
+                text_parts.append(f"{bundle_size} connection{'' if bundle_size == 1 else 's'}")
             
             # Join all protocol texts with line breaks
-            line_text = "<br>".join([f"<i>{text}</i>" for text in text_parts])
+            line_text = line_label_markup(text_parts)
+            
+            # Highlight lines whose rules changed in diff mode
+            stroke = BUNDLE_STROKE if conn_data.get("bundle_size") else LINE_STROKE
+            change = summarize_changes(conn_data["changes"])
+            if change:
+                stroke = CHANGE_LINE_STROKES.get(change, stroke)
             
             # Create line with appropriate arrow style based on whether it's bidirectional
             line = {
-                "id": f"line_{line_id}",
+                "id": self.id_namespace + stable_id("line", direction_key),
                 "lineType": "elbow",
                 "endpoint1": {
                     "type": "shapeEndpoint",
@@ -1510,11 +1586,7 @@ class LucidGenerator:
                     "shapeId": dest_id,
                     "position": dest_pos
                 },
-                "stroke": {
-                    "color": "#131313",
-                    "width": 1.5,
-                    "style": "solid"
-                },
+                "stroke": stroke,
                 "text": [
                     {
                         "text": line_text,
@@ -1524,52 +1596,567 @@ class LucidGenerator:
                 ]
             }
             
-            lines.append(line)
-            line_id += 1
+            yield line
+            
+            # Fan a trunk attached to an AZ container out to its member entities
+            if conn_data.get("fan_out"):
+                yield from self._fan_out_lines(direction_key, conn_data, source_pos, dest_pos)
+    
+    def _fan_out_lines(self, direction_key, conn_data, source_pos, dest_pos):
+        """
+        Create the segments joining a trunk's container ends to its member entities
+        
+        Each segment starts where the trunk meets the AZ container, so the members
+        visibly branch off the trunk, and keeps the direction of the trunk: source
+        entities lead into it and destination entities are reached from it.
         
-        return lines
+        Args:
+            direction_key (str): Key of the trunk
+            conn_data (dict): The trunk, with "fan_out" mapping "source"/"dest" to
+                {entity ID: set of diff statuses} for each end attached to a container
+            source_pos (dict): Position of the trunk on its source shape
+            dest_pos (dict): Position of the trunk on its destination shape
+            
+        Yields:
+            dict: Line definitions
+        """
+        ends = (("source", conn_data["source_id"], source_pos), ("dest", conn_data["dest_id"], dest_pos))
+        for end, container_id, trunk_pos in ends:
+            for entity_id, changes in conn_data["fan_out"].get(end, {}).items():
+                # Attach to the side of the entity facing the trunk
+                entity_pos = {"x": 0 if trunk_pos["x"] < 0.5 else 1, "y": 0.5}
+                container_endpoint = {"type": "shapeEndpoint", "style": "none",
+                                      "shapeId": container_id, "position": dict(trunk_pos)}
+                entity_endpoint = {"type": "shapeEndpoint", "shapeId": entity_id, "position": entity_pos}
+                if end == "source":
+                    entity_endpoint["style"] = "arrow" if conn_data["is_bidirectional"] else "none"
+                    endpoint1, endpoint2 = entity_endpoint, container_endpoint
+                else:
+                    entity_endpoint["style"] = "arrow"
+                    endpoint1, endpoint2 = container_endpoint, entity_endpoint
+                
+                change = summarize_changes(changes)
+                yield {
+                    "id": self.id_namespace + stable_id("line", f"{direction_key}:{end}:{entity_id}"),
+                    "lineType": "elbow",
+                    "endpoint1": endpoint1,
+                    "endpoint2": endpoint2,
+                    "stroke": CHANGE_LINE_STROKES.get(change, LINE_STROKE)
+                }
     
-    def create_lucid_file(self, output_path):
+    def _format_protocol_text(self, protocols, old_ports=None):
         """
-        Create a .lucid file (ZIP) containing the document.json
+        Format the protocol and port labels of a connection
         
         Args:
-            output_path (str): Path to the output .lucid file
+            protocols (dict): Mapping of protocol to a list of ports strings
+            old_ports (dict): Mapping of protocol to the set of ports its changed rules
+                had in the old workbook, shown as "PROTOCOL old → new"; None in normal mode
             
         Returns:
-            str: Path to the created .lucid file
+            list: One "PROTOCOL ports" string per protocol
+        """
+        old_ports = old_ports or {}
+        text_parts = []
+        for protocol, ports_list in protocols.items():
+            # Combine all ports for this protocol
+            all_ports = []
+            for ports in ports_list:
+                # Ensure ports is a string before splitting
+                if isinstance(ports, str):
+                    all_ports.extend(ports.split(", "))
+                else:
+                    # If it's not a string (e.g., an integer), convert it to string
+                    all_ports.append(str(ports))
+            
+            # Remove duplicates and sort
+            unique_ports = sorted(set(all_ports))
+            ports_text = ", ".join(unique_ports)
+            
+            if old_ports.get(protocol):
+                ports_text = f"{', '.join(sorted(old_ports[protocol]))} → {ports_text}"
+            
+            text_parts.append(f"{protocol} {ports_text}")
+        
+        return text_parts
+    
+    def _bundle_connections(self, grouped_connections, entity_az_map):
         """
-        document_json = self._create_document_json()
+        Merge parallel connections between the same pair of AZs into trunk lines
+        
+        Connections between two different AZs that share direction and an identical
+        protocol and port signature are candidates for bundling. Candidates that
+        share a destination entity are bundled first, then those sharing a source
+        entity, and finally any remaining candidates between the two AZs; each
+        bundle needs at least bundle_threshold members. A trunk attaches to the
+        shared entity at one end and to the AZ container at the other. With
+        bundle_fan_out, unlabeled segments also fan out from the container end to
+        every member entity.
         
-        # Create a temporary directory
-        with tempfile.TemporaryDirectory() as temp_dir:
-            # Write document.json to the temporary directory
-            document_path = os.path.join(temp_dir, "document.json")
-            with open(document_path, "w") as f:
-                json.dump(document_json, f, indent=2)
+        Args:
+            grouped_connections (dict): Grouped connections keyed by direction key
+            entity_az_map (dict): Mapping of shape IDs to AZ names; container IDs
+                of bundled AZs are added to it
+            
+        Returns:
+            dict: Grouped connections with bundles replacing their members
+        """
+        # Group candidate connections by AZ pair, direction and label signature
+        candidates = {}
+        for direction_key, conn_data in grouped_connections.items():
+            source_az = entity_az_map.get(conn_data["source_id"])
+            dest_az = entity_az_map.get(conn_data["dest_id"])
+            if source_az is None or dest_az is None or source_az == dest_az:
+                continue
             
-            # Create a ZIP file containing document.json
-            with zipfile.ZipFile(output_path, "w") as zip_file:
-                zip_file.write(document_path, arcname="document.json")
+            signature = (source_az, dest_az, conn_data["is_bidirectional"],
+                         tuple(self._format_protocol_text(conn_data["protocols"], conn_data["old_ports"])))
+            candidates.setdefault(signature, []).append(direction_key)
+        
+        # Split each signature group into fan-in, fan-out and AZ-to-AZ bundles
+        bundle_for_key = {}
+        bundle_members = {}
+        for signature, members in candidates.items():
+            remaining = members
+            for end in ("dest_id", "source_id", None):
+                by_end = {}
+                for direction_key in remaining:
+                    shared = grouped_connections[direction_key][end] if end else None
+                    by_end.setdefault(shared, []).append(direction_key)
+                
+                remaining = []
+                for shared, keys in by_end.items():
+                    if len(keys) < self.config.bundle_threshold:
+                        remaining.extend(keys)
+                        continue
+                    bundle_key = f"bundle:{signature[0]}:{signature[1]}:{signature[2]}:{'|'.join(signature[3])}:{shared}"
+                    bundle_members[bundle_key] = keys
+                    for direction_key in keys:
+                        bundle_for_key[direction_key] = bundle_key
         
-        return output_path
+        if not bundle_for_key:
+            return grouped_connections
+        
+        # Rebuild the groups, placing each trunk where its first member was
+        bundled = {}
+        for direction_key, conn_data in grouped_connections.items():
+            bundle_key = bundle_for_key.get(direction_key)
+            if bundle_key is None:
+                bundled[direction_key] = conn_data
+                continue
+            if bundle_key in bundled:
+                continue
+            
+            members = [grouped_connections[key] for key in bundle_members[bundle_key]]
+            source_ids = {member["source_id"] for member in members}
+            dest_ids = {member["dest_id"] for member in members}
+            source_az = entity_az_map[conn_data["source_id"]]
+            dest_az = entity_az_map[conn_data["dest_id"]]
+            
+            # Attach each end to the shared entity, or to the AZ container; with
+            # bundle_fan_out, also fan out from the container to the member entities,
+            # keeping the diff status of each member
+            fan_out = {}
+            if len(source_ids) == 1:
+                source_id = conn_data["source_id"]
+            else:
+                source_id = self.az_dimensions[source_az]["container"]["id"]
+                entity_az_map[source_id] = source_az
+                if self.config.bundle_fan_out:
+                    fan_out["source"] = {}
+                    for member in members:
+                        fan_out["source"].setdefault(member["source_id"], set()).update(member["changes"])
+            if len(dest_ids) == 1:
+                dest_id = conn_data["dest_id"]
+            else:
+                dest_id = self.az_dimensions[dest_az]["container"]["id"]
+                entity_az_map[dest_id] = dest_az
+                if self.config.bundle_fan_out:
+                    fan_out["dest"] = {}
+                    for member in members:
+                        fan_out["dest"].setdefault(member["dest_id"], set()).update(member["changes"])
+            
+            bundled[bundle_key] = {
+                "source_id": source_id,
+                "dest_id": dest_id,
+                "is_bidirectional": conn_data["is_bidirectional"],
+                "protocols": conn_data["protocols"],
+                "old_ports": conn_data["old_ports"],
+                "connection_index": conn_data["connection_index"],
+                "bundle_size": len(members),
+                "changes": set().union(*(member["changes"] for member in members)),
+                "fan_out": fan_out
+            }
+        
+        return bundled
+
+
+def _layout_az_entities(task):
+    """
+    Lay out the entity shapes of a single AZ inside its container
+    
+    This only depends on the AZ's own entities and container.
+    
+    Args:
+        task (tuple): (config, ordered entities, shape IDs by entity, connection counts
+            by shape ID, container x, container y, container width, container height)
+        
+    Returns:
+        list: List of entity shapes for the AZ
+    """
+    config, entities, shape_ids, connection_counts, container_x, container_y, container_width, container_height = task
+    
+    # If we couldn't find the container, use default values
+    if container_width == 0:
+        container_width = config.min_container_width
+    if container_height == 0:
+        container_height = config.min_container_height
+    
+    # Calculate available height for entities in this AZ
+    available_height = container_height - 60  # Increased padding from 40 to 60
+    
+    # Count total entities in this AZ
+    entity_count = len(entities)
+    
+    # Calculate max height per entity to ensure all fit
+    if entity_count > 0:
+        max_entity_height = (available_height - (entity_count - 1) * config.entity_vertical_spacing) / entity_count
+        # Ensure minimum height
+        max_entity_height = max(40, min(max_entity_height, config.entity_height))
+    else:
+        max_entity_height = config.entity_height
+    
+    # Start components at the top of the container with a small padding
+    y_position = container_y + 30
+    
+    shapes = []
+    
+    # Process entities in this AZ
+    for entity in entities:
+        shape_id = shape_ids[entity]
+        
+        # Size the entity from its measured label text
+        label_width, text_height_factor = _measure_entity(config, entity)
+        
+        # Set entity width to fit within container
+        entity_width = min(label_width, container_width - 40)  # Ensure it fits with padding
+        
+        # Adjust entity height based on text length and number of connections
+        entity_height = max_entity_height  # Default to calculated max height
+        
+        # Get the number of connections for this entity from our pre-analysis
+        connection_count = connection_counts.get(shape_id, 0)
+        
+        # Apply text length factor
+        entity_height = entity_height * text_height_factor
+        
+        # If this entity has many connections, make it even taller (but still within limits)
+        if connection_count > 3:
+            # Increase height based on connection count, but don't exceed container
+            # Use a more aggressive scaling factor to provide more space for connections
+            additional_height = min((connection_count - 3) * 15, 100)
+            entity_height = min(entity_height + additional_height, 
+                               (container_height - (y_position - container_y) - 30))
+        
+        # Calculate the center position of the container
+        container_center_x = container_x + (container_width / 2)
+        entity_x = container_center_x - (entity_width / 2)
+        
+        # Ensure entity stays within container bounds
+        if entity_x < container_x + 20:
+            entity_x = container_x + 20
+        if entity_x + entity_width > container_x + container_width - 20:
+            entity_x = container_x + container_width - entity_width - 20
+        
+        # Check if this entity would exceed container height
+        if y_position + entity_height > container_y + container_height - 20:
+            # Adjust height to fit, but ensure minimum height
+            entity_height = max(config.min_entity_height, container_y + container_height - 20 - y_position)
+            
+            # If we can't fit this entity with minimum height, adjust previous entities to make room
+            if entity_height < config.min_entity_height:
+                # Set to minimum height anyway - we'll overlap slightly if necessary
+                entity_height = config.min_entity_height
+        
+        # Ensure entity height is at least the minimum height
+        # This prevents negative or very small heights that cause API errors
+        entity_height = max(config.min_entity_height, entity_height)
+        
+        # Ensure entity y-coordinate doesn't exceed the maximum allowed value
+        if y_position > config.max_y_coordinate - entity_height:
+            y_position = config.max_y_coordinate - entity_height
+        
+        # Create the entity shape
+        shapes.append(entity_shape(shape_id, {
+            "x": entity_x,
+            "y": y_position,
+            "w": entity_width,
+            "h": entity_height
+        }, entity))
+        
+        y_position += entity_height + config.entity_vertical_spacing
+    
+    return shapes
+
+def _measure_entity(config, entity):
+    """
+    Calculate the box size needed for an entity label
+    
+    Args:
+        config (LayoutConfig): Layout configuration
+        entity (str): The entity name
+        
+    Returns:
+        tuple: (width, text_height_factor) of the entity box
+    """
+    width, line_count = TEXT_METRICS.fit_box(entity, config.entity_width, config.max_entity_width,
+                                             config.entity_text_padding)
+    
+    # Wrapped labels need taller boxes: 50% per extra line, at most double height
+    text_height_factor = min(1.0 + 0.5 * (line_count - 1), 2.0)
+    
+    return width, text_height_factor
+
+def _spread_position(total, index):
+    """
+    Get the base y-position of a connection endpoint among all endpoints on an entity side
+    
+    Only the endpoint's own position is computed, so a hub entity does not build
+    a list of all its positions for every one of its lines.
+    
+    Args:
+        total (int): Number of connections of the entity
+        index (int): Index of this connection among them
+        
+    Returns:
+        float: The y-position, relative to the entity height
+    """
+    if total <= 3:
+        # For few connections, use fixed positions
+        positions = (0.2, 0.5, 0.8)
+        return positions[min(index, len(positions) - 1)]
+    if total <= 5:
+        # For medium number of connections, use more positions
+        positions = (0.15, 0.3, 0.5, 0.7, 0.85)
+        return positions[min(index, len(positions) - 1)]
+    
+    # For many connections, distribute the positions evenly
+    step = 0.7 / (total - 1)
+    return 0.15 + min(index, total - 1) * step
+
+def _point_cell(point):
+    """
+    Get the tolerance-sized grid cell holding a connection point
+    
+    Args:
+        point (tuple): (x, y) of the point on its entity
+        
+    Returns:
+        tuple: (column, row) of the cell
+    """
+    return math.floor(point[0] / POINT_TOLERANCE[0]), math.floor(point[1] / POINT_TOLERANCE[1])
+
+def _point_used(used_points, point):
+    """
+    Check whether a point is within POINT_TOLERANCE of a point already used on an entity
+    
+    A point within the tolerance lies in the same or an adjacent cell, so only those
+    nine cells are scanned, however many points the entity already has.
+    
+    Args:
+        used_points (dict): Points used on the entity, by cell
+        point (tuple): (x, y) of the candidate point
+        
+    Returns:
+        bool: True if the point is already taken
+    """
+    column, row = _point_cell(point)
+    # Points in the point's own cell almost always match, so look there first
+    for cell_column in (column, column - 1, column + 1):
+        for cell_row in (row, row - 1, row + 1):
+            for used in used_points.get((cell_column, cell_row), ()):
+                if abs(used[0] - point[0]) < POINT_TOLERANCE[0] and abs(used[1] - point[1]) < POINT_TOLERANCE[1]:
+                    return True
+    return False
+
+def _use_point(used_points, point):
+    """
+    Record a point as used on an entity
+    
+    Args:
+        used_points (dict): Points used on the entity, by cell
+        point (tuple): (x, y) of the point
+    """
+    used_points.setdefault(_point_cell(point), []).append(point)
+
+def serialize_document(document_json):
+    """
+    Serialize a document.json structure to text
+    
+    Args:
+        document_json (dict): The document.json structure
+        
+    Returns:
+        str: The serialized document.json
+    """
+    # Compact separators: indentation is pure overhead in an import archive
+    return json.dumps(document_json, separators=(",", ":"))
+
+def package_lucid_archive(document_text, target):
+    """
+    Write a .lucid archive (ZIP) containing a serialized document.json
+    
+    Args:
+        document_text (str or bytes): The serialized document.json
+        target (str or file-like): Path or writable binary buffer for the archive
+    """
+    with zipfile.ZipFile(target, "w") as zip_file:
+        zip_file.writestr("document.json", document_text)
+
+def write_lucid_archive(document_json, target, metrics=None):
+    """
+    Write a .lucid archive (ZIP), streaming document.json into the archive entry
+    
+    The document is serialized piece by piece, so generators inside it (such as
+    the lines of a streaming document) are consumed while writing and the
+    serialized text is never held in memory as a whole.
+    
+    A path is written through a temporary file in the same directory that
+    replaces the target only once the archive is complete, so a failure while
+    streaming never leaves a truncated .lucid file behind.
+    
+    Args:
+        document_json (dict): The document.json structure, possibly containing generators
+        target (str or file-like): Path or writable binary buffer for the archive
+        metrics (dict): Filled with the document.json and archive sizes and the write time, or None
+    """
+    started = time.perf_counter()
+    routing_before = metrics.get("routing_seconds", 0.0) if metrics is not None else 0.0
+    
+    if isinstance(target, (str, os.PathLike)):
+        # Unique per process and thread, so concurrent writers never share a temporary file
+        temp_path = f"{os.fspath(target)}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            document_bytes = _write_archive(document_json, temp_path)
+            os.replace(temp_path, target)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+    else:
+        document_bytes = _write_archive(document_json, target)
+    
+    if metrics is not None:
+        # Lines are routed while they are written; that time is counted as routing, not writing
+        routing = metrics.get("routing_seconds", 0.0) - routing_before
+        metrics["write_seconds"] = metrics.get("write_seconds", 0.0) + time.perf_counter() - started - routing
+        metrics["document_bytes"] = document_bytes
+        metrics["archive_bytes"] = archive_size(target)
+
+def _write_archive(document_json, target):
+    """
+    Stream document.json into a new archive
+    
+    Returns:
+        int: Size of document.json in bytes
+    """
+    with zipfile.ZipFile(target, "w") as zip_file:
+        with zip_file.open("document.json", "w") as entry:
+            with io.TextIOWrapper(entry, encoding="utf-8") as text:
+                dump_streaming(document_json, text)
+        return zip_file.getinfo("document.json").file_size
+
+def archive_size(target):
+    """
+    Get the size of a .lucid archive that has just been written
+    
+    Args:
+        target (str or file-like): Path or binary buffer the archive was written to
+        
+    Returns:
+        int: Size of the archive in bytes
+    """
+    if isinstance(target, (str, os.PathLike)):
+        return os.path.getsize(target)
+    # The archive was written up to the buffer's current position
+    return target.tell()
+
+def _record_page(metrics, run, page, rows, started):
+    """
+    Record the counts of a laid-out page in a metrics dict
+    
+    The page's lines are wrapped so they are counted, and the time spent routing
+    them is measured, while they are consumed.
+    
+    Args:
+        metrics (dict): The metrics of the generation
+        run (_DiagramRun): The run that laid out the page
+        page (dict): The page structure, with a generator of lines
+        rows (int): Number of rules drawn on the page
+        started (float): time.perf_counter() value when the layout of the page started
+    """
+    page_metrics = {
+        "software_type": run.software_type,
+        "rows": rows,
+        "entities": len(run.entity_id_map),
+        "containers": len(run.az_dimensions),
+        "shapes": len(page["shapes"]),
+        "lines": 0
+    }
+    if run.collapsed:
+        # Per-AZ entity counts before and after level-of-detail collapsing
+        page_metrics["collapsed"] = run.collapsed
+    metrics.setdefault("pages", []).append(page_metrics)
+    metrics["layout_seconds"] = metrics.get("layout_seconds", 0.0) + time.perf_counter() - started
+    metrics.setdefault("routing_seconds", 0.0)
+    page["lines"] = _count_lines(page["lines"], page_metrics, metrics)
 
+def _count_lines(lines, page_metrics, metrics):
+    """
+    Pass lines through, counting them and timing how long each took to route
+    """
+    lines = iter(lines)
+    while True:
+        started = time.perf_counter()
+        try:
+            line = next(lines)
+        except StopIteration:
+            return
+        finally:
+            metrics["routing_seconds"] += time.perf_counter() - started
+        page_metrics["lines"] += 1
+        yield line
+
+
+@functools.lru_cache(maxsize=SHARED_GENERATORS)
+def _shared_generator(lod_threshold=None, bundle_threshold=None, bundle_fan_out=False):
+    """
+    Get a generator shared by all callers using the same layout options
+    """
+    return LucidGenerator(LayoutConfig(lod_threshold, bundle_threshold, bundle_fan_out=bundle_fan_out))
 
-def create_document_json(filtered_data, software_type):
+def create_document_json(filtered_data, software_type, lod_threshold=None, bundle_threshold=None,
+                         layout_state=None, metrics=None, bundle_fan_out=False):
     """
     Create the document.json structure for the Lucid diagram
     
     Args:
         filtered_data (pd.DataFrame): DataFrame containing the filtered firewall rules
         software_type (str): The selected software type
+        lod_threshold (int): Maximum entities shown per AZ before they are collapsed
+        bundle_threshold (int): Minimum parallel connections merged into a trunk line
+        layout_state (LayoutState): Placement remembered from earlier runs, or None
+        metrics (dict): Filled with the counts, sizes and timings of this generation, or None
+        bundle_fan_out (bool): Also draw a segment from each trunk to every bundled entity
         
     Returns:
         dict: The document.json structure
     """
-    generator = LucidGenerator(filtered_data, software_type)
-    return generator._create_document_json()
+    generator = _shared_generator(lod_threshold, bundle_threshold, bundle_fan_out)
+    return generator.create_document_json(filtered_data, software_type, layout_state, metrics)
 
-def create_lucid_file(filtered_data, software_type, output_path):
+def create_lucid_file(filtered_data, software_type, output_path, lod_threshold=None, bundle_threshold=None,
+                      layout_state=None, metrics=None, bundle_fan_out=False):
     """
     Create a .lucid file containing the document.json
     
@@ -1577,9 +2164,93 @@ def create_lucid_file(filtered_data, software_type, output_path):
         filtered_data (pd.DataFrame): DataFrame containing the filtered firewall rules
         software_type (str): The selected software type
         output_path (str): Path to the output .lucid file
+        lod_threshold (int): Maximum entities shown per AZ before they are collapsed
+        bundle_threshold (int): Minimum parallel connections merged into a trunk line
+        layout_state (LayoutState): Placement remembered from earlier runs, or None
+        metrics (dict): Filled with the counts, sizes and timings of this generation, or None
+        bundle_fan_out (bool): Also draw a segment from each trunk to every bundled entity
+        
+    Returns:
+        str: Path to the created .lucid file
+    """
+    generator = _shared_generator(lod_threshold, bundle_threshold, bundle_fan_out)
+    return generator.create_lucid_file(filtered_data, software_type, output_path, layout_state, metrics)
+
+def create_lucid_bytes(filtered_data, software_type, lod_threshold=None, bundle_threshold=None,
+                       layout_state=None, metrics=None, bundle_fan_out=False):
+    """
+    Create a .lucid archive in memory
+    
+    Args:
+        filtered_data (pd.DataFrame): DataFrame containing the filtered firewall rules
+        software_type (str): The selected software type
+        lod_threshold (int): Maximum entities shown per AZ before they are collapsed
+        bundle_threshold (int): Minimum parallel connections merged into a trunk line
+        layout_state (LayoutState): Placement remembered from earlier runs, or None
+        metrics (dict): Filled with the counts, sizes and timings of this generation, or None
+        bundle_fan_out (bool): Also draw a segment from each trunk to every bundled entity
+        
+    Returns:
+        bytes: The contents of the .lucid archive
+    """
+    generator = _shared_generator(lod_threshold, bundle_threshold, bundle_fan_out)
+    return generator.create_lucid_bytes(filtered_data, software_type, layout_state, metrics)
+
+def create_multi_page_lucid_file(pages, output_path, lod_threshold=None, bundle_threshold=None,
+                                 layout_state=None, metrics=None, bundle_fan_out=False):
+    """
+    Create a .lucid file with one page per software type, for a single upload
+    
+    Args:
+        pages (list): List of (filtered_data, software_type) tuples, one per page
+        output_path (str): Path to the output .lucid file
+        lod_threshold (int): Maximum entities shown per AZ before they are collapsed
+        bundle_threshold (int): Minimum parallel connections merged into a trunk line
+        layout_state (LayoutState): Placement remembered from earlier runs, or None
+        metrics (dict): Filled with the counts, sizes and timings of this generation, or None
+        bundle_fan_out (bool): Also draw a segment from each trunk to every bundled entity
         
     Returns:
         str: Path to the created .lucid file
     """
-    generator = LucidGenerator(filtered_data, software_type)
-    return generator.create_lucid_file(output_path)
+    generator = _shared_generator(lod_threshold, bundle_threshold, bundle_fan_out)
+    return generator.create_multi_page_lucid_file(pages, output_path, layout_state, metrics)
+
+def create_lucid_buffer(filtered_data, software_type, lod_threshold=None, bundle_threshold=None,
+                        layout_state=None, metrics=None, bundle_fan_out=False):
+    """
+    Create a .lucid archive in an in-memory buffer, e.g. to upload it without writing a file
+    
+    Args:
+        filtered_data (pd.DataFrame): DataFrame containing the filtered firewall rules
+        software_type (str): The selected software type
+        lod_threshold (int): Maximum entities shown per AZ before they are collapsed
+        bundle_threshold (int): Minimum parallel connections merged into a trunk line
+        layout_state (LayoutState): Placement remembered from earlier runs, or None
+        metrics (dict): Filled with the counts, sizes and timings of this generation, or None
+        bundle_fan_out (bool): Also draw a segment from each trunk to every bundled entity
+        
+    Returns:
+        io.BytesIO: Buffer holding the archive, positioned at its start
+    """
+    generator = _shared_generator(lod_threshold, bundle_threshold, bundle_fan_out)
+    return generator.create_lucid_buffer(filtered_data, software_type, layout_state, metrics)
+
+def create_multi_page_lucid_buffer(pages, lod_threshold=None, bundle_threshold=None,
+                                   layout_state=None, metrics=None, bundle_fan_out=False):
+    """
+    Create a .lucid archive with one page per software type in an in-memory buffer
+    
+    Args:
+        pages (list): List of (filtered_data, software_type) tuples, one per page
+        lod_threshold (int): Maximum entities shown per AZ before they are collapsed
+        bundle_threshold (int): Minimum parallel connections merged into a trunk line
+        layout_state (LayoutState): Placement remembered from earlier runs, or None
+        metrics (dict): Filled with the counts, sizes and timings of this generation, or None
+        bundle_fan_out (bool): Also draw a segment from each trunk to every bundled entity
+        
+    Returns:
+        io.BytesIO: Buffer holding the archive, positioned at its start
+    """
+    generator = _shared_generator(lod_threshold, bundle_threshold, bundle_fan_out)
+    return generator.create_multi_page_lucid_buffer(pages, layout_state, metrics)
@@ -1,7 +1,9 @@
 #!/usr/bin/env python3
 
+import argparse
 import os
 import sys
+import time
 import warnings
 import pandas as pd
 
@@ -9,9 +11,16 @@ import pandas as pd
 warnings.filterwarnings("ignore", 
                        message="Data Validation extension is not supported and will be removed",
                        module="openpyxl")
-from excel_reader import read_excel_data, get_software_types, filter_by_software_type
-from lucid_generator import create_lucid_file
-from api_client import LucidApiClient
+from excel_reader import (read_excel_data, read_excel_data_streaming, read_workbooks, normalize_rules,
+                          get_software_types, filter_by_software_type)
+from lucid_generator import (AZ_GRID_POSITIONS, LayoutConfig, LucidGenerator, create_lucid_buffer,
+                             create_lucid_file, create_multi_page_lucid_buffer, create_multi_page_lucid_file)
+from pipeline import DiagramPipeline
+from layout_state import LayoutState
+from api_client import LUCID_API_URL, LucidApiClient
+from upload_spool import SpooledUploader, UploadSpool
+from metrics_ledger import MetricsLedger, build_record, format_report
+from profiling import GenerationProfiler
 
 def display_menu(software_types):
     """
@@ -39,6 +48,15 @@ def display_menu(software_types):
         except ValueError:
             print("Please enter a valid number")
 
+def get_source_data_dir():
+    """
+    Get the path of the source data directory
+    
+    Returns:
+        str: The path to the source data directory
+    """
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), "source data")
+
 def display_excel_files():
     """
     Display a menu of available Excel files in the source data directory
@@ -46,7 +64,7 @@ def display_excel_files():
     Returns:
         str: The path to the selected Excel file
     """
-    source_data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "source data")
+    source_data_dir = get_source_data_dir()
     
     # Check if the source data directory exists
     if not os.path.exists(source_data_dir):
@@ -81,9 +99,503 @@ def display_excel_files():
         except ValueError:
             print("Please enter a valid number")
 
-def main():
+def parse_args():
+    """
+    Parse the command line arguments
+    
+    Returns:
+        argparse.Namespace: The parsed arguments
+    """
+    parser = argparse.ArgumentParser(description="Lucid Firewall Diagram Generator")
+    parser.add_argument("--serve", action="store_true",
+                        help="Run a local HTTP server that keeps workbooks in memory")
+    parser.add_argument("--host", default="127.0.0.1",
+                        help="Interface for the HTTP server to listen on (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8080,
+                        help="Port for the HTTP server to listen on (default: 8080)")
+    parser.add_argument("--cache-mb", type=int, default=64,
+                        help="Maximum size of the server's document cache in MB (default: 64)")
+    parser.add_argument("--lod-threshold", type=int, default=None,
+                        help="Collapse AZs with more entities than this into grouped super-nodes")
+    parser.add_argument("--bundle-threshold", type=int, default=None,
+                        help="Merge at least this many parallel connections between two AZs into one trunk line")
+    parser.add_argument("--bundle-fan-out", action="store_true",
+                        help="Also draw a segment from each trunk line to every bundled entity")
+    parser.add_argument("--layout-state", default=None,
+                        help="JSON file remembering AZ and entity placement so repeated runs stay stable")
+    parser.add_argument("--streaming-read", action="store_true",
+                        help="Read only the rules sheet in read-only streaming mode, for very large workbooks")
+    parser.add_argument("--all-workbooks", action="store_true",
+                        help="Generate diagrams for every workbook in the source data directory without prompting")
+    parser.add_argument("--read-workers", type=int, default=None,
+                        help="Number of processes reading workbooks with --all-workbooks (default: one per CPU)")
+    parser.add_argument("--upload", action="store_true",
+                        help="Upload every diagram generated with --all-workbooks, using the LUCID_API_KEY environment variable")
+    parser.add_argument("--upload-only", action="store_true",
+                        help="Upload diagrams to Lucid straight from memory without writing .lucid files")
+    parser.add_argument("--upload-spool", default=None,
+                        help="SQLite file recording pending uploads (default: output/upload_spool.sqlite3)")
+    parser.add_argument("--max-upload-attempts", type=int, default=5,
+                        help="Attempts per spooled upload before giving up on it (default: 5)")
+    parser.add_argument("--resume-uploads", action="store_true",
+                        help="Retry the uploads left in the upload spool by an earlier run")
+    parser.add_argument("--requests-per-second", type=float, default=None,
+                        help="Maximum Lucid API request rate (default: only slow down when rate limited)")
+    parser.add_argument("--burst", type=int, default=1,
+                        help="Requests sent at once before --requests-per-second pacing applies (default: 1)")
+    parser.add_argument("--layout-threads", type=int, default=1,
+                        help="Number of threads laying out diagrams with --all-workbooks (default: 1)")
+    parser.add_argument("--package-workers", type=int, default=1,
+                        help="Number of threads zipping documents with --all-workbooks (default: 1)")
+    parser.add_argument("--upload-workers", type=int, default=2,
+                        help="Number of concurrent uploads with --all-workbooks --upload (default: 2)")
+    parser.add_argument("--queue-size", type=int, default=2,
+                        help="Maximum number of diagrams waiting between pipeline stages; diagrams waiting "
+                             "for packaging hold their shapes, not their lines (default: 2)")
+    parser.add_argument("--pages", default=None,
+                        help="Pack software types as pages of one document: 'all' or a comma-separated list")
+    parser.add_argument("--diff", nargs=2, metavar=("OLD", "NEW"), default=None,
+                        help="Generate highlighted diagrams of the software types changed between two workbooks")
+    parser.add_argument("--metrics-ledger", default=None,
+                        help="JSON Lines file recording the metrics of every generation (default: output/metrics.jsonl, "
+                             "or none with --upload-only)")
+    parser.add_argument("--metrics-report", action="store_true",
+                        help="Report per-software-type growth and timing regressions from the metrics ledger")
+    parser.add_argument("--profile", action="store_true",
+                        help="Profile the generation with cProfile and write hot-spot reports to the output directory")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="Trace memory allocations with tracemalloc and write allocation reports to the output directory")
+    return parser.parse_args()
+
+def read_workbook(path, args):
+    """
+    Read a workbook, in streaming mode if requested on the command line
+    
+    Args:
+        path (str): Path to the Excel file
+        args (argparse.Namespace): The parsed command line arguments
+        
+    Returns:
+        pd.DataFrame: DataFrame containing the Excel data
+    """
+    if args.streaming_read:
+        return read_excel_data_streaming(path)
+    return read_excel_data(path)
+
+def select_software_types(software_types, pages):
+    """
+    Select the software types named by the --pages option
+    
+    Args:
+        software_types (list): Software types in the workbook
+        pages (str): "all" or a comma-separated list of software types
+        
+    Returns:
+        list: The selected software types, in workbook order
+    """
+    if pages.strip().lower() == "all":
+        return software_types
+    
+    requested = [name.strip() for name in pages.split(",") if name.strip()]
+    unknown = [name for name in requested if name not in software_types]
+    if unknown:
+        raise ValueError(f"Unknown software types: {', '.join(unknown)}")
+    
+    return [software_type for software_type in software_types if software_type in requested]
+
+def resolve_workbook_path(path):
+    """
+    Resolve a workbook given on the command line, also looking in the source data directory
+    
+    Args:
+        path (str): Path or file name of the workbook
+        
+    Returns:
+        str: The path to the workbook
+    """
+    if not os.path.exists(path):
+        source_data_path = os.path.join(get_source_data_dir(), path)
+        if os.path.exists(source_data_path):
+            return source_data_path
+        raise FileNotFoundError(f"Excel file not found: {path}")
+    return path
+
+def create_api_client(api_key, args):
+    """
+    Create a Lucid API client paced by the rate limit options
+    
+    The LUCID_API_URL environment variable points the client at another
+    server, such as the mock server used for load tests.
+    
+    Args:
+        api_key (str): The API key to use for authentication
+        args (argparse.Namespace): The parsed command line arguments
+        
+    Returns:
+        LucidApiClient: The client
+    """
+    return LucidApiClient(api_key, os.environ.get("LUCID_API_URL", LUCID_API_URL),
+                          args.requests_per_second, args.burst)
+
+def open_uploader(client, args):
+    """
+    Create an uploader recording every upload in the upload spool
+    
+    Args:
+        client (LucidApiClient): Client used to upload the files
+        args (argparse.Namespace): The parsed command line arguments
+        
+    Returns:
+        SpooledUploader: The uploader
+    """
+    spool_path = args.upload_spool or os.path.join(os.path.dirname(os.path.abspath(__file__)), "output",
+                                                   "upload_spool.sqlite3")
+    return SpooledUploader(UploadSpool(spool_path), client, args.max_upload_attempts)
+
+def metrics_ledger_path(args):
+    """
+    Get the path of the metrics ledger
+    
+    Args:
+        args (argparse.Namespace): The parsed command line arguments
+        
+    Returns:
+        str: The --metrics-ledger path, or output/metrics.jsonl
+    """
+    return args.metrics_ledger or os.path.join(os.path.dirname(os.path.abspath(__file__)), "output", "metrics.jsonl")
+
+def open_metrics_ledger(args):
+    """
+    Open the ledger recording the metrics of every generation
+    
+    With --upload-only nothing is written to disk unless --metrics-ledger is
+    given explicitly.
+    
+    Args:
+        args (argparse.Namespace): The parsed command line arguments
+        
+    Returns:
+        MetricsLedger: The ledger, or None if no metrics are recorded
+    """
+    if args.upload_only and not args.metrics_ledger:
+        return None
+    return MetricsLedger(metrics_ledger_path(args))
+
+def record_metrics(ledger, metrics, mode, workbook, document, timings=None):
+    """
+    Append the metrics of a generation to the ledger, without failing the generation
+    
+    Args:
+        ledger (MetricsLedger): The ledger, or None to record nothing
+        metrics (dict): Metrics filled in by the generator
+        mode (str): How the document was generated ("interactive", "batch" or "diff")
+        workbook (str): Name of the workbook the rules were read from
+        document (str): File name of the generated document
+        timings (dict): Further phase timings in seconds
+    """
+    if ledger is None:
+        return
+    
+    try:
+        ledger.append(build_record(metrics, mode, workbook, document, timings))
+    except Exception as e:
+        print(f"Warning: could not record metrics in {ledger.path}: {str(e)}")
+
+def print_collapsed(metrics):
+    """
+    Print the AZs collapsed in level-of-detail mode during a generation
+    
+    Args:
+        metrics (dict): Metrics filled in by the generator
+    """
+    for page in metrics.get("pages", []):
+        for az, counts in page.get("collapsed", {}).items():
+            print(f"Collapsed {counts['entities_before']} entities in {az} into {counts['entities_after']} groups")
+
+def start_profiler(name, args):
+    """
+    Start profiling a generation if --profile or --trace-memory was given
+    
+    Args:
+        name (str): Base name of the report files
+        args (argparse.Namespace): The parsed command line arguments
+        
+    Returns:
+        GenerationProfiler: The started profiler, or None if profiling was not requested
+    """
+    if not (args.profile or args.trace_memory):
+        return None
+    
+    output_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "output")
+    profiler = GenerationProfiler(name, output_dir, args.profile, args.trace_memory)
+    profiler.start()
+    return profiler
+
+def stop_profiler(profiler):
+    """
+    Stop a profiler started with start_profiler and print where its reports were written
+    
+    Args:
+        profiler (GenerationProfiler): The profiler, or None
+    """
+    if profiler is None:
+        return
+    
+    for path in profiler.stop():
+        print(f"Wrote profiling report: {path}")
+
+def run_metrics_report(args):
+    """
+    Print per-software-type growth and timing regressions recorded in the metrics ledger
+    
+    Args:
+        args (argparse.Namespace): The parsed command line arguments
+    """
+    ledger = MetricsLedger(metrics_ledger_path(args))
+    print(f"Metrics ledger: {ledger.path}\n")
+    for line in format_report(ledger.records()):
+        print(line)
+
+def run_resume_uploads(args):
+    """
+    Retry the uploads left pending or failed in the upload spool by earlier runs
+    
+    Uploads are retried with exponential backoff; entries that were given up on
+    get a fresh set of attempts. Documents already uploaded are not uploaded again.
+    
+    Args:
+        args (argparse.Namespace): The parsed command line arguments
+    """
+    api_key = os.environ.get("LUCID_API_KEY", "").strip() or input("Enter your Lucid API key: ").strip()
+    if not api_key:
+        print("Error: API key cannot be empty")
+        sys.exit(1)
+    
+    uploader = open_uploader(create_api_client(api_key, args), args)
+    requeued = uploader.spool.requeue_failed()
+    counts = uploader.spool.counts()
+    print(f"Upload spool {uploader.spool.path}: {counts['pending']} pending ({requeued} previously failed), "
+          f"{counts['uploaded']} already uploaded")
+    
+    counts = uploader.drain()
+    print(f"\n{counts['uploaded']} uploaded, {counts['pending']} pending, {counts['failed']} failed")
+    for entry in uploader.spool.entries("failed"):
+        print(f"  {entry['file_path']}: {entry['last_error']}")
+    
+    if counts["pending"] or counts["failed"]:
+        sys.exit(1)
+
+def run_diff(args):
+    """
+    Generate diagrams highlighting the rules changed between two workbooks
+    
+    Only the software types whose rules changed are generated. Added rules and
+    entities are drawn in green, removed ones in red and changed ones in orange.
+    
+    Args:
+        args (argparse.Namespace): The parsed command line arguments
+    """
+    from diff_mode import diff_rules, summarize_diff
+    
+    try:
+        normalized = []
+        for path in args.diff:
+            path = resolve_workbook_path(path)
+            print(f"Reading Excel data from {path}...")
+            df, _ = normalize_rules(read_workbook(path, args), AZ_GRID_POSITIONS.keys())
+            normalized.append(df)
+        
+        diff = diff_rules(*normalized)
+        summary = summarize_diff(diff)
+        
+        if not summary:
+            print("No rule changes found between the two workbooks")
+            return
+        
+        output_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "output")
+        os.makedirs(output_dir, exist_ok=True)
+        ledger = open_metrics_ledger(args)
+        workbook_name = os.path.splitext(os.path.basename(args.diff[1]))[0]
+        
+        for software_type, counts in summary.items():
+            print(f"\n{software_type}: {counts['added']} added, {counts['removed']} removed, "
+                  f"{counts['changed']} changed")
+            
+            output_path = os.path.join(output_dir, f"{software_type.replace(' ', '_')}_diff.lucid")
+            metrics = {}
+            create_lucid_file(filter_by_software_type(diff, software_type), software_type, output_path,
+                              args.lod_threshold, args.bundle_threshold, metrics=metrics,
+                              bundle_fan_out=args.bundle_fan_out)
+            print_collapsed(metrics)
+            print(f"Created diff diagram: {output_path}")
+            record_metrics(ledger, metrics, "diff", workbook_name, os.path.basename(output_path))
+    except Exception as e:
+        print(f"Error: {str(e)}")
+        sys.exit(1)
+
+def run_all_workbooks(args):
+    """
+    Generate the diagrams of every workbook in the source data directory
+    
+    Workbooks are read concurrently and their diagrams are fed into a staged
+    pipeline (layout, packaging, then upload with --upload) as soon as they have
+    been read. Diagrams are written to output/<workbook>/, one per software type,
+    or one multi-page document per workbook with --pages. With --layout-state,
+    each workbook keeps its placement in its own file next to the given path.
+    
+    Args:
+        args (argparse.Namespace): The parsed command line arguments
+    """
+    source_data_dir = get_source_data_dir()
+    excel_files = []
+    if os.path.isdir(source_data_dir):
+        excel_files = sorted(os.path.join(source_data_dir, f) for f in os.listdir(source_data_dir)
+                             if f.endswith('.xlsx') or f.endswith('.xls'))
+    
+    if not excel_files:
+        print(f"Error: No Excel files found in {source_data_dir}")
+        sys.exit(1)
+    
+    client = None
+    if args.upload or args.upload_only:
+        api_key = os.environ.get("LUCID_API_KEY", "").strip()
+        if not api_key:
+            print("Error: uploading requires the LUCID_API_KEY environment variable")
+            sys.exit(1)
+        client = create_api_client(api_key, args)
+        if not args.upload_only:
+            # Files on disk go through the upload spool, so failed uploads can be retried
+            client = open_uploader(client, args)
+    
+    # Layout, packaging and upload run as pipeline stages, so the next diagram is
+    # laid out while the previous one is zipped and uploaded
+    generator = LucidGenerator(LayoutConfig(args.lod_threshold, args.bundle_threshold, args.bundle_fan_out))
+    pipeline = DiagramPipeline(generator, client, layout_workers=args.layout_threads,
+                               package_workers=args.package_workers,
+                               upload_workers=args.upload_workers, queue_size=args.queue_size)
+    # Start profiling first, so the pipeline's worker threads are profiled too
+    profiler = start_profiler("all_workbooks", args)
+    try:
+        pipeline.start()
+        
+        print(f"Reading {len(excel_files)} Excel files...")
+        failures = 0
+        layout_states = []
+        
+        for path, df, error in read_workbooks(excel_files, args.read_workers, args.streaming_read):
+            workbook_name = os.path.splitext(os.path.basename(path))[0]
+            if error is not None:
+                print(f"Error reading {os.path.basename(path)}: {str(error)}")
+                failures += 1
+                continue
+            
+            try:
+                timings = {"read": df.attrs.get("read_seconds", 0.0)}
+                started = time.perf_counter()
+                df, stats = normalize_rules(df, AZ_GRID_POSITIONS.keys())
+                timings["normalize"] = time.perf_counter() - started
+                print(f"\n{os.path.basename(path)}: {stats['rows_after']} rules")
+                
+                software_types = get_software_types(df)
+                if args.pages:
+                    software_types = select_software_types(software_types, args.pages)
+                pages = [(filter_by_software_type(df, software_type), software_type) for software_type in software_types]
+                
+                output_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "output",
+                                          workbook_name.replace(' ', '_'))
+                if not args.upload_only:
+                    os.makedirs(output_dir, exist_ok=True)
+                
+                # Software types may repeat across workbooks, so each workbook keeps its own layout state
+                layout_state = None
+                if args.layout_state:
+                    root, ext = os.path.splitext(args.layout_state)
+                    layout_state = LayoutState(f"{root}.{workbook_name.replace(' ', '_')}{ext or '.json'}")
+                    layout_states.append(layout_state)
+                
+                # Submitting blocks while the layout stage is full, which throttles reading
+                if args.pages:
+                    jobs = [{
+                        "pages": pages,
+                        "software_type": ", ".join(software_types),
+                        "filename": f"{workbook_name.replace(' ', '_')}_pages.lucid",
+                        "title": f"Firewall Rules - {workbook_name}"
+                    }]
+                else:
+                    jobs = [{
+                        "filtered_data": filtered_data,
+                        "software_type": software_type,
+                        "filename": f"{software_type.replace(' ', '_')}.lucid"
+                    } for filtered_data, software_type in pages]
+                
+                for job in jobs:
+                    job["layout_state"] = layout_state
+                    # With --upload-only the archive stays in memory until it is uploaded
+                    if not args.upload_only:
+                        job["output_path"] = os.path.join(output_dir, job["filename"])
+                    job["name"] = f"{workbook_name}/{job['filename']}"
+                    job["workbook"] = workbook_name
+                    job["timings"] = timings
+                    job["metrics"] = {}
+                    pipeline.submit(job)
+            except Exception as e:
+                print(f"Error generating diagrams for {os.path.basename(path)}: {str(e)}")
+                failures += 1
+        
+        results = pipeline.close()
+    finally:
+        stop_profiler(profiler)
+    ledger = open_metrics_ledger(args)
+    retry_uploads = False
+    for job in results:
+        if job.get("failed_stage") in (None, "upload"):
+            # The upload is timed only when it succeeded at once
+            timings = dict(job["timings"])
+            if "upload" in job:
+                timings["upload"] = job["stage_seconds"]["upload"]
+            record_metrics(ledger, job["metrics"], "batch", job["workbook"], job["filename"], timings)
+            print_collapsed(job["metrics"])
+        if "output_path" in job and job.get("failed_stage") in (None, "upload"):
+            print(f"Created Lucid diagram: {job['output_path']}")
+        if isinstance(client, SpooledUploader) and job.get("failed_stage") == "upload":
+            # The file stays in the upload spool and is retried below
+            print(f"Upload of {job['name']} failed, will retry: {job['error']}")
+            retry_uploads = True
+        elif job["error"] is not None:
+            print(f"Error generating {job['name']}: {job['error']}")
+            failures += 1
+        elif "upload" in job:
+            print(f"Uploaded {job['name']} to Lucid: {job['upload'].get('document_url')}")
+    
+    if retry_uploads:
+        print("\nRetrying failed uploads...")
+        output_paths = {os.path.abspath(job["output_path"]) for job in results if "output_path" in job}
+        client.drain(output_paths)
+        for entry in client.spool.entries():
+            if entry["file_path"] in output_paths and entry["status"] != "uploaded":
+                print(f"Upload of {entry['file_path']} still failing: {entry['last_error']}")
+                failures += 1
+        if failures:
+            print("Run with --resume-uploads to retry the remaining uploads later")
+    
+    for layout_state in layout_states:
+        layout_state.save()
+        print(f"Saved layout state to {layout_state.path}")
+    
+    print("\nPipeline stages:")
+    for line in pipeline.format_metrics():
+        print(f"  {line}")
+    
+    if failures:
+        print(f"\n{failures} workbooks or diagrams failed")
+        sys.exit(1)
+
+def main(args):
     """
     Main function to run the Lucid Firewall Diagram Generator
+    
+    Args:
+        args (argparse.Namespace): The parsed command line arguments
     """
     # Let the user select an Excel file
     print("Select an Excel file to use:")
@@ -97,7 +609,16 @@ def main():
     try:
         # Read the Excel data
         print(f"Reading Excel data from {excel_file_path}...")
-        df = read_excel_data(excel_file_path)
+        started = time.perf_counter()
+        df = read_workbook(excel_file_path, args)
+        timings = {"read": time.perf_counter() - started}
+        
+        # Normalize the rules and collapse duplicate or overlapping rows
+        started = time.perf_counter()
+        df, stats = normalize_rules(df, AZ_GRID_POSITIONS.keys())
+        timings["normalize"] = time.perf_counter() - started
+        print(f"Normalized {stats['rows_before']} rules to {stats['rows_after']} "
+              f"({stats['rows_eliminated']} duplicate or overlapping rows eliminated)")
         
         # Get the list of software types
         software_types = get_software_types(df)
@@ -106,35 +627,88 @@ def main():
             print("Error: No software types found in the Excel file")
             sys.exit(1)
         
-        # Display menu and get user selection
-        selection = display_menu(software_types)
-        selected_software_type = software_types[selection]
-        
-        # Filter the data by the selected software type
-        print(f"\nGenerating diagram for: {selected_software_type}")
-        filtered_data = filter_by_software_type(df, selected_software_type)
+        if args.pages:
+            # Pack the selected software types as pages of a single document
+            selected_software_types = select_software_types(software_types, args.pages)
+            workbook_name = os.path.splitext(os.path.basename(excel_file_path))[0]
+            document_title = f"Firewall Rules - {workbook_name}"
+            output_filename = f"{workbook_name.replace(' ', '_')}_pages.lucid"
+        else:
+            # Display menu and get user selection
+            selection = display_menu(software_types)
+            selected_software_types = [software_types[selection]]
+            document_title = f"Firewall Rules - {software_types[selection]}"
+            output_filename = f"{software_types[selection].replace(' ', '_')}.lucid"
         
-        if filtered_data.empty:
-            print(f"Error: No data found for software type '{selected_software_type}'")
-            sys.exit(1)
+        # Filter the data by the selected software types
+        pages = []
+        for selected_software_type in selected_software_types:
+            print(f"\nGenerating diagram for: {selected_software_type}")
+            filtered_data = filter_by_software_type(df, selected_software_type)
+            
+            if filtered_data.empty:
+                print(f"Error: No data found for software type '{selected_software_type}'")
+                sys.exit(1)
+            
+            pages.append((filtered_data, selected_software_type))
         
-        # Create output directory if it doesn't exist
-        output_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "output")
-        os.makedirs(output_dir, exist_ok=True)
+        # Load the placement remembered from earlier runs
+        layout_state = LayoutState(args.layout_state) if args.layout_state else None
         
-        # Define the output path
-        output_filename = f"{selected_software_type.replace(' ', '_')}.lucid"
-        output_path = os.path.join(output_dir, output_filename)
+        # Counts, sizes and timings of this generation, recorded in the metrics ledger
+        metrics = {}
+        profiler = start_profiler(os.path.splitext(output_filename)[0], args)
         
-        # Create the Lucid file
-        print(f"Creating Lucid diagram...")
-        create_lucid_file(filtered_data, selected_software_type, output_path)
+        try:
+            if args.upload_only:
+                # Keep the archive in memory; it is only uploaded
+                print(f"Creating Lucid diagram in memory...")
+                if args.pages:
+                    lucid_file = create_multi_page_lucid_buffer(pages, args.lod_threshold, args.bundle_threshold,
+                                                                layout_state, metrics,
+                                                                bundle_fan_out=args.bundle_fan_out)
+                else:
+                    filtered_data, selected_software_type = pages[0]
+                    lucid_file = create_lucid_buffer(filtered_data, selected_software_type, args.lod_threshold,
+                                                     args.bundle_threshold, layout_state, metrics,
+                                                     bundle_fan_out=args.bundle_fan_out)
+            else:
+                # Create output directory if it doesn't exist
+                output_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "output")
+                os.makedirs(output_dir, exist_ok=True)
+                
+                # Define the output path
+                lucid_file = os.path.join(output_dir, output_filename)
+                
+                # Create the Lucid file
+                print(f"Creating Lucid diagram...")
+                if args.pages:
+                    create_multi_page_lucid_file(pages, lucid_file, args.lod_threshold, args.bundle_threshold,
+                                                 layout_state, metrics,
+                                                 bundle_fan_out=args.bundle_fan_out)
+                else:
+                    filtered_data, selected_software_type = pages[0]
+                    create_lucid_file(filtered_data, selected_software_type, lucid_file,
+                                      args.lod_threshold, args.bundle_threshold, layout_state,
+                                      metrics, bundle_fan_out=args.bundle_fan_out)
+        finally:
+            stop_profiler(profiler)
+        print_collapsed(metrics)
+        record_metrics(open_metrics_ledger(args), metrics, "interactive",
+                       os.path.splitext(os.path.basename(excel_file_path))[0], output_filename, timings)
         
-        print(f"\nSuccessfully created Lucid diagram: {output_path}")
-        print("You can import this file into Lucid to view the diagram.")
+        if layout_state is not None:
+            layout_state.save()
+            print(f"Saved layout state to {args.layout_state}")
         
-        # Ask if the user wants to upload to Lucid
-        upload_choice = input("\nWould you like to upload this diagram to Lucid? (y/n): ").strip().lower()
+        if args.upload_only:
+            upload_choice = 'y'
+        else:
+            print(f"\nSuccessfully created Lucid diagram: {lucid_file}")
+            print("You can import this file into Lucid to view the diagram.")
+            
+            # Ask if the user wants to upload to Lucid
+            upload_choice = input("\nWould you like to upload this diagram to Lucid? (y/n): ").strip().lower()
         
         if upload_choice in ('y', 'yes'):
             try:
@@ -146,25 +720,46 @@ def main():
                     print("API key cannot be empty. Skipping upload.")
                     return
                 
-                # Create API client
-                client = LucidApiClient(api_key)
+                # Create API client; files on disk go through the upload spool so a
+                # failed upload can be retried with --resume-uploads
+                client = create_api_client(api_key, args)
+                if not args.upload_only:
+                    client = open_uploader(client, args)
                 
                 # Upload the document
                 print("Uploading to Lucid...")
-                response = client.upload_document(output_path, f"Firewall Rules - {selected_software_type}")
+                response = client.upload_document(lucid_file, document_title, output_filename)
                 
                 print(f"\nSuccess! Document uploaded to Lucid.")
                 print(f"Document URL: {response['document_url']}")
                 
             except Exception as e:
                 print(f"Error uploading to Lucid: {str(e)}")
-                print("The .lucid file is still available locally.")
+                if not args.upload_only:
+                    print("The .lucid file is still available locally.")
+                    print("It is kept in the upload spool; run with --resume-uploads to retry the upload.")
         
     except Exception as e:
         print(f"Error: {str(e)}")
         sys.exit(1)
 
 if __name__ == "__main__":
+    args = parse_args()
+    
     print("Lucid Firewall Diagram Generator")
     print("--------------------------------")
-    main()
+    
+    if args.serve:
+        from server import serve
+        serve(get_source_data_dir(), args.host, args.port, args.cache_mb,
+              args.lod_threshold, args.bundle_threshold)
+    elif args.metrics_report:
+        run_metrics_report(args)
+    elif args.resume_uploads:
+        run_resume_uploads(args)
+    elif args.diff:
+        run_diff(args)
+    elif args.all_workbooks:
+        run_all_workbooks(args)
+    else:
+        main(args)
@@ -0,0 +1,183 @@
+import json
+import os
+import statistics
+import threading
+from datetime import datetime, timezone
+
+# Counts summed over the pages of a document
+COUNT_FIELDS = ("rows", "entities", "containers", "shapes", "lines")
+
+# Phases timed by the generator; reading, normalizing and uploading are timed by the caller
+GENERATION_PHASES = ("layout", "routing", "write")
+
+
+def build_record(metrics, mode, workbook, document, timings=None):
+    """
+    Build a ledger record from the metrics filled in by a generation
+
+    Args:
+        metrics (dict): Metrics filled in by LucidGenerator (pages, sizes and *_seconds timings)
+        mode (str): How the document was generated, e.g. "interactive", "batch" or "diff"
+        workbook (str): Name of the workbook the rules were read from
+        document (str): File name of the generated document
+        timings (dict): Further phase timings in seconds, e.g. {"read": 0.8}
+
+    Returns:
+        dict: The record
+    """
+    pages = metrics.get("pages", [])
+    record = {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "mode": mode,
+        "workbook": workbook,
+        "document": document,
+        "software_types": [page["software_type"] for page in pages]
+    }
+    for field in COUNT_FIELDS:
+        record[field] = sum(page[field] for page in pages)
+    record["document_bytes"] = metrics.get("document_bytes")
+    record["archive_bytes"] = metrics.get("archive_bytes")
+    record["pages"] = pages
+
+    record_timings = {phase: metrics[f"{phase}_seconds"] for phase in GENERATION_PHASES
+                      if f"{phase}_seconds" in metrics}
+    record_timings.update(timings or {})
+    record["timings"] = {phase: round(seconds, 4) for phase, seconds in record_timings.items()}
+    return record
+
+
+class MetricsLedger:
+    """
+    Append-only JSON Lines file with one metrics record per generated document
+
+    Each record is written as a single line in append mode, so records of
+    concurrent runs do not interleave, and a line cut short by a crash only
+    loses that record.
+    """
+
+    def __init__(self, path):
+        """
+        Initialize the ledger
+
+        Args:
+            path (str): Path to the JSON Lines file; created on the first append
+        """
+        self.path = path
+        self._lock = threading.Lock()
+
+    def append(self, record):
+        """
+        Append a record to the ledger
+
+        Args:
+            record (dict): The record, as built by build_record
+        """
+        line = json.dumps(record, separators=(",", ":")) + "\n"
+        with self._lock:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+
+    def records(self):
+        """
+        Read every record in the ledger, oldest first
+
+        Returns:
+            list: The records; lines that cannot be parsed are skipped
+        """
+        if not os.path.exists(self.path):
+            return []
+
+        records = []
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue
+        return records
+
+
+def _generation_seconds(record):
+    return sum(record["timings"].get(phase, 0.0) for phase in GENERATION_PHASES)
+
+
+def _growth(first, latest):
+    if not first:
+        return ""
+    return f" ({(latest - first) / first:+.1%})"
+
+
+def format_report(records, threshold=0.25, window=10, min_seconds=0.05):
+    """
+    Format a per-software-type report of growth and timing regressions
+
+    Counts are compared between the first and the latest generation of each
+    software type. The time to generate a diagram is compared per 1,000 rules,
+    so a diagram that only got slower because it grew is not flagged; the latest
+    generation is flagged as a regression when it is more than `threshold`
+    slower than the median of the `window` generations before it. Timings are
+    only taken from single-page documents, since multi-page documents are timed
+    as a whole.
+
+    Args:
+        records (list): Ledger records, oldest first
+        threshold (float): Slowdown over the median flagged as a regression, e.g. 0.25 for 25%
+        window (int): Number of earlier generations the latest one is compared to
+        min_seconds (float): Slowdowns smaller than this many seconds are not flagged
+
+    Returns:
+        list: The lines of the report
+    """
+    history = {}
+    for record in records:
+        single_page = len(record["pages"]) == 1
+        for page in record["pages"]:
+            history.setdefault(page["software_type"], []).append((record, page, single_page))
+
+    if not history:
+        return ["No generations recorded yet"]
+
+    lines = []
+    regressions = 0
+    for software_type in sorted(history):
+        entries = history[software_type]
+        first_record, first_page, _ = entries[0]
+        latest_record, latest_page, _ = entries[-1]
+        lines.append(f"{software_type}: {len(entries)} generations from {first_record['timestamp']} "
+                     f"to {latest_record['timestamp']}")
+        for field in COUNT_FIELDS:
+            lines.append(f"  {field:<16}{first_page[field]:>10} -> {latest_page[field]:<10}"
+                         f"{_growth(first_page[field], latest_page[field])}")
+
+        timed = [(record, page) for record, page, single_page in entries if single_page]
+        if not timed:
+            continue
+
+        first_timed, latest_timed = timed[0][0], timed[-1][0]
+        if first_timed["archive_bytes"] is not None and latest_timed["archive_bytes"] is not None:
+            lines.append(f"  {'archive KB':<16}{first_timed['archive_bytes'] / 1024:>10.1f} -> "
+                         f"{latest_timed['archive_bytes'] / 1024:<10.1f}"
+                         f"{_growth(first_timed['archive_bytes'], latest_timed['archive_bytes'])}")
+
+        record, page = timed[-1]
+        seconds = _generation_seconds(record)
+        phases = ", ".join(f"{phase} {record['timings'][phase]:.3f} s" for phase in record["timings"])
+        lines.append(f"  {'generate':<16}{seconds:>10.3f} s ({phases})")
+
+        previous = timed[-window - 1:-1]
+        if previous and page["rows"]:
+            # Compare the cost per 1,000 rules, which stays flat while a diagram only grows
+            cost = seconds / page["rows"] * 1000
+            baseline = statistics.median(_generation_seconds(r) / p["rows"] * 1000 for r, p in previous if p["rows"])
+            change = (cost - baseline) / baseline if baseline else 0.0
+            status = ""
+            if change > threshold and seconds - baseline * page["rows"] / 1000 > min_seconds:
+                status = "  REGRESSION"
+                regressions += 1
+            lines.append(f"  {'s per 1k rules':<16}{cost:>10.3f}    median of previous {len(previous)}: "
+                         f"{baseline:.3f} ({change:+.1%}){status}")
+
+    lines.append("")
+    lines.append(f"{len(records)} generations of {len(history)} software types, {regressions} timing regressions")
+    return lines
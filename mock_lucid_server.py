@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class MockLucidBehavior:
+    """
+    Latency and failures injected by the mock Lucid server
+
+    Every request draws its latency and outcome from one seeded random
+    generator, so a load test with the same seed and settings sees the same
+    mix of failures.
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, rate_limit_rate=0.0, error_rate=0.0, retry_after=1, seed=0,
+                 rate_limit=None):
+        """
+        Initialize the injected behavior
+
+        Args:
+            latency (float): Seconds each upload takes before the response is sent
+            jitter (float): Maximum extra random latency in seconds
+            rate_limit_rate (float): Fraction of uploads answered with 429 Too Many Requests
+            error_rate (float): Fraction of uploads answered with a 500 or 503 error
+            retry_after (int): Retry-After value in seconds sent with 429 responses
+            seed (int): Seed of the random generator
+            rate_limit (int): Uploads accepted per one-second window before answering 429, or None
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit_rate = rate_limit_rate
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.rate_limit = rate_limit
+        self._window = (0, 0)
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.counts = {"requests": 0, "created": 0, "rate_limited": 0, "errors": 0, "rejected": 0, "bytes": 0}
+
+    def draw(self):
+        """
+        Draw the latency and outcome of the next upload
+
+        Returns:
+            tuple: (latency in seconds, status code)
+        """
+        with self._lock:
+            delay = self.latency + self._random.uniform(0, self.jitter)
+            roll = self._random.random()
+            if roll < self.rate_limit_rate:
+                return delay, 429
+            if roll < self.rate_limit_rate + self.error_rate:
+                return delay, self._random.choice((500, 503))
+            return delay, 201
+
+    def admit(self):
+        """
+        Count an upload against the fixed one-second rate limit window
+
+        Returns:
+            tuple: (whether the upload is admitted, requests left in the window, Unix time the window resets)
+        """
+        with self._lock:
+            window = int(time.time())
+            start, used = self._window
+            if start != window:
+                used = 0
+            used += 1
+            self._window = (window, used)
+            if self.rate_limit is None:
+                return True, None, window + 1
+            return used <= self.rate_limit, max(0, self.rate_limit - used), window + 1
+
+    def count(self, key, amount=1):
+        with self._lock:
+            self.counts[key] += amount
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counts)
+
+
+class MockLucidRequestHandler(BaseHTTPRequestHandler):
+    """
+    HTTP request handler imitating the Lucid document import endpoint
+
+    Endpoints:
+        POST /documents (multipart/form-data with title, product and file)
+        GET /stats
+    """
+
+    behavior = None
+    # Uploads need HTTP/1.1 so clients can keep connections alive between requests
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        if self.path != "/documents":
+            self._read_body()
+            self._send_json({"message": f"Unknown endpoint: {self.path}"}, 404)
+            return
+
+        self.behavior.count("requests")
+        body = self._read_body()
+        self.behavior.count("bytes", len(body))
+
+        # Reject requests the real API would reject before injecting failures
+        content_type = self.headers.get("Content-Type", "")
+        if not self.headers.get("Authorization", "").startswith("Bearer "):
+            self.behavior.count("rejected")
+            self._send_json({"message": "Missing bearer token"}, 401)
+            return
+        if not content_type.startswith("multipart/form-data") or b'name="file"' not in body:
+            self.behavior.count("rejected")
+            self._send_json({"message": "Expected a multipart upload with a file"}, 400)
+            return
+
+        admitted, remaining, reset = self.behavior.admit()
+        rate_headers = {}
+        if remaining is not None:
+            rate_headers = {"X-RateLimit-Limit": str(self.behavior.rate_limit),
+                            "X-RateLimit-Remaining": str(remaining), "X-RateLimit-Reset": str(reset)}
+        if not admitted:
+            # Over the real rate limit: answer at once, like an API gateway would
+            self.behavior.count("rate_limited")
+            self._send_json({"message": "Rate limit exceeded"}, 429,
+                            dict(rate_headers, **{"Retry-After": str(max(1, int(reset - time.time() + 0.999)))}))
+            return
+
+        delay, status = self.behavior.draw()
+        time.sleep(delay)
+
+        if status == 429:
+            self.behavior.count("rate_limited")
+            self._send_json({"message": "Rate limit exceeded"}, 429,
+                            dict(rate_headers, **{"Retry-After": str(self.behavior.retry_after)}))
+        elif status >= 500:
+            self.behavior.count("errors")
+            self._send_json({"message": "Injected server error"}, status, rate_headers)
+        else:
+            self.behavior.count("created")
+            document_id = str(uuid.uuid4())
+            self._send_json({
+                "documentId": document_id,
+                "editUrl": f"https://lucid.app/lucidchart/{document_id}/edit"
+            }, 201, rate_headers)
+
+    def do_GET(self):
+        if self.path == "/stats":
+            self._send_json(self.behavior.stats())
+        else:
+            self._send_json({"message": f"Unknown endpoint: {self.path}"}, 404)
+
+    def log_message(self, format, *args):
+        # Load tests send many requests; only the totals in /stats matter
+        pass
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        chunks = []
+        while length > 0:
+            chunk = self.rfile.read(min(length, 64 * 1024))
+            if not chunk:
+                break
+            chunks.append(chunk)
+            length -= len(chunk)
+        return b"".join(chunks)
+
+    def _send_json(self, data, status=200, extra_headers=None):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (extra_headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_mock_server(behavior, host="127.0.0.1", port=0):
+    """
+    Start the mock Lucid server in a background thread
+
+    Args:
+        behavior (MockLucidBehavior): Latency and failures to inject
+        host (str): Interface to listen on
+        port (int): Port to listen on, or 0 for any free port
+
+    Returns:
+        ThreadingHTTPServer: The running server; call shutdown() to stop it. Its
+            base URL is http://HOST:PORT using server.server_address
+    """
+    handler = type("BoundMockLucidRequestHandler", (MockLucidRequestHandler,), {"behavior": behavior})
+    httpd = ThreadingHTTPServer((host, port), handler)
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, name="mock-lucid-server", daemon=True).start()
+    return httpd
+
+
+def parse_args():
+    """
+    Parse the command line arguments
+
+    Returns:
+        argparse.Namespace: The parsed arguments
+    """
+    parser = argparse.ArgumentParser(description="Mock Lucid /documents endpoint for upload load tests")
+    parser.add_argument("--host", default="127.0.0.1", help="Interface to listen on (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8081, help="Port to listen on (default: 8081)")
+    parser.add_argument("--latency", type=float, default=0.2, help="Seconds per upload (default: 0.2)")
+    parser.add_argument("--jitter", type=float, default=0.1, help="Maximum extra random latency (default: 0.1)")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0,
+                        help="Fraction of uploads answered with 429 (default: 0)")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="Fraction of uploads answered with 500 or 503 (default: 0)")
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After seconds sent with 429 (default: 1)")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed (default: 0)")
+    parser.add_argument("--rate-limit", type=int, default=None,
+                        help="Uploads accepted per second before answering 429 with rate limit headers")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    behavior = MockLucidBehavior(args.latency, args.jitter, args.rate_limit_rate, args.error_rate,
+                                 args.retry_after, args.seed, args.rate_limit)
+    httpd = start_mock_server(behavior, args.host, args.port)
+
+    print(f"Mock Lucid API listening on http://{args.host}:{httpd.server_address[1]}")
+    print("Press Ctrl+C to stop.")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        print(f"\nShutting down mock server: {behavior.stats()}")
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
@@ -0,0 +1,261 @@
+import io
+import queue
+import threading
+import time
+
+from lucid_generator import write_lucid_archive
+
+# Marks the end of the work for a stage's workers
+_DONE = object()
+
+
+class StageMetrics:
+    """
+    Throughput counters for one pipeline stage
+    """
+
+    def __init__(self, name, workers):
+        """
+        Initialize the stage metrics
+
+        Args:
+            name (str): Name of the stage
+            workers (int): Number of worker threads in the stage
+        """
+        self.name = name
+        self.workers = workers
+        self.items = 0
+        self.errors = 0
+        self.busy_seconds = 0.0
+        self.blocked_seconds = 0.0
+        self.started = None
+        self.finished = None
+        self._lock = threading.Lock()
+
+    def record(self, busy_seconds, blocked_seconds, error=False):
+        """
+        Record one processed item
+
+        Args:
+            busy_seconds (float): Time spent processing the item
+            blocked_seconds (float): Time spent waiting for room in the next stage's queue
+            error (bool): Whether processing the item failed
+        """
+        with self._lock:
+            self.items += 1
+            self.errors += 1 if error else 0
+            self.busy_seconds += busy_seconds
+            self.blocked_seconds += blocked_seconds
+
+    def summary(self):
+        """
+        Get the stage metrics
+
+        Returns:
+            dict: Item and error counts, busy and blocked time, and throughput
+        """
+        with self._lock:
+            elapsed = (self.finished or time.perf_counter()) - self.started if self.started else 0.0
+            return {
+                "stage": self.name,
+                "workers": self.workers,
+                "items": self.items,
+                "errors": self.errors,
+                "busy_seconds": round(self.busy_seconds, 3),
+                "blocked_seconds": round(self.blocked_seconds, 3),
+                "elapsed_seconds": round(elapsed, 3),
+                "items_per_second": round(self.items / elapsed, 2) if elapsed else 0.0
+            }
+
+
+class DiagramPipeline:
+    """
+    Staged producer/consumer pipeline: layout, then packaging, then upload
+
+    Each stage runs in its own worker threads and hands items to the next stage
+    through a bounded queue, so the layout of the next diagram overlaps with
+    packaging and with the network-bound upload of the previous one. When a
+    downstream stage falls behind its queue fills up and the upstream stage
+    blocks (back-pressure) instead of piling up finished documents in memory.
+
+    The layout stage hands on streaming documents: shapes are laid out, but
+    lines are only routed while the package stage writes them into the archive.
+    A document waiting in a queue therefore holds its shapes but none of its
+    lines, and routing time and errors show up in the package stage.
+
+    A job is a dict with "software_type" and either "filtered_data" or, for a
+    multi-page document, "pages" (a list of (filtered_data, software_type) tuples).
+    With an "output_path" the archive is written to that file; without one it is
+    kept in memory and only uploaded. A job may also carry "filename" (sent with
+    the upload), "title" (the upload title) and "layout_state", overriding the
+    pipeline's layout state, and "metrics", a dict filled with the counts, sizes
+    and timings of the generation. Upload is skipped without a client. A failed
+    job skips the remaining stages and records the stage in "failed_stage". Each
+    finished job records the seconds spent in every stage in "stage_seconds".
+    """
+
+    def __init__(self, generator, client=None, layout_workers=1, package_workers=1, upload_workers=1,
+                 queue_size=2, layout_state=None):
+        """
+        Initialize the pipeline
+
+        Args:
+            generator (LucidGenerator): Generator used to lay out the diagrams
+            client (LucidApiClient): Client used to upload the archives, or None to skip uploading
+            layout_workers (int): Number of layout threads; layout is CPU-bound and holds
+                the GIL, so more than one thread mostly helps when another stage waits on I/O
+            package_workers (int): Number of threads serializing and zipping documents
+            upload_workers (int): Number of upload threads
+            queue_size (int): Maximum number of items waiting between two stages
+            layout_state (LayoutState): Placement remembered from earlier runs, or None
+        """
+        self.generator = generator
+        self.client = client
+        self.layout_state = layout_state
+
+        self._stages = [("layout", layout_workers, self._layout), ("package", package_workers, self._package)]
+        if client is not None:
+            self._stages.append(("upload", upload_workers, self._upload))
+
+        # One bounded queue feeds each stage; the last stage hands finished jobs to the results
+        self._queues = [queue.Queue(maxsize=queue_size) for _ in self._stages]
+        self.metrics = {name: StageMetrics(name, workers) for name, workers, _ in self._stages}
+        self.results = []
+        self._results_lock = threading.Lock()
+        self._threads = []
+
+    def start(self):
+        """
+        Start the worker threads of every stage
+        """
+        for index, (name, workers, handler) in enumerate(self._stages):
+            self.metrics[name].started = time.perf_counter()
+            stage_threads = []
+            for worker in range(workers):
+                thread = threading.Thread(target=self._work, args=(index, handler, stage_threads),
+                                          name=f"pipeline-{name}-{worker + 1}", daemon=True)
+                stage_threads.append(thread)
+                self._threads.append(thread)
+            for thread in stage_threads:
+                thread.start()
+
+    def submit(self, job):
+        """
+        Add a job to the pipeline, blocking while the layout queue is full
+
+        Args:
+            job (dict): The job to process
+        """
+        job.setdefault("error", None)
+        job.setdefault("stage_seconds", {})
+        self._queues[0].put(job)
+
+    def close(self):
+        """
+        Wait for every submitted job to finish and stop the workers
+
+        Returns:
+            list: The finished jobs, each with an "error" key (None on success)
+        """
+        self._queues[0].put(_DONE)
+        for thread in self._threads:
+            thread.join()
+        return self.results
+
+    def run(self, jobs):
+        """
+        Process a sequence of jobs and wait for all of them to finish
+
+        Args:
+            jobs (iterable): The jobs to process
+
+        Returns:
+            list: The finished jobs, each with an "error" key (None on success)
+        """
+        self.start()
+        for job in jobs:
+            self.submit(job)
+        return self.close()
+
+    def format_metrics(self):
+        """
+        Format the per-stage metrics for printing
+
+        Returns:
+            list: One line per stage
+        """
+        lines = []
+        for metrics in self.metrics.values():
+            summary = metrics.summary()
+            lines.append(f"{summary['stage']}: {summary['items']} items ({summary['errors']} failed) "
+                         f"with {summary['workers']} workers, {summary['busy_seconds']:.2f} s busy, "
+                         f"{summary['blocked_seconds']:.2f} s blocked, {summary['items_per_second']:.2f} items/s")
+        return lines
+
+    def _work(self, index, handler, stage_threads):
+        """
+        Worker loop of a stage: take jobs from the stage's queue and pass them on
+        """
+        name = self._stages[index][0]
+        metrics = self.metrics[name]
+        inbox = self._queues[index]
+        outbox = self._queues[index + 1] if index + 1 < len(self._queues) else None
+
+        while True:
+            job = inbox.get()
+            if job is _DONE:
+                # Let the other workers of this stage see the end marker too, and have
+                # the last one to finish close the next stage
+                inbox.put(_DONE)
+                with metrics._lock:
+                    stage_threads.remove(threading.current_thread())
+                    last = not stage_threads
+                    if last:
+                        metrics.finished = time.perf_counter()
+                if last and outbox is not None:
+                    outbox.put(_DONE)
+                return
+
+            started = time.perf_counter()
+            error = False
+            try:
+                handler(job)
+            except Exception as e:
+                job["error"] = f"{name} failed: {str(e)}"
+                job["failed_stage"] = name
+                error = True
+            busy = time.perf_counter() - started
+            job["stage_seconds"][name] = busy
+
+            # Failed jobs skip the remaining stages
+            if outbox is not None and not error:
+                outbox.put(job)
+            else:
+                with self._results_lock:
+                    self.results.append(job)
+            metrics.record(busy, time.perf_counter() - started - busy, error)
+
+    def _layout(self, job):
+        layout_state = job.get("layout_state", self.layout_state)
+        # Leave the lines as generators; they are routed while the package stage writes them
+        if "pages" in job:
+            job["document_json"] = self.generator._create_streaming_multi_page_document(
+                job.pop("pages"), layout_state, job.get("metrics"))
+        else:
+            job["document_json"] = self.generator._create_streaming_document(job.pop("filtered_data"),
+                                                                              job["software_type"], layout_state,
+                                                                              job.get("metrics"))
+
+    def _package(self, job):
+        # Without an output path the archive stays in memory until it is uploaded
+        target = job.get("output_path") or io.BytesIO()
+        # Stream the document into the archive instead of serializing it to one string first
+        write_lucid_archive(job.pop("document_json"), target, job.get("metrics"))
+        if not job.get("output_path"):
+            target.seek(0)
+            job["archive"] = target
+
+    def _upload(self, job):
+        title = job.get("title") or f"Firewall Rules - {job['software_type']}"
+        source = job.pop("archive", None) or job["output_path"]
+        job["upload"] = self.client.upload_document(source, title, job.get("filename"))
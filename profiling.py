@@ -0,0 +1,224 @@
+import cProfile
+import linecache
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+
+# Module whose allocation sites are reported separately
+GENERATOR_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "lucid_generator.py")
+
+# Number of entries in each section of the reports
+REPORT_LIMIT = 30
+
+
+class GenerationProfiler:
+    """
+    Runs a generation under cProfile and/or tracemalloc and writes the reports
+
+    Used as a context manager around the code to diagnose. With profile=True,
+    <name>.profile.txt lists the hot spots sorted by cumulative and by internal
+    time, and <name>.prof holds the raw statistics for pstats or a viewer such
+    as snakeviz. With trace_memory=True, <name>.memory.txt lists the top
+    allocation sites, those in lucid_generator.py first, and <name>.snapshot
+    holds the allocation snapshot for tracemalloc.Snapshot.load().
+
+    Threads started while profiling (such as pipeline workers) are profiled too.
+    Worker processes (--read-workers) are not. Memory is sampled every
+    `sample_interval` seconds and the snapshot taken at the highest memory use
+    is reported, since a streamed document has been freed again by the time
+    the generation returns.
+    """
+
+    def __init__(self, name, output_dir, profile=False, trace_memory=False, sample_interval=0.25, frames=25):
+        """
+        Initialize the profiler
+
+        Args:
+            name (str): Base name of the report files
+            output_dir (str): Directory the reports are written to
+            profile (bool): Profile CPU time with cProfile
+            trace_memory (bool): Trace memory allocations with tracemalloc
+            sample_interval (float): Seconds between memory snapshots
+            frames (int): Number of stack frames stored per allocation
+        """
+        self.name = name
+        self.output_dir = output_dir
+        self.profile = profile
+        self.trace_memory = trace_memory
+        self.sample_interval = sample_interval
+        self.frames = frames
+        self.paths = []
+        self._profiles = []
+        self._profiles_lock = threading.Lock()
+        self._peak_snapshot = None
+        self._peak_size = -1
+        self._stop_sampling = threading.Event()
+        self._sampler = None
+        self._started = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+        return False
+
+    def start(self):
+        """
+        Start profiling and tracing the current thread and threads started from now on
+        """
+        self._started = time.perf_counter()
+
+        if self.trace_memory:
+            tracemalloc.start(self.frames)
+            self._sampler = threading.Thread(target=self._sample, name="memory-sampler", daemon=True)
+            self._sampler.start()
+
+        if self.profile:
+            # Before Python 3.12 a profiler only sees the thread that enabled it, so
+            # every new thread enables its own profiler on its first call
+            if sys.version_info < (3, 12):
+                threading.setprofile(self._profile_thread)
+            self._profile_thread()
+
+    def stop(self):
+        """
+        Stop profiling and write the reports
+
+        Returns:
+            list: Paths of the written files
+        """
+        elapsed = time.perf_counter() - self._started
+
+        if self.profile:
+            if sys.version_info < (3, 12):
+                threading.setprofile(None)
+            # The profiler of the current thread is always the first one
+            self._profiles[0].disable()
+
+        # Stop tracing before the reports are written, so their allocations are not traced
+        if self.trace_memory:
+            self._stop_sampling.set()
+            self._sampler.join()
+            self._take_snapshot()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        if self.profile:
+            self._write_profile(elapsed)
+        if self.trace_memory:
+            self._write_memory(elapsed, peak)
+
+        return self.paths
+
+    def _profile_thread(self, *args):
+        """
+        Enable a profiler for the calling thread
+        """
+        profile = cProfile.Profile()
+        with self._profiles_lock:
+            self._profiles.append(profile)
+        profile.enable()
+
+    def _sample(self):
+        """
+        Take memory snapshots until profiling stops, keeping the largest
+        """
+        while not self._stop_sampling.wait(self.sample_interval):
+            self._take_snapshot()
+
+    def _take_snapshot(self):
+        size = tracemalloc.get_traced_memory()[0]
+        if size > self._peak_size:
+            snapshot = tracemalloc.take_snapshot().filter_traces([
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, __file__)
+            ])
+            self._peak_size = size
+            self._peak_snapshot = snapshot
+
+    def _write_profile(self, elapsed):
+        """
+        Write the sorted hot-spot report and the raw statistics
+        """
+        report_path = os.path.join(self.output_dir, f"{self.name}.profile.txt")
+        stats_path = os.path.join(self.output_dir, f"{self.name}.prof")
+
+        with open(report_path, "w", encoding="utf-8") as f:
+            stats = pstats.Stats(self._profiles[0], stream=f)
+            for profile in self._profiles[1:]:
+                stats.add(profile)
+            stats.dump_stats(stats_path)
+
+            f.write(f"Profile of {self.name}: {elapsed:.3f} s wall time in {len(self._profiles)} threads\n")
+            stats.strip_dirs()
+            for sort_key, title in (("cumulative", "cumulative time"), ("tottime", "internal time")):
+                f.write(f"\n=== Top {REPORT_LIMIT} functions by {title} ===\n")
+                stats.sort_stats(sort_key).print_stats(REPORT_LIMIT)
+
+            # Time spent waiting in other threads dominates the totals of a pipeline run
+            f.write(f"\n=== Top {REPORT_LIMIT} functions in lucid_generator.py by cumulative time ===\n")
+            stats.sort_stats("cumulative").print_stats(r"lucid_generator\.py", REPORT_LIMIT)
+
+        self.paths.extend([report_path, stats_path])
+
+    def _write_memory(self, elapsed, peak):
+        """
+        Write the allocation report and the snapshot taken at the highest memory use
+        """
+        report_path = os.path.join(self.output_dir, f"{self.name}.memory.txt")
+        snapshot_path = os.path.join(self.output_dir, f"{self.name}.snapshot")
+        snapshot = self._peak_snapshot
+        snapshot.dump(snapshot_path)
+
+        with open(report_path, "w", encoding="utf-8") as f:
+            f.write(f"Memory of {self.name}: {elapsed:.3f} s wall time, peak {_format_size(peak)} traced, "
+                    f"snapshot at {_format_size(self._peak_size)}\n")
+
+            f.write(f"\n=== Top {REPORT_LIMIT} allocation sites in lucid_generator.py ===\n")
+            f.write("(memory allocated by each line, including the functions it calls)\n")
+            for (filename, lineno), size, count in _generator_sites(snapshot)[:REPORT_LIMIT]:
+                f.write(_format_site(filename, lineno, size, count))
+
+            f.write(f"\n=== Top {REPORT_LIMIT} allocation sites overall ===\n")
+            for statistic in snapshot.statistics("lineno")[:REPORT_LIMIT]:
+                frame = statistic.traceback[0]
+                f.write(_format_site(frame.filename, frame.lineno, statistic.size, statistic.count))
+
+        self.paths.extend([report_path, snapshot_path])
+
+
+def _generator_sites(snapshot):
+    """
+    Group the traced memory by the innermost lucid_generator.py line on each allocation's stack
+
+    Returns:
+        list: ((filename, lineno), size, count) tuples, largest first
+    """
+    sites = {}
+    for trace in snapshot.traces:
+        # Frames are iterated oldest first; the innermost generator line is the most specific
+        frame = next((frame for frame in reversed(trace.traceback) if frame.filename == GENERATOR_FILE), None)
+        if frame is None:
+            continue
+        size, count = sites.get((frame.filename, frame.lineno), (0, 0))
+        sites[(frame.filename, frame.lineno)] = (size + trace.size, count + 1)
+    return sorted(((site, size, count) for site, (size, count) in sites.items()), key=lambda item: -item[1])
+
+
+def _format_site(filename, lineno, size, count):
+    source = linecache.getline(filename, lineno).strip()
+    return f"{_format_size(size):>10} {count:>8} blocks  {os.path.basename(filename)}:{lineno}  {source}\n"
+
+
+def _format_size(size):
+    for unit in ("B", "KB", "MB"):
+        if abs(size) < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
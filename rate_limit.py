@@ -0,0 +1,178 @@
+import email.utils
+import threading
+import time
+
+# Response headers announcing how many requests are left and when the window resets
+REMAINING_HEADERS = ("X-RateLimit-Remaining", "RateLimit-Remaining")
+RESET_HEADERS = ("X-RateLimit-Reset", "RateLimit-Reset")
+
+# Reset values above this are absolute Unix timestamps rather than seconds from now
+_EPOCH_THRESHOLD = 1e9
+
+
+def parse_retry_after(value, now=None):
+    """
+    Parse a Retry-After header value
+
+    Args:
+        value (str): Seconds to wait, or an HTTP date
+        now (float): Current time; defaults to time.time()
+
+    Returns:
+        float: Seconds to wait, or None if the value cannot be parsed
+    """
+    if value is None:
+        return None
+    now = time.time() if now is None else now
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - now)
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+def rate_limit_reset(headers, now=None):
+    """
+    Get the wait announced by rate limit headers once no requests are left
+
+    Args:
+        headers (Mapping): Response headers (case-insensitive)
+        now (float): Current time; defaults to time.time()
+
+    Returns:
+        float: Seconds until the rate limit window resets, or None if requests are left
+    """
+    now = time.time() if now is None else now
+    remaining = next((headers[name] for name in REMAINING_HEADERS if name in headers), None)
+    reset = next((headers[name] for name in RESET_HEADERS if name in headers), None)
+    try:
+        if remaining is None or reset is None or float(remaining) > 0:
+            return None
+        reset = float(reset)
+    except ValueError:
+        return None
+    return max(0.0, reset - now if reset > _EPOCH_THRESHOLD else reset)
+
+
+class TokenBucket:
+    """
+    Token bucket pacing requests to the Lucid API, adapting to its rate limits
+
+    Requests are let through at up to `rate` per second with bursts of up to
+    `burst` requests. A 429 response halves the rate and pauses every caller
+    for the Retry-After period (or until the announced rate limit window
+    resets); each successful response then raises the rate again by a fraction
+    of the configured rate (additive increase, multiplicative decrease), so
+    bulk uploads settle at the highest rate the API sustains. Without a rate,
+    requests are not paced but pauses requested by the API are still honored.
+
+    The bucket is thread-safe. reserve() returns the wait instead of sleeping,
+    so asyncio callers can wait with asyncio.sleep.
+    """
+
+    def __init__(self, rate=None, burst=1, min_rate=0.1, recovery=0.05):
+        """
+        Initialize the token bucket
+
+        Args:
+            rate (float): Requests per second, or None to pace only on rate limit responses
+            burst (int): Maximum number of requests let through at once
+            min_rate (float): Lowest rate the bucket backs off to, in requests per second
+            recovery (float): Fraction of the configured rate regained after each successful request
+        """
+        if rate is not None and rate <= 0:
+            raise ValueError("rate must be positive")
+        if burst < 1:
+            raise ValueError("burst must be at least 1")
+
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min(min_rate, rate) if rate else min_rate
+        self.recovery = recovery
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """
+        Take a token, returning how long the caller must wait before sending its request
+
+        Returns:
+            float: Seconds to wait
+        """
+        with self._lock:
+            now = time.monotonic()
+            wait = max(0.0, self._paused_until - now)
+            if self.rate is not None:
+                # Tokens are counted from _updated, which lies in the future during a pause
+                if now > self._updated:
+                    self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                    self._updated = now
+                # Tokens may go negative: later callers queue up behind earlier ones
+                self._tokens -= 1
+                if self._tokens < 0:
+                    wait = max(wait, self._updated - now - self._tokens / self.rate)
+            return wait
+
+    def pause_remaining(self):
+        """
+        Get how long a pause requested by the API still lasts
+
+        Callers re-check this after waiting out their reservation, since a pause
+        may have started while they were waiting.
+
+        Returns:
+            float: Seconds until the pause ends, 0 if there is none
+        """
+        with self._lock:
+            return max(0.0, self._paused_until - time.monotonic())
+
+    def acquire(self):
+        """
+        Wait until a request may be sent
+        """
+        wait = self.reserve()
+        while wait > 0:
+            time.sleep(wait)
+            wait = self.pause_remaining()
+
+    def on_response(self, status, headers):
+        """
+        Adapt to a response from the API
+
+        Args:
+            status (int): HTTP status code
+            headers (Mapping): Response headers (case-insensitive)
+
+        Returns:
+            float: For a 429 response, the seconds callers now wait before the next request; otherwise None
+        """
+        now = time.time()
+        pause = rate_limit_reset(headers, now)
+
+        with self._lock:
+            if status == 429:
+                # Requests sent together are rejected together: back off once per pause
+                if self.rate is not None and time.monotonic() >= self._paused_until:
+                    self.rate = max(self.min_rate, self.rate / 2)
+                retry_after = parse_retry_after(headers.get("Retry-After"), now)
+                if retry_after is not None:
+                    pause = max(pause or 0.0, retry_after)
+                elif pause is None:
+                    pause = 1.0 / self.rate if self.rate else 1.0
+            elif status < 400 and self.rate is not None:
+                self.rate = min(self.max_rate, self.rate + self.recovery * self.max_rate)
+
+            if pause is not None:
+                self._paused_until = max(self._paused_until, time.monotonic() + pause)
+                # The window restarts after the pause, so do not let a burst through at once
+                if self.rate is not None and self._paused_until > self._updated:
+                    self._tokens = min(self._tokens, 1.0)
+                    self._updated = self._paused_until
+
+        return pause if status == 429 else None
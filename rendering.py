@@ -0,0 +1,179 @@
+class FrozenStyle(dict):
+    """
+    Immutable style mapping that can be shared between shapes and lines
+
+    Subclassing dict keeps it directly serializable by the json module.
+    """
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("Shared styles are immutable; create a new FrozenStyle instead")
+
+    __setitem__ = _readonly
+    __delitem__ = _readonly
+    clear = _readonly
+    pop = _readonly
+    popitem = _readonly
+    setdefault = _readonly
+    update = _readonly
+    __ior__ = _readonly
+
+    def __hash__(self):
+        return hash(tuple(sorted(self.items())))
+
+    def __reduce__(self):
+        # Pickle through the constructor, since unpickling a dict subclass uses __setitem__
+        return (FrozenStyle, (dict(self),))
+
+
+# Inline text style shared by every label
+TEXT_STYLE = "font-family:Liberation Sans;font-size:9pt"
+
+# AZ titles are centered across the top of their container
+CONTAINER_LABEL_TEXT_STYLE = TEXT_STYLE + ";text-align:center"
+
+# Entity labels are centered both ways inside their box
+ENTITY_TEXT_STYLE = (TEXT_STYLE + ";text-align:center;display:flex;justify-content:center;align-items:center;"
+                     "height:100%;margin:0")
+
+# Height of the AZ title shown at the top of each container
+CONTAINER_LABEL_HEIGHT = 30
+
+CONTAINER_STYLE = FrozenStyle({
+    "fill": FrozenStyle({"type": "color", "color": "#d7d7d7"}),
+    "stroke": FrozenStyle({"color": "#d7d7d7", "width": 2, "style": "solid"})
+})
+
+ENTITY_STYLE = FrozenStyle({
+    "fill": FrozenStyle({"type": "color", "color": "#ffffff"}),
+    "stroke": FrozenStyle({"color": "#131313", "width": 1.5, "style": "solid"})
+})
+
+LINE_STROKE = FrozenStyle({"color": "#131313", "width": 1.5, "style": "solid"})
+
+# Trunk lines standing in for a bundle of parallel connections
+BUNDLE_STROKE = FrozenStyle({"color": "#131313", "width": 3, "style": "solid"})
+
+# Diff mode highlights for rules added, removed or changed between two workbooks
+CHANGE_COLORS = {"added": "#2e7d32", "removed": "#c62828", "changed": "#ef6c00"}
+
+CHANGE_LINE_STROKES = {
+    change: FrozenStyle({"color": color, "width": 2.5, "style": "solid"})
+    for change, color in CHANGE_COLORS.items()
+}
+
+CHANGE_ENTITY_STYLES = {
+    change: FrozenStyle({
+        "fill": ENTITY_STYLE["fill"],
+        "stroke": FrozenStyle({"color": color, "width": 3, "style": "solid"})
+    })
+    for change, color in CHANGE_COLORS.items()
+}
+
+
+def label_markup(text, style=TEXT_STYLE):
+    """
+    Wrap label text in a shared paragraph style
+
+    Args:
+        text (str): The label text
+        style (str): Inline style of the paragraph
+
+    Returns:
+        str: The label markup
+    """
+    return f"<p style=\"{style}\">{text}</p>"
+
+
+def line_label_markup(text_parts):
+    """
+    Build the label markup for a connection line
+
+    Args:
+        text_parts (list): One "PROTOCOL ports" string per protocol
+
+    Returns:
+        str: The line label markup
+    """
+    return "<br>".join([f"<i>{text}</i>" for text in text_parts])
+
+
+def container_shape(container_id, bounding_box):
+    """
+    Create an AZ container shape
+
+    Args:
+        container_id (str): ID of the container shape
+        bounding_box (dict): Bounding box of the container
+
+    Returns:
+        dict: The container shape
+    """
+    return {
+        "id": container_id,
+        "type": "rectangle",
+        "boundingBox": bounding_box,
+        "style": CONTAINER_STYLE
+    }
+
+
+def container_label_shape(container_id, az, bounding_box):
+    """
+    Create the title shown at the top of an AZ container
+
+    Args:
+        container_id (str): ID of the container shape the title belongs to
+        az (str): The AZ name
+        bounding_box (dict): Bounding box of the container
+
+    Returns:
+        dict: The text shape for the title
+    """
+    return {
+        "id": f"{container_id}_label",
+        "type": "text",
+        "boundingBox": {
+            "x": bounding_box["x"],
+            "y": bounding_box["y"],
+            "w": bounding_box["w"],
+            "h": CONTAINER_LABEL_HEIGHT
+        },
+        "text": label_markup(az, CONTAINER_LABEL_TEXT_STYLE)
+    }
+
+
+def container_group(container_id):
+    """
+    Group an AZ container with its title, so the title moves with the container
+
+    Args:
+        container_id (str): ID of the container shape
+
+    Returns:
+        dict: The group
+    """
+    return {
+        "id": f"{container_id}_group",
+        "items": [container_id, f"{container_id}_label"]
+    }
+
+
+def entity_shape(shape_id, bounding_box, entity, style=ENTITY_STYLE):
+    """
+    Create an entity shape
+
+    Args:
+        shape_id (str): ID of the entity shape
+        bounding_box (dict): Bounding box of the entity
+        entity (str): The entity name
+        style (FrozenStyle): Shared style for the shape
+
+    Returns:
+        dict: The entity shape
+    """
+    return {
+        "id": shape_id,
+        "type": "rectangle",
+        "boundingBox": bounding_box,
+        "style": style,
+        "text": label_markup(entity, ENTITY_TEXT_STYLE)
+    }
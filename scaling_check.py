@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+
+import argparse
+import gc
+import io
+import math
+import random
+import sys
+import time
+
+import pandas as pd
+
+from excel_reader import normalize_rules
+from level_of_detail import collapse_dense_azs
+from lucid_generator import AZ_GRID_POSITIONS, LayoutConfig, _DiagramRun, write_lucid_archive
+
+# Time complexity each stage is allowed
+LINEAR = "n"
+N_LOG_N = "n log n"
+
+# Stages in the order they run; every stage is timed on the output of the ones before it
+STAGES = [
+    ("normalize", N_LOG_N),
+    ("level of detail", N_LOG_N),
+    ("preprocess", N_LOG_N),
+    ("analyze connections", LINEAR),
+    ("count connections", LINEAR),
+    ("containers", N_LOG_N),
+    ("entities", N_LOG_N),
+    ("routing", N_LOG_N),
+    ("bundled routing", N_LOG_N),
+    ("write", LINEAR)
+]
+
+# Inputs the stages are scaled on: the number of entities grows with the rules
+# ("sparse"), stays fixed so that every entity gets more connections ("dense"), or
+# grows with the rules while half of the rules go to a single entity ("hub")
+SCENARIOS = ("sparse", "dense", "hub")
+
+# Entity every hub rule goes to
+HUB = ("hub-00000", "AZ1")
+
+PORTS = ["22", "53", "80, 443", "443", "3306", "5432", "6379", "8000-8100", "8443", "9090"]
+PROTOCOLS = ["TCP", "UDP", "TCP/UDP"]
+
+
+def parse_args():
+    """
+    Parse the command line arguments
+
+    Returns:
+        argparse.Namespace: The parsed arguments
+    """
+    parser = argparse.ArgumentParser(
+        description="Check that every generator stage scales linearly or as N log N with the number of rules")
+    parser.add_argument("--size", type=int, default=500, help="Number of rules of the smaller input (default: 500)")
+    parser.add_argument("--factor", type=int, default=4,
+                        help="How many times larger the larger input is (default: 4)")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="Timing runs per input; the fastest one counts (default: 3)")
+    parser.add_argument("--slack", type=float, default=1.5,
+                        help="Allowed factor over the time ratio of the stage's complexity budget (default: 1.5)")
+    parser.add_argument("--min-seconds", type=float, default=0.05,
+                        help="Each timing run repeats a stage until it takes at least this long (default: 0.05)")
+    parser.add_argument("--scenario", choices=SCENARIOS, action="append", default=None,
+                        help="Input scenario to check; may be repeated (default: all)")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed of the synthetic rules (default: 0)")
+    return parser.parse_args()
+
+
+def synthetic_rules(rules, entities, seed=0, software_type="Scaling Check", hub_share=0.0):
+    """
+    Generate random firewall rules between entities spread over the diagram's AZs
+
+    Args:
+        rules (int): Number of rules
+        entities (int): Number of distinct entities
+        seed (int): Seed of the random generator
+        software_type (str): Software type of every rule
+        hub_share (float): Share of the rules whose destination is the HUB entity
+
+    Returns:
+        pd.DataFrame: The rules, with the columns of a workbook's rules sheet
+    """
+    rnd = random.Random(seed)
+    azs = list(AZ_GRID_POSITIONS)
+    hosts = [(f"{rnd.choice(['web', 'app', 'db', 'cache'])}-{index:05d}", azs[index % len(azs)])
+             for index in range(entities)]
+
+    rows = []
+    for _ in range(rules):
+        (source, source_az), (destination, dest_az) = rnd.choice(hosts), rnd.choice(hosts)
+        if rnd.random() < hub_share:
+            destination, dest_az = HUB
+        rows.append({
+            "Software Type": software_type,
+            "Source": source,
+            "Ports": rnd.choice(PORTS),
+            "Transfer Protocol": rnd.choice(PROTOCOLS),
+            "Destination": destination,
+            "Service Flow": "",
+            "Additional Notes": "",
+            "Source AZ (Used for Diagram Generation)": source_az,
+            "Destination AZ (Used for Diagram Generation)": dest_az
+        })
+    return pd.DataFrame(rows)
+
+
+def scenario_rules(scenario, rules, seed=0):
+    """
+    Generate the synthetic rules of a scenario
+
+    Args:
+        scenario (str): "sparse", "dense" or "hub"
+        rules (int): Number of rules
+        seed (int): Seed of the random generator
+
+    Returns:
+        pd.DataFrame: The rules
+    """
+    if scenario == "sparse":
+        return synthetic_rules(rules, max(8, rules // 4), seed)
+    if scenario == "hub":
+        return synthetic_rules(rules, max(8, rules // 4), seed, hub_share=0.5)
+    return synthetic_rules(rules, 60, seed)
+
+
+def _autorange(func, args, min_seconds):
+    """
+    Call a function 1, 2, 5, 10, 20, ... times in a row until the calls take at least min_seconds
+
+    Returns:
+        float: Seconds per call
+        object: The result of the last call
+    """
+    base = 1
+    while True:
+        for multiple in (1, 2, 5):
+            loops = base * multiple
+            started = time.perf_counter()
+            for _ in range(loops):
+                result = func(*args)
+            elapsed = time.perf_counter() - started
+            if elapsed >= min_seconds:
+                return elapsed / loops, result
+        base *= 10
+
+
+def _timed(timings, stage, min_seconds, func, *args):
+    """
+    Time a stage with the garbage collector paused, keeping its fastest time per call
+
+    Like timeit's autorange, a fast stage is called repeatedly until the calls
+    take at least min_seconds, so every stage is measured reliably. Stages must
+    give the same result when called again on the same run.
+    """
+    gc.collect()
+    gc.disable()
+    try:
+        per_call, result = _autorange(func, args, min_seconds)
+    finally:
+        gc.enable()
+    timings[stage] = min(timings.get(stage, per_call), per_call)
+    return result
+
+
+def time_stages(df, repeat=3, min_seconds=0.05):
+    """
+    Time every stage of the generation on a set of rules
+
+    Args:
+        df (pd.DataFrame): The rules, as read from a workbook
+        repeat (int): Timing runs; the fastest run of each stage counts
+        min_seconds (float): Each timing run repeats a stage until it takes at least this long
+
+    Returns:
+        dict: Mapping of stage name to seconds
+        int: Number of rules after normalization
+    """
+    config = LayoutConfig()
+    bundle_config = LayoutConfig(bundle_threshold=3)
+    software_type = df["Software Type"].iloc[0]
+    timings = {}
+
+    for _ in range(repeat):
+        normalized, _ = _timed(timings, "normalize", min_seconds, normalize_rules, df, AZ_GRID_POSITIONS.keys())
+        # A quarter of the average entities per AZ, so AZs are collapsed at every size
+        threshold = max(2, normalized["Source"].nunique() // (4 * len(AZ_GRID_POSITIONS)))
+        _timed(timings, "level of detail", min_seconds, collapse_dense_azs, normalized, threshold)
+
+        run = _DiagramRun(config, normalized, software_type)
+        _timed(timings, "preprocess", min_seconds, run._preprocess_data)
+        _timed(timings, "analyze connections", min_seconds, run._analyze_connections)
+        _timed(timings, "count connections", min_seconds, run._pre_analyze_connections)
+        shapes = _timed(timings, "containers", min_seconds, run._create_az_containers)
+        shapes = shapes + _timed(timings, "entities", min_seconds, run._create_entity_shapes)
+        lines = _timed(timings, "routing", min_seconds, lambda: list(run._iter_connection_lines()))
+
+        # Bundling only changes the routing: lay out a second run with bundling and time its routing
+        bundled = _DiagramRun(bundle_config, normalized, software_type)
+        bundled._preprocess_data()
+        bundled._create_az_containers()
+        bundled._create_entity_shapes()
+        _timed(timings, "bundled routing", min_seconds, lambda: list(bundled._iter_connection_lines()))
+
+        document = {"version": 1, "pages": [{"id": "page1", "title": software_type, "shapes": shapes, "lines": lines}]}
+        _timed(timings, "write", min_seconds, lambda: write_lucid_archive(document, io.BytesIO()))
+
+    return timings, len(normalized)
+
+
+def allowed_ratio(complexity, small, large):
+    """
+    Get the time ratio a stage of the given complexity may show between two input sizes
+
+    Args:
+        complexity (str): LINEAR or N_LOG_N
+        small (int): Size of the smaller input
+        large (int): Size of the larger input
+
+    Returns:
+        float: The ratio of the larger input's time to the smaller input's
+    """
+    ratio = large / small
+    if complexity == N_LOG_N:
+        ratio *= math.log(large) / math.log(small)
+    return ratio
+
+
+def check_scenario(scenario, args):
+    """
+    Time every stage on inputs of two sizes and compare the time ratios to their budgets
+
+    Args:
+        scenario (str): "sparse", "dense" or "hub"
+        args (argparse.Namespace): The parsed command line arguments
+
+    Returns:
+        list: Names of the stages over their budget
+    """
+    small_rules = scenario_rules(scenario, args.size, args.seed)
+    large_rules = scenario_rules(scenario, args.size * args.factor, args.seed)
+
+    small_timings, small_rows = time_stages(small_rules, args.repeat, args.min_seconds)
+    large_timings, large_rows = time_stages(large_rules, args.repeat, args.min_seconds)
+
+    print(f"\n{scenario}: {len(small_rules)} -> {len(large_rules)} rules "
+          f"({small_rows} -> {large_rows} after normalization)")
+    print(f"  {'stage':<22}{'small':>10}{'large':>10}{'ratio':>9}{'budget':>9}  result")
+
+    failures = []
+    for stage, complexity in STAGES:
+        small, large = small_timings[stage], large_timings[stage]
+        # Normalization sees the raw rules; every later stage sees the normalized ones
+        if stage == "normalize":
+            budget = allowed_ratio(complexity, len(small_rules), len(large_rules)) * args.slack
+        else:
+            budget = allowed_ratio(complexity, small_rows, large_rows) * args.slack
+        ratio = large / small if small > 0 else float("inf")
+
+        if ratio <= budget:
+            result = f"ok ({complexity})"
+        else:
+            result = f"FAIL: slower than {complexity}"
+            failures.append(f"{scenario}: {stage}")
+        print(f"  {stage:<22}{small:>9.4f}s{large:>9.4f}s{ratio:>9.2f}{budget:>9.2f}  {result}")
+
+    return failures
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    failures = []
+    for scenario in args.scenario or SCENARIOS:
+        failures.extend(check_scenario(scenario, args))
+
+    if failures:
+        print(f"\n{len(failures)} stages scale worse than their budget:")
+        for failure in failures:
+            print(f"  {failure}")
+        sys.exit(1)
+    print("\nEvery stage scales within its budget")
@@ -0,0 +1,388 @@
+import io
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from excel_reader import read_excel_data, normalize_rules, get_software_types, filter_by_software_type
+from lucid_generator import AZ_GRID_POSITIONS, create_document_json, serialize_document, package_lucid_archive
+
+
+class WorkbookStore:
+    """
+    Keeps parsed workbooks in memory and reloads them when the file changes on disk
+    """
+
+    def __init__(self, source_data_dir):
+        """
+        Initialize the workbook store
+
+        Args:
+            source_data_dir (str): Directory containing the Excel workbooks
+        """
+        self.source_data_dir = source_data_dir
+        self._workbooks = {}
+        # Guards the two dicts only; each workbook is read under its own lock
+        self._lock = threading.Lock()
+        self._workbook_locks = {}
+
+    def list_workbooks(self):
+        """
+        List the Excel workbooks available in the source data directory
+
+        Returns:
+            list: Sorted list of workbook file names
+        """
+        if not os.path.isdir(self.source_data_dir):
+            return []
+        return sorted(f for f in os.listdir(self.source_data_dir)
+                      if f.endswith('.xlsx') or f.endswith('.xls'))
+
+    def _resolve_path(self, workbook_name):
+        """
+        Resolve a workbook name to a path inside the source data directory
+
+        Args:
+            workbook_name (str): File name of the workbook
+
+        Returns:
+            str: Path to the workbook
+        """
+        # The workbook may be omitted when the directory holds a single one
+        if not workbook_name:
+            workbooks = self.list_workbooks()
+            if len(workbooks) == 1:
+                workbook_name = workbooks[0]
+
+        # Only plain file names are accepted so requests cannot escape the directory
+        if not workbook_name or os.path.basename(workbook_name) != workbook_name:
+            raise FileNotFoundError(f"Invalid workbook name: {workbook_name}")
+
+        path = os.path.join(self.source_data_dir, workbook_name)
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Excel file not found: {workbook_name}")
+        return path
+
+    def get(self, workbook_name):
+        """
+        Get the parsed workbook, reading it only if it is new or has changed
+
+        A workbook is read while holding its own lock, so requests for other
+        workbooks are not held up and a changed workbook is read only once.
+
+        Args:
+            workbook_name (str): File name of the workbook
+
+        Returns:
+            tuple: (version, DataFrame) where version identifies the file contents
+        """
+        path = self._resolve_path(workbook_name)
+        workbook_name = os.path.basename(path)
+        stat = os.stat(path)
+        version = f"{stat.st_mtime_ns}-{stat.st_size}"
+
+        with self._lock:
+            cached = self._workbooks.get(workbook_name)
+            if cached and cached[0] == version:
+                return cached
+            workbook_lock = self._workbook_locks.setdefault(workbook_name, threading.Lock())
+
+        with workbook_lock:
+            # Another request may have read this version while we waited
+            with self._lock:
+                cached = self._workbooks.get(workbook_name)
+            if cached and cached[0] == version:
+                return cached
+
+            print(f"Reading Excel data from {path}...")
+            df, _ = normalize_rules(read_excel_data(path), AZ_GRID_POSITIONS.keys())
+            with self._lock:
+                self._workbooks[workbook_name] = (version, df)
+            return version, df
+
+
+class DocumentCache:
+    """
+    Size-bounded LRU cache for generated documents
+    """
+
+    def __init__(self, max_bytes):
+        """
+        Initialize the document cache
+
+        Args:
+            max_bytes (int): Maximum total size of the cached documents in bytes
+        """
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Look up a cached document and mark it as most recently used
+
+        Args:
+            key (tuple): Cache key
+
+        Returns:
+            bytes: The cached document, or None if it is not cached
+        """
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """
+        Store a document, evicting the least recently used entries if needed
+
+        Args:
+            key (tuple): Cache key
+            value (bytes): The document contents
+        """
+        # Documents larger than the whole cache are never stored
+        if len(value) > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self.current_bytes -= len(self._entries.pop(key))
+
+            self._entries[key] = value
+            self.current_bytes += len(value)
+
+            while self.current_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.current_bytes -= len(evicted)
+
+    def stats(self):
+        """
+        Get cache statistics
+
+        Returns:
+            dict: Entry count, size and hit/miss counters
+        """
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses
+            }
+
+
+class DiagramService:
+    """
+    Generates diagrams from warm workbooks, caching the results
+    """
+
+    def __init__(self, source_data_dir, cache_bytes, lod_threshold=None, bundle_threshold=None):
+        """
+        Initialize the diagram service
+
+        Args:
+            source_data_dir (str): Directory containing the Excel workbooks
+            cache_bytes (int): Maximum size of the document cache in bytes
+            lod_threshold (int): Maximum entities shown per AZ before they are collapsed
+            bundle_threshold (int): Minimum parallel connections merged into a trunk line
+        """
+        self.workbooks = WorkbookStore(source_data_dir)
+        self.cache = DocumentCache(cache_bytes)
+        self.lod_threshold = lod_threshold
+        self.bundle_threshold = bundle_threshold
+        # Documents being generated, by cache key, so concurrent misses generate them once
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+
+    def software_types(self, workbook_name):
+        """
+        List the software types in a workbook
+
+        Args:
+            workbook_name (str): File name of the workbook
+
+        Returns:
+            list: List of software types
+        """
+        _, df = self.workbooks.get(workbook_name)
+        return get_software_types(df)
+
+    def document(self, workbook_name, software_type, kind):
+        """
+        Get a generated document for a software type
+
+        When several requests miss the cache for the same document at once, the
+        first one generates it and the others wait for its result.
+
+        Args:
+            workbook_name (str): File name of the workbook
+            software_type (str): The software type to generate a diagram for
+            kind (str): "json" for document.json or "lucid" for the .lucid archive
+
+        Returns:
+            bytes: The document contents
+        """
+        version, df = self.workbooks.get(workbook_name)
+        key = (workbook_name, version, software_type, kind)
+
+        with self._pending_lock:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+            pending = self._pending.get(key)
+            leader = pending is None
+            if leader:
+                pending = self._pending[key] = {"done": threading.Event(), "value": None, "error": None}
+
+        if not leader:
+            pending["done"].wait()
+            if pending["error"] is not None:
+                raise pending["error"]
+            return pending["value"]
+
+        try:
+            pending["value"] = self._generate(workbook_name, software_type, kind, df)
+            self.cache.put(key, pending["value"])
+            return pending["value"]
+        except Exception as e:
+            pending["error"] = e
+            raise
+        finally:
+            with self._pending_lock:
+                del self._pending[key]
+            pending["done"].set()
+
+    def _generate(self, workbook_name, software_type, kind, df):
+        """
+        Generate a document that is not cached
+
+        Args:
+            workbook_name (str): File name of the workbook
+            software_type (str): The software type to generate a diagram for
+            kind (str): "json" for document.json or "lucid" for the .lucid archive
+            df (pd.DataFrame): The workbook's rules
+
+        Returns:
+            bytes: The document contents
+        """
+        if kind == "lucid":
+            # Package the (possibly cached) document.json rather than regenerating it
+            document_bytes = self.document(workbook_name, software_type, "json")
+            buffer = io.BytesIO()
+            package_lucid_archive(document_bytes, buffer)
+            return buffer.getvalue()
+
+        filtered_data = filter_by_software_type(df, software_type)
+        if filtered_data.empty:
+            raise KeyError(f"No data found for software type '{software_type}'")
+        document_json = create_document_json(filtered_data, software_type, self.lod_threshold, self.bundle_threshold)
+        return serialize_document(document_json).encode("utf-8")
+
+
+class DiagramRequestHandler(BaseHTTPRequestHandler):
+    """
+    HTTP request handler exposing the diagram service
+
+    Endpoints:
+        GET /workbooks
+        GET /software-types?workbook=NAME
+        GET /document.json?workbook=NAME&type=TYPE
+        GET /document.lucid?workbook=NAME&type=TYPE
+        GET /cache
+    """
+
+    service = None
+
+    def do_GET(self):
+        started = time.perf_counter()
+        url = urlparse(self.path)
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+
+        try:
+            if url.path == "/workbooks":
+                self._send_json(self.service.workbooks.list_workbooks())
+            elif url.path == "/software-types":
+                self._send_json(self.service.software_types(params.get("workbook")))
+            elif url.path in ("/document.json", "/document.lucid"):
+                software_type = params.get("type")
+                if not software_type:
+                    self._send_error(400, "Missing 'type' parameter")
+                    return
+
+                kind = "json" if url.path == "/document.json" else "lucid"
+                body = self.service.document(params.get("workbook"), software_type, kind)
+
+                if kind == "json":
+                    self._send(200, body, "application/json")
+                else:
+                    filename = f"{software_type.replace(' ', '_')}.lucid"
+                    self._send(200, body, "application/zip",
+                               {"Content-Disposition": f"attachment; filename=\"{filename}\""})
+            elif url.path == "/cache":
+                self._send_json(self.service.cache.stats())
+            else:
+                self._send_error(404, f"Unknown endpoint: {url.path}")
+        except (FileNotFoundError, KeyError) as e:
+            self._send_error(404, e.args[0] if e.args else str(e))
+        except Exception as e:
+            self._send_error(500, str(e))
+        finally:
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            print(f"{self.command} {self.path} ({elapsed_ms:.1f} ms)")
+
+    def log_message(self, format, *args):
+        # Requests are logged with their timing in do_GET instead
+        pass
+
+    def _send(self, status, body, content_type, extra_headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (extra_headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, data, status=200):
+        self._send(status, json.dumps(data).encode("utf-8"), "application/json")
+
+    def _send_error(self, status, message):
+        self._send_json({"error": message}, status)
+
+
+def serve(source_data_dir, host="127.0.0.1", port=8080, cache_mb=64, lod_threshold=None,
+          bundle_threshold=None):
+    """
+    Run the local diagram HTTP server until interrupted
+
+    Args:
+        source_data_dir (str): Directory containing the Excel workbooks
+        host (str): Interface to listen on
+        port (int): Port to listen on
+        cache_mb (int): Maximum size of the document cache in megabytes
+        lod_threshold (int): Maximum entities shown per AZ before they are collapsed
+        bundle_threshold (int): Minimum parallel connections merged into a trunk line
+    """
+    DiagramRequestHandler.service = DiagramService(source_data_dir, cache_mb * 1024 * 1024,
+                                                   lod_threshold, bundle_threshold)
+    httpd = ThreadingHTTPServer((host, port), DiagramRequestHandler)
+
+    print(f"Serving diagrams from {source_data_dir} on http://{host}:{port}")
+    print("Press Ctrl+C to stop.")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        print("\nShutting down server...")
+    finally:
+        httpd.server_close()
@@ -0,0 +1,119 @@
+import functools
+import math
+
+# Advance widths of Liberation Sans (metric-compatible with Arial) in 1/1000 em units
+LIBERATION_SANS_WIDTHS = {
+    " ": 278, "!": 278, "\"": 355, "#": 556, "$": 556, "%": 889, "&": 667, "'": 191,
+    "(": 333, ")": 333, "*": 389, "+": 584, ",": 278, "-": 333, ".": 278, "/": 278,
+    "0": 556, "1": 556, "2": 556, "3": 556, "4": 556, "5": 556, "6": 556, "7": 556,
+    "8": 556, "9": 556, ":": 278, ";": 278, "<": 584, "=": 584, ">": 584, "?": 556,
+    "@": 1015, "A": 667, "B": 667, "C": 722, "D": 722, "E": 667, "F": 611, "G": 778,
+    "H": 722, "I": 278, "J": 500, "K": 667, "L": 556, "M": 833, "N": 722, "O": 778,
+    "P": 667, "Q": 778, "R": 722, "S": 667, "T": 611, "U": 722, "V": 667, "W": 944,
+    "X": 667, "Y": 667, "Z": 611, "[": 278, "\\": 278, "]": 278, "^": 469, "_": 556,
+    "`": 333, "a": 556, "b": 556, "c": 500, "d": 556, "e": 556, "f": 278, "g": 556,
+    "h": 556, "i": 222, "j": 222, "k": 500, "l": 222, "m": 833, "n": 556, "o": 556,
+    "p": 556, "q": 556, "r": 333, "s": 500, "t": 278, "u": 556, "v": 500, "w": 722,
+    "x": 500, "y": 500, "z": 500, "{": 334, "|": 260, "}": 334, "~": 584
+}
+
+# Width used for characters missing from the table (average digit width)
+DEFAULT_CHAR_WIDTH = 556
+
+# Number of measured words and fitted labels kept; the least recently used are evicted
+CACHE_SIZE = 65536
+
+
+class TextMetrics:
+    """
+    Measures label text for shape sizing, memoizing the most recent results
+    """
+
+    def __init__(self, char_widths=LIBERATION_SANS_WIDTHS, font_size_pt=9, cache_size=CACHE_SIZE):
+        """
+        Initialize the text metrics
+
+        Args:
+            char_widths (dict): Character advance widths in 1/1000 em units
+            font_size_pt (int): Font size in points
+            cache_size (int): Number of widths and boxes memoized each
+        """
+        # Lucid renders 9pt text at 96 DPI, so 1pt is 4/3 px
+        px_per_unit = font_size_pt * 96 / 72 / 1000
+        self._char_px = {char: width * px_per_unit for char, width in char_widths.items()}
+        self._default_char_px = DEFAULT_CHAR_WIDTH * px_per_unit
+        self._space_px = self._char_px.get(" ", self._default_char_px)
+
+        # Bounded, thread-safe memoization per instance
+        self.text_width = functools.lru_cache(maxsize=cache_size)(self.text_width)
+        self.fit_box = functools.lru_cache(maxsize=cache_size)(self.fit_box)
+
+    def text_width(self, text):
+        """
+        Get the rendered width of text on a single line
+
+        Args:
+            text (str): The text to measure
+
+        Returns:
+            float: Width in pixels
+        """
+        return sum(self._char_px.get(char, self._default_char_px) for char in text)
+
+    def line_count(self, text, max_width):
+        """
+        Count the lines needed to word-wrap text within a width
+
+        Args:
+            text (str): The text to wrap
+            max_width (float): Available width in pixels
+
+        Returns:
+            int: Number of lines
+        """
+        lines = 1
+        line_width = 0
+
+        for word in text.split():
+            word_width = self.text_width(word)
+
+            # Words wider than the line are broken across lines
+            if word_width > max_width:
+                if line_width > 0:
+                    lines += 1
+                extra_lines = math.ceil(word_width / max_width) - 1
+                lines += extra_lines
+                line_width = word_width - extra_lines * max_width
+                continue
+
+            needed = word_width if line_width == 0 else line_width + self._space_px + word_width
+            if needed > max_width:
+                lines += 1
+                line_width = word_width
+            else:
+                line_width = needed
+
+        return lines
+
+    def fit_box(self, text, min_width, max_width, padding):
+        """
+        Find the box width and line count for a label
+
+        The box grows from min_width up to max_width to keep the label on one
+        line, and wraps the label once max_width is reached.
+
+        Args:
+            text (str): The label text
+            min_width (int): Minimum box width
+            max_width (int): Maximum box width
+            padding (int): Horizontal padding inside the box on each side
+
+        Returns:
+            tuple: (box_width, line_count)
+        """
+        box_width = min(max(min_width, math.ceil(self.text_width(text)) + 2 * padding), max_width)
+        return box_width, self.line_count(text, box_width - 2 * padding)
+
+
+# Shared instance so labels repeated across AZs and software types are measured once
+TEXT_METRICS = TextMetrics()
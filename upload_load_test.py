@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+
+import argparse
+import asyncio
+import os
+import time
+from collections import Counter
+
+from async_api_client import AsyncLucidApiClient
+from mock_lucid_server import MockLucidBehavior, start_mock_server
+
+
+def parse_args():
+    """
+    Parse the command line arguments
+
+    Returns:
+        argparse.Namespace: The parsed arguments
+    """
+    parser = argparse.ArgumentParser(description="Load test bulk uploads against a local mock Lucid API")
+    parser.add_argument("--file", default=None,
+                        help="The .lucid file to upload (default: a diagram generated in memory from the first workbook)")
+    parser.add_argument("--documents", type=int, default=100, help="Number of uploads (default: 100)")
+    parser.add_argument("--concurrency", type=int, default=8, help="Maximum uploads in flight (default: 8)")
+    parser.add_argument("--latency", type=float, default=0.2, help="Seconds per upload (default: 0.2)")
+    parser.add_argument("--jitter", type=float, default=0.1, help="Maximum extra random latency (default: 0.1)")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0,
+                        help="Fraction of uploads answered with 429 (default: 0)")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="Fraction of uploads answered with 500 or 503 (default: 0)")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed of the mock server (default: 0)")
+    parser.add_argument("--server-rate-limit", type=int, default=None,
+                        help="Uploads the mock server accepts per second before answering 429")
+    parser.add_argument("--requests-per-second", type=float, default=None,
+                        help="Client-side request rate limit (default: only slow down when rate limited)")
+    parser.add_argument("--burst", type=int, default=1,
+                        help="Requests the client sends at once before pacing applies (default: 1)")
+    parser.add_argument("--base-url", default=None,
+                        help="Upload to this server instead of starting the mock server")
+    return parser.parse_args()
+
+
+def sample_lucid_archive():
+    """
+    Generate a diagram of the first software type in the first workbook of the source data directory
+
+    Returns:
+        bytes: The contents of the .lucid archive
+    """
+    from excel_reader import read_excel_data, normalize_rules, get_software_types, filter_by_software_type
+    from lucid_generator import AZ_GRID_POSITIONS, create_lucid_bytes
+
+    source_data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "source data")
+    excel_files = sorted(f for f in os.listdir(source_data_dir) if f.endswith('.xlsx') or f.endswith('.xls'))
+    if not excel_files:
+        raise FileNotFoundError(f"No Excel files found in {source_data_dir}")
+
+    df, _ = normalize_rules(read_excel_data(os.path.join(source_data_dir, excel_files[0])), AZ_GRID_POSITIONS.keys())
+    software_type = get_software_types(df)[0]
+    return create_lucid_bytes(filter_by_software_type(df, software_type), software_type)
+
+
+async def run_load_test(client, lucid_file, documents):
+    """
+    Upload the same archive many times and time each upload
+
+    Args:
+        client (AsyncLucidApiClient): The client to upload with
+        lucid_file (str or bytes): Path to the .lucid file or the archive contents
+        documents (int): Number of uploads
+
+    Returns:
+        list: One (seconds, error message or None) tuple per upload
+    """
+    async def timed_upload(index):
+        started = time.perf_counter()
+        try:
+            await client.upload_document(lucid_file, f"Load test {index + 1}", "load_test.lucid")
+            error = None
+        except Exception as e:
+            error = str(e)
+        return time.perf_counter() - started, error
+
+    async with client:
+        return await asyncio.gather(*(timed_upload(index) for index in range(documents)))
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] if ordered else 0.0
+
+
+def main(args):
+    """
+    Run the upload load test and print its results
+
+    Args:
+        args (argparse.Namespace): The parsed command line arguments
+    """
+    lucid_file = args.file or sample_lucid_archive()
+    size = os.path.getsize(lucid_file) if args.file else len(lucid_file)
+
+    behavior = None
+    httpd = None
+    base_url = args.base_url
+    if base_url is None:
+        behavior = MockLucidBehavior(args.latency, args.jitter, args.rate_limit_rate, args.error_rate,
+                                     seed=args.seed, rate_limit=args.server_rate_limit)
+        httpd = start_mock_server(behavior)
+        base_url = f"http://127.0.0.1:{httpd.server_address[1]}"
+
+    try:
+        client = AsyncLucidApiClient("load-test-key", base_url, args.concurrency,
+                                     requests_per_second=args.requests_per_second, burst=args.burst)
+        backend = "aiohttp" if client._aiohttp is not None else "requests in worker threads"
+        print(f"Uploading {size} bytes x {args.documents} to {base_url} "
+              f"with {args.concurrency} concurrent uploads ({backend})...")
+
+        started = time.perf_counter()
+        results = asyncio.run(run_load_test(client, lucid_file, args.documents))
+        elapsed = time.perf_counter() - started
+    finally:
+        if httpd is not None:
+            httpd.shutdown()
+            httpd.server_close()
+
+    latencies = [seconds for seconds, _ in results]
+    errors = Counter(error for _, error in results if error is not None)
+    succeeded = len(results) - sum(errors.values())
+
+    print(f"\n{succeeded} of {len(results)} uploads succeeded in {elapsed:.2f} s "
+          f"({len(results) / elapsed:.1f} uploads/s)")
+    print(f"Latency: p50 {percentile(latencies, 0.5) * 1000:.0f} ms, "
+          f"p95 {percentile(latencies, 0.95) * 1000:.0f} ms, max {max(latencies) * 1000:.0f} ms")
+    for error, count in errors.most_common():
+        print(f"  {count} x {error}")
+    if behavior is not None:
+        print(f"Mock server: {behavior.stats()}")
+
+
+if __name__ == "__main__":
+    main(parse_args())
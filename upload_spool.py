@@ -0,0 +1,335 @@
+import hashlib
+import os
+import random
+import sqlite3
+import threading
+import time
+import zipfile
+
+# Bumped whenever the table layout changes
+UPLOAD_SPOOL_VERSION = 1
+
+# Upload statuses: waiting for (another) attempt, done, or given up on
+PENDING = "pending"
+UPLOADED = "uploaded"
+FAILED = "failed"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS uploads (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    file_path TEXT NOT NULL,
+    title TEXT NOT NULL,
+    content_hash TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    next_attempt_at REAL NOT NULL DEFAULT 0,
+    document_url TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    UNIQUE (file_path, title)
+)
+"""
+
+
+def content_hash(path):
+    """
+    Compute the SHA-256 hash of a .lucid archive's contents
+
+    The names and contents of the archive entries are hashed rather than the
+    ZIP file itself, whose entry timestamps change every time a diagram is
+    regenerated. Files that are not ZIP archives are hashed as they are.
+
+    Args:
+        path (str): Path to the file
+
+    Returns:
+        str: The hex digest
+    """
+    digest = hashlib.sha256()
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            for name in sorted(archive.namelist()):
+                digest.update(name.encode("utf-8") + b"\0")
+                with archive.open(name) as entry:
+                    for chunk in iter(lambda: entry.read(1024 * 1024), b""):
+                        digest.update(chunk)
+    else:
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+class UploadSpool:
+    """
+    Durable queue of .lucid files waiting to be uploaded, kept in a SQLite database
+
+    Each entry references a file on disk and records its content hash, status,
+    number of attempts, last error and when it may be tried again, so a batch
+    interrupted by a network failure or a rate limit can be resumed later
+    without uploading finished documents again.
+    """
+
+    def __init__(self, path):
+        """
+        Open the spool, creating the database if it does not exist
+
+        Args:
+            path (str): Path to the SQLite database file
+        """
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        # Pipeline upload workers share the connection, so access is serialized by a lock
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.row_factory = sqlite3.Row
+
+        with self._lock, self._connection:
+            version = self._connection.execute("PRAGMA user_version").fetchone()[0]
+            if version not in (0, UPLOAD_SPOOL_VERSION):
+                raise ValueError(f"Unsupported upload spool version {version} in {path}")
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(_SCHEMA)
+            self._connection.execute(f"PRAGMA user_version = {UPLOAD_SPOOL_VERSION}")
+
+    def close(self):
+        """
+        Close the database connection
+        """
+        with self._lock:
+            self._connection.close()
+
+    def enqueue(self, file_path, title):
+        """
+        Add a file to the spool
+
+        A file already uploaded with the same title and unchanged contents is not
+        queued again. A changed file, or one that previously failed for good, is
+        queued afresh with its attempt count reset.
+
+        Args:
+            file_path (str): Path to the .lucid file
+            title (str): Title for the document
+
+        Returns:
+            dict: The spool entry
+        """
+        file_path = os.path.abspath(file_path)
+        archive_hash = content_hash(file_path)
+        now = time.time()
+
+        with self._lock, self._connection:
+            entry = self._connection.execute(
+                "SELECT * FROM uploads WHERE file_path = ? AND title = ?", (file_path, title)).fetchone()
+
+            if entry is None:
+                self._connection.execute(
+                    "INSERT INTO uploads (file_path, title, content_hash, status, created_at, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)", (file_path, title, archive_hash, PENDING, now, now))
+            elif entry["content_hash"] != archive_hash or entry["status"] == FAILED:
+                self._connection.execute(
+                    "UPDATE uploads SET content_hash = ?, status = ?, attempts = 0, last_error = NULL, "
+                    "next_attempt_at = 0, document_url = NULL, updated_at = ? WHERE id = ?",
+                    (archive_hash, PENDING, now, entry["id"]))
+
+            return dict(self._connection.execute(
+                "SELECT * FROM uploads WHERE file_path = ? AND title = ?", (file_path, title)).fetchone())
+
+    def mark_uploaded(self, entry_id, archive_hash, document_url):
+        """
+        Record a successful upload
+
+        Args:
+            entry_id (int): ID of the spool entry
+            archive_hash (str): Hash of the contents that were uploaded
+            document_url (str): URL of the uploaded document, if the API returned one
+        """
+        with self._lock, self._connection:
+            self._connection.execute(
+                "UPDATE uploads SET status = ?, attempts = attempts + 1, last_error = NULL, content_hash = ?, "
+                "document_url = ?, updated_at = ? WHERE id = ?",
+                (UPLOADED, archive_hash, document_url, time.time(), entry_id))
+
+    def mark_failed(self, entry_id, error, retry_at=None):
+        """
+        Record a failed upload attempt
+
+        Args:
+            entry_id (int): ID of the spool entry
+            error (str): The error message
+            retry_at (float): When to try again, or None to give up on the entry
+        """
+        with self._lock, self._connection:
+            self._connection.execute(
+                "UPDATE uploads SET status = ?, attempts = attempts + 1, last_error = ?, next_attempt_at = ?, "
+                "updated_at = ? WHERE id = ?",
+                (PENDING if retry_at is not None else FAILED, error, retry_at or 0, time.time(), entry_id))
+
+    def requeue_failed(self):
+        """
+        Give entries that were given up on a fresh set of attempts
+
+        Returns:
+            int: Number of entries requeued
+        """
+        with self._lock, self._connection:
+            return self._connection.execute(
+                "UPDATE uploads SET status = ?, attempts = 0, last_error = NULL, next_attempt_at = 0, updated_at = ? "
+                "WHERE status = ?",
+                (PENDING, time.time(), FAILED)).rowcount
+
+    def entries(self, status=None):
+        """
+        List the spool entries
+
+        Args:
+            status (str): Only list entries with this status
+
+        Returns:
+            list: The entries, oldest first
+        """
+        with self._lock:
+            if status is None:
+                rows = self._connection.execute("SELECT * FROM uploads ORDER BY id").fetchall()
+            else:
+                rows = self._connection.execute(
+                    "SELECT * FROM uploads WHERE status = ? ORDER BY id", (status,)).fetchall()
+        return [dict(row) for row in rows]
+
+    def counts(self):
+        """
+        Count the entries of each status
+
+        Returns:
+            dict: Mapping of status to number of entries
+        """
+        with self._lock:
+            rows = self._connection.execute("SELECT status, COUNT(*) FROM uploads GROUP BY status").fetchall()
+        counts = {PENDING: 0, UPLOADED: 0, FAILED: 0}
+        counts.update({status: count for status, count in rows})
+        return counts
+
+
+class SpooledUploader:
+    """
+    Uploads files through an UploadSpool, retrying failures with exponential backoff
+
+    upload_document has the same signature as LucidApiClient.upload_document, so
+    it can stand in for the client (e.g. in DiagramPipeline): the file is spooled
+    and tried once right away, and if that fails it stays in the spool for
+    drain(), or for a later run with --resume-uploads.
+    """
+
+    def __init__(self, spool, client, max_attempts=5, base_delay=2.0, max_delay=300.0):
+        """
+        Initialize the uploader
+
+        Args:
+            spool (UploadSpool): The spool recording the uploads
+            client (LucidApiClient): Client used to upload the files
+            max_attempts (int): Attempts after which an entry is given up on
+            base_delay (float): Backoff before the second attempt, in seconds; doubles on every failure
+            max_delay (float): Maximum backoff in seconds
+        """
+        self.spool = spool
+        self.client = client
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def upload_document(self, lucid_file, title, filename=None):
+        """
+        Spool a file and try to upload it once
+
+        Archives that only exist in memory cannot be spooled, so they are
+        uploaded directly.
+
+        Args:
+            lucid_file (str, bytes or file-like): Path to the .lucid file, or the archive in memory
+            title (str): Title for the document
+            filename (str): File name sent with the archive
+
+        Returns:
+            dict: The upload result; for a file uploaded before with the same
+                contents, the result recorded then
+        """
+        if not isinstance(lucid_file, (str, os.PathLike)):
+            return self.client.upload_document(lucid_file, title, filename)
+
+        entry = self.spool.enqueue(lucid_file, title)
+        if entry["status"] == UPLOADED:
+            print(f"Skipping upload of {lucid_file}: unchanged since it was uploaded")
+            return {"message": "Document already uploaded", "document_url": entry["document_url"]}
+        return self.attempt(entry)
+
+    def attempt(self, entry):
+        """
+        Try to upload a spool entry once, recording the outcome
+
+        Args:
+            entry (dict): The spool entry
+
+        Returns:
+            dict: The upload result
+        """
+        try:
+            # Upload the file as it is now, which may differ from when it was spooled
+            archive_hash = content_hash(entry["file_path"])
+        except OSError as e:
+            self.spool.mark_failed(entry["id"], f"Cannot read {entry['file_path']}: {str(e)}")
+            raise
+
+        try:
+            result = self.client.upload_document(entry["file_path"], entry["title"])
+        except Exception as e:
+            attempts = entry["attempts"] + 1
+            retry_at = None
+            if attempts < self.max_attempts:
+                # Exponential backoff with jitter, so retries of a batch do not arrive together
+                delay = min(self.max_delay, self.base_delay * 2 ** (attempts - 1)) * random.uniform(0.5, 1.0)
+                # Never retry before the API's Retry-After has passed
+                retry_at = time.time() + max(delay, getattr(e, "retry_after", None) or 0.0)
+            self.spool.mark_failed(entry["id"], str(e), retry_at)
+            raise
+
+        self.spool.mark_uploaded(entry["id"], archive_hash, result.get("document_url"))
+        return result
+
+    def drain(self, file_paths=None, deadline=None):
+        """
+        Upload every pending entry, waiting out the backoff between attempts
+
+        Args:
+            file_paths (set): Only upload entries for these absolute paths, or None for all pending entries
+            deadline (float): Stop waiting for retries after this time.time() value, or None to wait
+
+        Returns:
+            dict: Mapping of status to number of entries once the spool is drained
+        """
+        while True:
+            pending = [entry for entry in self.spool.entries(PENDING)
+                       if file_paths is None or entry["file_path"] in file_paths]
+            if not pending:
+                break
+
+            now = time.time()
+            due = [entry for entry in pending if entry["next_attempt_at"] <= now]
+            if not due:
+                next_attempt_at = min(entry["next_attempt_at"] for entry in pending)
+                if deadline is not None and next_attempt_at > deadline:
+                    break
+                time.sleep(next_attempt_at - now)
+                continue
+
+            for entry in due:
+                try:
+                    result = self.attempt(entry)
+                    print(f"Uploaded {entry['file_path']}: {result.get('document_url')}")
+                except Exception as e:
+                    print(f"Upload of {entry['file_path']} failed (attempt {entry['attempts'] + 1} "
+                          f"of {self.max_attempts}): {str(e)}")
+
+        return self.spool.counts()